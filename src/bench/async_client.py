@@ -0,0 +1,140 @@
+"""
+Um único processo cliente: REQ síncrono (um pedido por vez) x
+AsyncClient (DEALER com id por pedido) com janelas de tamanhos variados.
+
+Mede pedidos/s e latência de publish com o servidor em modo dealer, e
+confere que um pedido sem resposta vira TimeoutError em vez de travar e
+que só os serviços idempotentes são reenviados (código 1 se um publish
+sair duas vezes).
+--flush-ms simula um disco com fsync (cada lote do group commit espera
+T ms): o REQ fica preso nessa espera, a janela a preenche com outros
+pedidos. Sem ela, numa máquina de um núcleo a CPU já é o limite.
+
+Uso:
+    python bench/async_client.py [--requests 10000] [--windows 1,16,64]
+                                 [--flush-ms 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client"))
+
+from async_client import AsyncClient  # noqa: E402
+from common import LocalCluster, free_port, latency_summary  # noqa: E402
+
+
+def publish(i: int) -> dict:
+    return {"user": "bench", "channel": "general", "message": f"msg {i}"}
+
+
+def run_req(endpoint: str, total: int) -> dict:
+    ctx = zmq.Context()
+    req = ctx.socket(zmq.REQ)
+    req.connect(endpoint)
+    lat = []
+    t0 = time.perf_counter()
+    for i in range(total):
+        t = time.perf_counter()
+        req.send(msgpack.packb({"service": "publish", "data": publish(i)}, use_bin_type=True))
+        req.recv()
+        lat.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t0
+    ctx.destroy(linger=0)
+    out = {"client": "req", "window": 1, "throughput": round(total / elapsed, 1), "errors": 0}
+    out.update(latency_summary(lat))
+    return out
+
+
+async def run_async(endpoint: str, total: int, window: int) -> dict:
+    client = AsyncClient(endpoint, window=window, ctx=zmq.asyncio.Context())
+    lat = []
+    errors = 0
+
+    async def loop(first):
+        # malha fechada: `window` corrotinas, cada uma com um pedido em voo
+        nonlocal errors
+        for i in range(first, total, window):
+            t = time.perf_counter()
+            reply = await client.request("publish", publish(i))
+            lat.append(time.perf_counter() - t)
+            if reply["data"].get("status") != "OK":
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(loop(k) for k in range(window)))
+    elapsed = time.perf_counter() - t0
+    await client.close()
+    out = {"client": "async", "window": window,
+           "throughput": round(total / elapsed, 1), "errors": errors}
+    out.update(latency_summary(lat))
+    return out
+
+
+async def lost_reply() -> dict:
+    """Pedido para um endereço sem ninguém: deve falhar no prazo."""
+    client = AsyncClient(f"tcp://127.0.0.1:{free_port()}", timeout_ms=200, retries=1,
+                         ctx=zmq.asyncio.Context())
+    t0 = time.perf_counter()
+    try:
+        await client.request("list_channels", {})
+        result = "respondeu"
+    except TimeoutError:
+        result = "TimeoutError"
+    await client.close()
+    return {"check": "lost_reply", "result": result,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+
+async def resends() -> dict:
+    """Servidor mudo: list_channels é reenviado, publish sai uma vez só."""
+    ctx = zmq.asyncio.Context()
+    addr = f"tcp://127.0.0.1:{free_port()}"
+    router = ctx.socket(zmq.ROUTER)
+    router.setsockopt(zmq.LINGER, 0)
+    router.bind(addr)
+    client = AsyncClient(addr, timeout_ms=200, retries=1, ctx=ctx)
+    counts = {}
+    for service in ("list_channels", "publish"):
+        try:
+            await client.request(service, {})
+        except TimeoutError:
+            pass
+        while await router.poll(0):
+            await router.recv_multipart()
+            counts[service] = counts.get(service, 0) + 1
+    await client.close()
+    router.close()
+    ok = counts == {"list_channels": 2, "publish": 1}
+    return {"check": "resends", "sent": counts, "ok": ok}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--windows", default="1,16,64")
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--flush-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": "0", "LOG_FLUSH_MS": str(args.flush_ms)}
+    with LocalCluster(servers=args.servers, server_env=env) as cluster:
+        print(json.dumps(run_req(cluster.router, args.requests)))
+        for window in (int(w) for w in args.windows.split(",")):
+            print(json.dumps(asyncio.run(run_async(cluster.router, args.requests, window))))
+    print(json.dumps(asyncio.run(lost_reply())))
+    check = asyncio.run(resends())
+    print(json.dumps(check))
+    sys.exit(0 if check["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Broker round-robin (BROKER_MODE=proxy) x balanceamento por carga
+(BROKER_MODE=lb), com um dos servidores lento.
+
+O servidor lento espera --slow-flush-ms em cada lote do group commit,
+simulando um disco travado: no round-robin ele continua recebendo um
+terço dos pedidos e define a cauda de latência; no modo lb o broker
+manda os pedidos para quem deve responder antes. Numa máquina com um
+só núcleo, concorrência alta satura a CPU e esconde o servidor lento.
+
+Uso:
+    python bench/broker_lb.py [--requests 10000] [--concurrency 4]
+                              [--slow-flush-ms 30] [--affinity]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def run(broker: str, args) -> dict:
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": "0"}
+    slow = [{"LOG_FLUSH_MS": str(args.slow_flush_ms)}]
+    with LocalCluster(servers=args.servers, server_env=env, server_envs=slow,
+                      broker=broker, affinity=args.affinity) as cluster:
+        def make_request(i):
+            return {
+                "service": "publish",
+                "data": {"user": "bench", "channel": "general", "message": f"msg {i}"},
+            }
+
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, args.requests,
+        )
+
+    out = {
+        "broker": broker,
+        "servers": args.servers,
+        "throughput": round(args.requests / elapsed, 1),
+        "errors": errors,
+    }
+    out.update(latency_summary(lat))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--slow-flush-ms", type=float, default=30.0)
+    parser.add_argument("--affinity", action="store_true")
+    args = parser.parse_args()
+
+    for broker in ("proxy", "lb"):
+        print(json.dumps(run(broker, args)))
+
+
+if __name__ == "__main__":
+    main()
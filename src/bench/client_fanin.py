@@ -0,0 +1,160 @@
+"""
+SUB do cliente com canais movimentados: uma mensagem por vez x FanIn.
+
+Um PUB numa thread publica --messages mensagens (payloads como os do
+servidor) em --channels canais o mais rápido que consegue. Do outro
+lado:
+
+  - subscriber: como o Subscriber, um recv por mensagem no loop
+    asyncio, unpackb e print de cada uma (para /dev/null);
+  - fanin: client/fanin.py, lotes com NOBLOCK numa thread, entrega em
+    outra, só contando por tópico (sem decodificar nem imprimir).
+
+Os dois com a mesma RCVHWM: o que não cabe na fila é descartado pelo
+PUB, então "received" abaixo de "sent" é perda.
+
+Uso:
+    python bench/client_fanin.py [--messages 200000] [--channels 20]
+                                 [--rcvhwm 10000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "client"))
+
+from common import free_port  # noqa: E402
+from fanin import FanIn, peek_clock  # noqa: E402
+
+IDLE_S = 1.0                 # sem mensagens por esse tempo = fim
+
+
+def publisher(endpoint: str, total: int, channels: list, ready: threading.Event) -> None:
+    ctx = zmq.Context.instance()
+    pub = ctx.socket(zmq.PUB)
+    pub.setsockopt(zmq.LINGER, 0)
+    pub.bind(endpoint)
+    ready.wait()
+    time.sleep(0.3)          # assinaturas chegam ao PUB
+    for clock in range(1, total + 1):
+        ch = channels[clock % len(channels)]
+        pub.send_multipart([ch.encode(), msgpack.packb({
+            "type": "publish", "origin": "bench", "channel": ch, "user": "bench",
+            "message": f"mensagem {clock}", "timestamp": "2024-01-01T00:00:00.000000Z",
+            "clock": clock})])
+    pub.close()
+
+
+def result(received: int, sent: int, first: float, last: float, max_clock: int) -> dict:
+    span = max(1e-9, last - first)
+    return {"received": received, "sent": sent, "lost": sent - received,
+            "msgs_per_s": round(received / span), "max_clock": max_clock}
+
+
+def run_subscriber(total: int, channels: list, rcvhwm: int) -> dict:
+    endpoint = f"tcp://127.0.0.1:{free_port()}"
+    ready = threading.Event()
+    pub = threading.Thread(target=publisher, args=(endpoint, total, channels, ready), daemon=True)
+    pub.start()
+
+    async def consume():
+        ctx = zmq.asyncio.Context()
+        sub = ctx.socket(zmq.SUB)
+        sub.setsockopt(zmq.RCVHWM, rcvhwm)
+        sub.setsockopt(zmq.LINGER, 0)
+        time.sleep(0.1)
+        sub.connect(endpoint)
+        for ch in channels:
+            sub.setsockopt_string(zmq.SUBSCRIBE, ch)
+        ready.set()
+        received, max_clock, first, last = 0, 0, None, None
+        with open(os.devnull, "w") as out:
+            while True:
+                try:
+                    frames = await asyncio.wait_for(sub.recv_multipart(), IDLE_S)
+                except asyncio.TimeoutError:
+                    break
+                payload = msgpack.unpackb(frames[1], raw=False)
+                max_clock = max(max_clock, int(payload.get("clock") or 0))
+                print(f"[bench] <- ({frames[0].decode()}) {payload}", file=out)
+                last = time.perf_counter()
+                first = first or last
+                received += 1
+        sub.close()
+        return result(received, total, first or 0, last or 0, max_clock)
+
+    out = asyncio.run(consume())
+    pub.join()
+    return out
+
+
+def run_fanin(total: int, channels: list, rcvhwm: int) -> dict:
+    endpoint = f"tcp://127.0.0.1:{free_port()}"
+    ready = threading.Event()
+    pub = threading.Thread(target=publisher, args=(endpoint, total, channels, ready), daemon=True)
+    pub.start()
+
+    clock = [0]
+    counts = {}
+    stamps = []
+
+    def observe(c):
+        clock[0] = max(clock[0], c)
+
+    def count(messages):
+        counts[messages[0].topic] = counts.get(messages[0].topic, 0) + len(messages)
+        stamps.append(time.perf_counter())
+
+    time.sleep(0.1)
+    fan = FanIn(zmq.Context.instance(), endpoint, observe=observe, rcvhwm=rcvhwm)
+    fan.on("*", count)
+    for ch in channels:
+        fan.subscribe(ch)
+    fan.start()
+    ready.set()
+
+    seen = -1
+    while seen != fan.received or not stamps:
+        seen = fan.received
+        time.sleep(IDLE_S)
+    fan.stop()
+    pub.join()
+    assert sum(counts.values()) == fan.received
+    out = result(fan.received, total, stamps[0], stamps[-1], clock[0])
+    out["batches"] = fan.batches
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--rcvhwm", type=int, default=10000)
+    args = parser.parse_args()
+
+    channels = ["general", "random", "dev"] + [f"canal-{i}" for i in range(max(0, args.channels - 3))]
+    # sanidade do clock lido dos bytes
+    assert peek_clock(msgpack.packb({"message": "x", "clock": 70000})) == 70000
+
+    out = {
+        "messages": args.messages,
+        "channels": len(channels),
+        "rcvhwm": args.rcvhwm,
+        "subscriber": run_subscriber(args.messages, channels, args.rcvhwm),
+        "fanin": run_fanin(args.messages, channels, args.rcvhwm),
+    }
+    out["speedup"] = round(out["fanin"]["msgs_per_s"] / max(1, out["subscriber"]["msgs_per_s"]), 1)
+    print(json.dumps(out))
+
+
+if __name__ == "__main__":
+    main()
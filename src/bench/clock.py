@@ -0,0 +1,93 @@
+"""
+Custo por mensagem do relógio lógico (common/clock.py) e conferência
+das garantias com várias threads.
+
+Para cada modo (lamport, hlc) mede ns por tick, observe e tick_many(10)
+numa thread só, e o tick com --threads threads disputando o mesmo
+relógio. Em seguida confere, com as threads, que nenhum valor se repetiu
+e que os valores de cada thread são estritamente crescentes (o que o
+servidor precisa ao atender em vários workers e aplicar réplicas em
+paralelo). "baseline" é um int global sem lock, o custo mínimo possível.
+
+Uso:
+    python bench/clock.py [--ops 1000000] [--threads 4]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+
+from clock import make_clock  # noqa: E402
+
+_value = 0
+
+
+def _baseline_tick() -> int:
+    global _value
+    _value += 1
+    return _value
+
+
+def per_op_ns(fn, ops: int, *args) -> float:
+    t0 = time.perf_counter_ns()
+    for _ in range(ops):
+        fn(*args)
+    return (time.perf_counter_ns() - t0) / ops
+
+
+def contended(clock, threads: int, ops: int) -> tuple:
+    """Cada thread faz ops ticks; devolve (ns por op, valores por thread)."""
+    values = [[] for _ in range(threads)]
+    start = threading.Barrier(threads + 1)
+
+    def run(out):
+        tick = clock.tick
+        append = out.append
+        start.wait()
+        for _ in range(ops):
+            append(tick())
+
+    pool = [threading.Thread(target=run, args=(values[i],)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter_ns()
+    for t in pool:
+        t.join()
+    return (time.perf_counter_ns() - t0) / (threads * ops), values
+
+
+def check(values: list) -> dict:
+    flat = [v for vs in values for v in vs]
+    increasing = all(all(a < b for a, b in zip(vs, vs[1:])) for vs in values)
+    return {"unique": len(set(flat)) == len(flat), "per_thread_increasing": increasing}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=1000000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    print(json.dumps({"mode": "baseline", "tick_ns": round(per_op_ns(_baseline_tick, args.ops), 1)}))
+    for mode in ("lamport", "hlc"):
+        clock = make_clock(mode)
+        out = {
+            "mode": mode,
+            "tick_ns": round(per_op_ns(clock.tick, args.ops), 1),
+            "observe_ns": round(per_op_ns(clock.observe, args.ops, 12345), 1),
+            "tick_many_10_ns": round(per_op_ns(clock.tick_many, args.ops, 10), 1),
+        }
+        ns, values = contended(clock, args.threads, args.ops // args.threads)
+        out["contended_tick_ns"] = round(ns, 1)
+        out["threads"] = args.threads
+        out.update(check(values))
+        print(json.dumps(out))
+
+
+if __name__ == "__main__":
+    main()
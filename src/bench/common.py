@@ -0,0 +1,509 @@
+"""
+Utilitários compartilhados pelos benchmarks.
+
+Sobe o ref e os servidores Python como subprocessos e substitui o broker
+(Node.js) e o proxy (Go) por equivalentes locais em threads, usando
+zmq.proxy com os mesmos tipos de socket. Nada de Docker.
+"""
+import hashlib
+import itertools
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import zmq
+import msgpack
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, p: float) -> float:
+    """Percentil simples (nearest-rank) sobre uma lista de números."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))
+    return ordered[k]
+
+
+def latency_summary(lat_s) -> dict:
+    """Resumo de latências (em segundos) convertido para milissegundos."""
+    return {
+        "p50_ms": round(percentile(lat_s, 50) * 1000, 3),
+        "p99_ms": round(percentile(lat_s, 99) * 1000, 3),
+        "p999_ms": round(percentile(lat_s, 99.9) * 1000, 3),
+        "max_ms": round(max(lat_s) * 1000, 3) if lat_s else 0.0,
+    }
+
+
+def _proxy_thread(ctx, front_type, front_addr, back_type, back_addr):
+    front = ctx.socket(front_type)
+    front.bind(front_addr)
+    back = ctx.socket(back_type)
+    back.bind(back_addr)
+
+    def run():
+        try:
+            zmq.proxy(front, back)
+        except zmq.ZMQError:
+            # contexto destruído no stop()
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _delay_thread(ctx, front_addr, back_addr, delay_s: float):
+    """
+    Relay ROUTER/DEALER na frente do ref que atrasa cada resposta,
+    simulando a latência de rede de um ref em outra máquina.
+    """
+    front = ctx.socket(zmq.ROUTER)
+    front.bind(front_addr)
+    back = ctx.socket(zmq.DEALER)
+    back.connect(back_addr)
+
+    def run():
+        poller = zmq.Poller()
+        poller.register(front, zmq.POLLIN)
+        poller.register(back, zmq.POLLIN)
+        try:
+            while True:
+                for sock, _ in poller.poll():
+                    frames = sock.recv_multipart()
+                    if sock is front:
+                        back.send_multipart(frames)
+                    else:
+                        time.sleep(delay_s)
+                        front.send_multipart(frames)
+        except zmq.ZMQError:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+def _request_key(body: bytes):
+    try:
+        req = msgpack.unpackb(body, raw=False)
+        data = req.get("data") or {}
+    except Exception:
+        return None
+    if req.get("service") in ("publish", "publish_batch", "history"):
+        return data.get("channel")
+    if req.get("service") == "message":
+        return data.get("dst")
+    if req.get("service") == "replay":
+        return data.get("channel") or data.get("user")
+    if req.get("service") in ("inbox_fetch", "inbox_ack"):
+        return data.get("user")
+    return None
+
+
+def _envelope(frames) -> tuple:
+    """Identidade + id de requisição (tudo antes do frame vazio)."""
+    return tuple(itertools.takewhile(lambda f: f != b"", frames))
+
+
+def _error_reply(frames, message: str) -> list:
+    """Resposta de erro do broker com o envelope do pedido (como no main.js)."""
+    service = None
+    try:
+        req = msgpack.unpackb(frames[-1], raw=False)
+        if isinstance(req.get("service"), str):
+            service = req["service"]
+    except Exception:
+        pass
+    envelope = list(_envelope(frames))
+    return envelope + [b"", msgpack.packb({"service": service, "data": {
+        "status": "erro", "message": message,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}})]
+
+
+class _LbWorker:
+    __slots__ = ("outstanding", "capacity", "seen", "ewma", "sent")
+
+    def __init__(self):
+        self.outstanding = 0
+        self.capacity = 1
+        self.seen = 0.0
+        self.ewma = 0.0          # latência média das respostas (ms)
+        self.sent = {}           # envelope -> (instante do envio, frames do pedido)
+
+    def cost(self) -> float:
+        return (self.outstanding + 1) * max(self.ewma, 0.1)
+
+
+def _lb_thread(ctx, front_addr, back_addr, affinity: bool = False,
+               slack: float = 2.0, timeout_s: float = 3.0, alpha: float = 0.2,
+               queue_max: int = 10000):
+    """
+    Equivalente ao broker/main.js com BROKER_MODE=lb: ROUTER nos dois
+    lados, servidores se anunciam com ["", "READY", capacidade] e cada
+    pedido vai ao servidor com menor (em aberto + 1) x latência média,
+    com afinidade opcional (só aderência) por canal/destinatário. Fila
+    cheia ou servidor expirado respondem erro ao cliente.
+    """
+    front = ctx.socket(zmq.ROUTER)
+    front.bind(front_addr)
+    back = ctx.socket(zmq.ROUTER)
+    back.bind(back_addr)
+
+    workers = {}      # id -> _LbWorker
+    queue = []
+
+    def pick(frames):
+        free = [(w.cost(), wid) for wid, w in workers.items() if w.outstanding < w.capacity]
+        if not free:
+            return None
+        best_cost, best = min(free)
+        if not affinity:
+            return best
+        key = _request_key(frames[-1])
+        if key is None:
+            return best
+        home = max(workers, key=lambda wid: hashlib.md5(
+            str(key).encode("utf-8") + wid.hex().encode("ascii")).digest()[:4])
+        w = workers[home]
+        if w.outstanding < w.capacity and w.cost() <= best_cost * slack:
+            return home
+        return best
+
+    def dispatch(frames) -> bool:
+        wid = pick(frames)
+        if wid is None:
+            return False
+        w = workers[wid]
+        w.outstanding += 1
+        w.sent[_envelope(frames)] = (time.perf_counter(), frames)
+        back.send_multipart([wid] + frames)
+        return True
+
+    def run():
+        poller = zmq.Poller()
+        poller.register(front, zmq.POLLIN)
+        poller.register(back, zmq.POLLIN)
+        try:
+            while True:
+                for sock, _ in poller.poll(int(timeout_s * 500)):
+                    frames = sock.recv_multipart()
+                    if sock is front:
+                        if queue or not dispatch(frames):
+                            if len(queue) >= queue_max:
+                                front.send_multipart(_error_reply(frames, "broker sobrecarregado, tente novamente"))
+                            else:
+                                queue.append(frames)
+                        continue
+                    wid, rest = frames[0], frames[1:]
+                    if rest and rest[0] == b"":
+                        if len(rest) > 1 and rest[1] == b"READY":
+                            w = workers.get(wid) or workers.setdefault(wid, _LbWorker())
+                            w.capacity = max(1, int(rest[2]) if len(rest) > 2 else 1)
+                            w.seen = time.monotonic()
+                    else:
+                        w = workers.get(wid)
+                        entry = w.sent.pop(_envelope(rest), None) if w is not None else None
+                        if entry is not None:
+                            w.ewma += alpha * ((time.perf_counter() - entry[0]) * 1000 - w.ewma)
+                            w.outstanding = max(0, w.outstanding - 1)
+                            w.seen = time.monotonic()
+                            front.send_multipart(rest)
+                        # sem registro: servidor expirado, o cliente já recebeu o erro
+                    while queue and dispatch(queue[0]):
+                        queue.pop(0)
+                now = time.monotonic()
+                for wid in [wid for wid, w in workers.items() if now - w.seen > timeout_s]:
+                    for _, frames in workers.pop(wid).sent.values():
+                        front.send_multipart(_error_reply(
+                            frames, "servidor parou de responder; o pedido pode ou não ter sido processado"))
+                if not workers:
+                    for frames in queue:
+                        front.send_multipart(_error_reply(frames, "nenhum servidor disponível"))
+                    queue.clear()
+        except zmq.ZMQError:
+            pass
+
+    threading.Thread(target=run, daemon=True).start()
+
+
+class LocalCluster:
+    """
+    Cluster local: broker e proxy em threads, ref e N servidores como
+    subprocessos, cada servidor com seu próprio PERSIST_DIR temporário.
+    `broker="lb"` troca o round-robin pelo balanceamento por carga.
+    """
+
+    def __init__(self, servers: int = 1, server_env: dict = None,
+                 ref_delay_ms: float = 0.0, quiet: bool = True,
+                 broker: str = "proxy", affinity: bool = False, server_envs: list = None):
+        self.n_servers = servers
+        self.ref_delay_ms = ref_delay_ms
+        self.server_env = dict(server_env or {})
+        self.server_envs = list(server_envs or [])   # variáveis extras por servidor
+        self.broker = broker
+        self.affinity = affinity
+        self.quiet = quiet
+        self.ctx = zmq.Context()
+        self.procs = []
+        self.labels = {}     # "ref", "server-1", ... -> Popen
+        self.tmp = tempfile.TemporaryDirectory(prefix="bench-")
+
+        self.router = f"tcp://127.0.0.1:{free_port()}"   # clientes REQ
+        self.dealer = f"tcp://127.0.0.1:{free_port()}"   # servidores
+        self.xsub = f"tcp://127.0.0.1:{free_port()}"     # PUB dos servidores
+        self.xpub = f"tcp://127.0.0.1:{free_port()}"     # SUB dos clientes
+        self.ref_port = free_port()
+        self.peer_addrs = [f"tcp://127.0.0.1:{free_port()}" for _ in range(servers)]
+
+    def _spawn(self, script: str, env: dict, label: str) -> subprocess.Popen:
+        full_env = dict(os.environ)
+        full_env.update(env)
+        full_env["PYTHONUNBUFFERED"] = "1"
+        out = subprocess.DEVNULL if self.quiet else None
+        proc = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, script)],
+            env=full_env, stdout=out, stderr=out,
+        )
+        self.procs.append(proc)
+        self.labels[label] = proc
+        return proc
+
+    def server_dir(self, i: int) -> str:
+        return os.path.join(self.tmp.name, f"server-{i}")
+
+    def start(self) -> "LocalCluster":
+        if self.broker == "lb":
+            _lb_thread(self.ctx, self.router, self.dealer, affinity=self.affinity)
+        else:
+            _proxy_thread(self.ctx, zmq.ROUTER, self.router, zmq.DEALER, self.dealer)
+        _proxy_thread(self.ctx, zmq.XSUB, self.xsub, zmq.XPUB, self.xpub)
+
+        ref_bind = f"tcp://127.0.0.1:{self.ref_port}"
+        if self.ref_delay_ms > 0:
+            ref_bind = f"tcp://127.0.0.1:{free_port()}"
+            _delay_thread(self.ctx, f"tcp://127.0.0.1:{self.ref_port}", ref_bind,
+                          self.ref_delay_ms / 1000.0)
+
+        self._spawn("ref/main.py", {
+            "PERSIST_DIR": os.path.join(self.tmp.name, "ref"),
+            "REF_BIND": ref_bind,
+        }, "ref")
+        for i in range(self.n_servers):
+            self._spawn("server/main.py", self._server_env(i), f"server-{i + 1}")
+
+        self.wait_ready()
+        return self
+
+    def _server_env(self, i: int) -> dict:
+        env = {
+            "BROKER_ENDPOINT": self.dealer,
+            "PROXY_XSUB": self.xsub,
+            "PROXY_XPUB": self.xpub,
+            "REF_HOST": "127.0.0.1",
+            "REF_PORT": str(self.ref_port),
+            "PERSIST_DIR": self.server_dir(i),
+            "SERVER_NAME": f"bench-{i + 1}",
+            "PEER_BIND": self.peer_addrs[i],
+            "PEER_ADDR": self.peer_addrs[i],
+            "BROKER_MODE": self.broker,
+        }
+        env.update(self.server_env)
+        if i < len(self.server_envs):
+            env.update(self.server_envs[i] or {})
+        return env
+
+    def kill_server(self, i: int) -> None:
+        """Derruba o servidor i sem aviso (SIGKILL), como uma queda."""
+        proc = self.labels.pop(f"server-{i + 1}")
+        proc.kill()
+        proc.wait()
+        self.procs.remove(proc)
+
+    def start_server(self, i: int) -> None:
+        """Sobe de novo o servidor i, com o mesmo PERSIST_DIR."""
+        self._spawn("server/main.py", self._server_env(i), f"server-{i + 1}")
+
+    def wait_ready(self, timeout: float = 15.0) -> None:
+        """Espera até o cluster responder a um list_channels."""
+        req = self.ctx.socket(zmq.REQ)
+        req.setsockopt(zmq.LINGER, 0)
+        req.connect(self.router)
+        req.send(msgpack.packb({"service": "list_channels", "data": {}}))
+        if not req.poll(int(timeout * 1000)):
+            req.close(0)
+            self.stop()
+            raise RuntimeError("cluster não respondeu a tempo")
+        req.recv()
+        req.close(0)
+        # dá tempo para todos os servidores conectarem ao broker/proxy
+        time.sleep(0.5)
+
+    def stop(self) -> None:
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.procs = []
+        self.labels = {}
+        self.ctx.destroy(linger=0)
+        self.tmp.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def closed_loop(ctx, endpoint: str, make_request, concurrency: int, total: int,
+                on_reply=None):
+    """
+    Carga em malha fechada: `concurrency` sockets REQ, cada um com uma
+    requisição em voo, até completar `total` respostas.
+    Devolve (segundos, latências em segundos, respostas com erro).
+    `on_reply(reply)`, se definido, recebe cada resposta decodificada.
+    """
+    poller = zmq.Poller()
+    socks = []
+    for _ in range(concurrency):
+        s = ctx.socket(zmq.REQ)
+        s.setsockopt(zmq.LINGER, 0)
+        s.connect(endpoint)
+        poller.register(s, zmq.POLLIN)
+        socks.append(s)
+
+    sent_at = {}
+    latencies = []
+    errors = 0
+    sent = 0
+
+    t0 = time.perf_counter()
+    for s in socks:
+        if sent < total:
+            s.send(msgpack.packb(make_request(sent), use_bin_type=True))
+            sent_at[s] = time.perf_counter()
+            sent += 1
+
+    while len(latencies) < total:
+        events = poller.poll(10000)
+        if not events:
+            raise RuntimeError("sem respostas do cluster há 10s")
+        for s, _ in events:
+            reply = msgpack.unpackb(s.recv(), raw=False)
+            latencies.append(time.perf_counter() - sent_at[s])
+            if on_reply is not None:
+                on_reply(reply)
+            if (reply.get("data") or {}).get("status") not in (None, "OK"):
+                errors += 1
+            if sent < total:
+                s.send(msgpack.packb(make_request(sent), use_bin_type=True))
+                sent_at[s] = time.perf_counter()
+                sent += 1
+    elapsed = time.perf_counter() - t0
+
+    for s in socks:
+        s.close(0)
+    return elapsed, latencies, errors
+
+
+def open_loop(ctx, endpoint: str, make_request, rate: float, total: int, on_reply=None):
+    """
+    Carga em malha aberta: `total` requisições a `rate` por segundo em
+    horários fixos, por um DEALER com id por pedido, sem esperar as
+    respostas. A latência conta a partir do horário previsto de envio
+    (um servidor lento não "freia" a carga nem esconde a fila).
+    Devolve (segundos, latências em segundos, respostas com erro).
+    """
+    sock = ctx.socket(zmq.DEALER)
+    sock.setsockopt(zmq.LINGER, 0)
+    sock.connect(endpoint)
+    interval = 1.0 / rate
+    due = {}
+    latencies = []
+    errors = 0
+    sent = 0
+
+    t0 = time.perf_counter()
+    last_progress = t0
+    while len(latencies) < total:
+        now = time.perf_counter()
+        while sent < total and t0 + sent * interval <= now:
+            body = msgpack.packb(make_request(sent), use_bin_type=True)
+            sock.send_multipart([sent.to_bytes(8, "big"), b"", body])
+            due[sent] = t0 + sent * interval
+            sent += 1
+
+        wait = t0 + sent * interval - time.perf_counter() if sent < total else 0.05
+        # arredonda para cima: poll(0) em laço roubaria CPU dos servidores
+        if sock.poll(max(0, math.ceil(wait * 1000))):
+            while True:
+                try:
+                    frames = sock.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                now = time.perf_counter()
+                latencies.append(now - due.pop(int.from_bytes(frames[0], "big")))
+                reply = msgpack.unpackb(frames[2], raw=False)
+                if (reply.get("data") or {}).get("status") not in (None, "OK"):
+                    errors += 1
+                if on_reply is not None:
+                    on_reply(reply)
+                last_progress = now
+        if time.perf_counter() - last_progress > 10:
+            raise RuntimeError(f"sem respostas do cluster há 10s ({len(due)} em aberto)")
+    elapsed = time.perf_counter() - t0
+    sock.close(0)
+    return elapsed, latencies, errors
+
+
+# ---------------------------
+# CPU e memória por processo (/proc, só Linux)
+# ---------------------------
+
+_TICK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def proc_sample(pid: int) -> dict:
+    """CPU acumulada (s) e memória (MiB) de um processo; {} se não der para ler."""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status", "r") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    kib = lambda key: int(status.get(key, "0 kB").split()[0])  # noqa: E731
+    return {
+        "cpu_s": (int(fields[11]) + int(fields[12])) / _TICK,   # utime + stime
+        "rss_mb": round(kib("VmRSS") / 1024, 1),
+        "peak_rss_mb": round(kib("VmHWM") / 1024, 1),
+    }
+
+
+def proc_usage(before: dict, after: dict, elapsed: float) -> dict:
+    """Uso de CPU/memória de cada processo entre duas amostras {nome: proc_sample}."""
+    out = {}
+    for name, end in after.items():
+        start = before.get(name) or {}
+        if not end:
+            continue
+        cpu = end["cpu_s"] - start.get("cpu_s", 0.0)
+        out[name] = {
+            "cpu_s": round(cpu, 3),
+            "cpu_pct": round(100 * cpu / elapsed, 1) if elapsed > 0 else 0.0,
+            "rss_mb": end["rss_mb"],
+            "peak_rss_mb": end["peak_rss_mb"],
+        }
+    return out
@@ -0,0 +1,108 @@
+"""
+"Últimas N mensagens do canal": cache quente x log.
+
+Gera um log de publicações em --channels canais (os 3 padrão recebem a
+maior parte, como general/random/dev) e mede o history com "last": N de
+um canal popular, incluindo a codificação da resposta:
+
+  - log: fim do log lido a cada pedido (SegmentStore.tail), registros
+    decodificados e a resposta recodificada (o caminho antigo);
+  - log + splice: mesma leitura, registros emendados na resposta;
+  - cache: anel em memória (server/hot_cache.py) + splice.
+
+Uso:
+    python bench/hot_cache.py [--records 200000] [--channels 50] [--last 50]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+import msgpack  # noqa: E402
+
+from common import percentile  # noqa: E402
+from hot_cache import HotCache  # noqa: E402
+from log_writer import LogWriter  # noqa: E402
+from store import SegmentStore  # noqa: E402
+from wire import packb, splice  # noqa: E402
+
+POPULAR = ["general", "random", "dev"]
+
+
+def timed(fn, rounds: int) -> dict:
+    lat = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t0)
+    return {"p50_us": round(percentile(lat, 50) * 1e6, 1), "p99_us": round(percentile(lat, 99) * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--last", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    channels = POPULAR + [f"canal-{i}" for i in range(args.channels - len(POPULAR))]
+    with tempfile.TemporaryDirectory(prefix="bench-") as d:
+        writer = LogWriter(batch_max=4096)
+        store = SegmentStore(d, writer, segment_bytes=16 * 1024 * 1024)
+        cache = HotCache(store)
+        store.on_append = cache.add
+
+        batch, futs = [], []
+        for clock in range(1, args.records + 1):
+            ch = rnd.choice(POPULAR) if rnd.random() < 0.3 else rnd.choice(channels)
+            batch.append((ch, clock, packb({
+                "type": "publish", "origin": "bench", "channel": ch, "user": "bench",
+                "message": f"mensagem {clock}", "timestamp": "2024-01-01T00:00:00.000000Z", "clock": clock})))
+            if len(batch) == 512:
+                futs.append(store.append_many(batch))
+                batch = []
+        if batch:
+            futs.append(store.append_many(batch))
+        for fut in futs:
+            fut.result()
+
+        header = {"status": "OK", "channel": "general", "last_clock": 0, "more": False,
+                  "timestamp": "2024-01-01T00:00:00.000000Z", "clock": 0}
+
+        def from_log():
+            views = store.tail("general", args.last)[0]
+            data = dict(header, messages=[msgpack.unpackb(v, raw=False) for v in views])
+            return packb({"service": "history", "data": data})
+
+        def from_log_splice():
+            return splice("history", header, "messages", store.tail("general", args.last)[0]).raw
+
+        def from_cache():
+            return splice("history", header, "messages", cache.read("general", 0, args.last, True)).raw
+
+        assert from_log() == from_cache()
+        out = {
+            "records": args.records,
+            "channels": args.channels,
+            "last": args.last,
+            "log": timed(from_log, args.rounds),
+            "log_splice": timed(from_log_splice, args.rounds),
+            "cache": timed(from_cache, args.rounds),
+            "cache_bytes": cache.nbytes,
+        }
+        out["speedup"] = round(out["log"]["p50_us"] / max(0.1, out["cache"]["p50_us"]), 1)
+        print(json.dumps(out))
+        store.close()
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
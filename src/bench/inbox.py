@@ -0,0 +1,102 @@
+"""
+Não lidas de um usuário: caixa de entrada (inbox_fetch) x índice esparso
+do store (o caminho do replay por usuário).
+
+Gera um log de mensagens diretas para --users destinatários, misturados
+como chegam de verdade, e mede quanto custa buscar as --unread mensagens
+mais recentes de um usuário, que estão espalhadas pelo fim do log. O
+índice esparso acha o ponto de partida, mas a leitura passa pelos
+registros de todos os outros usuários até lá; a caixa de entrada lê só
+as posições do próprio usuário.
+
+Uso:
+    python bench/inbox.py [--records 300000] [--users 2000] [--unread 50]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+import msgpack  # noqa: E402
+
+from common import percentile  # noqa: E402
+from inbox import InboxIndex  # noqa: E402
+from log_writer import LogWriter  # noqa: E402
+from store import SegmentStore  # noqa: E402
+
+
+def timed(fn, rounds: int) -> dict:
+    lat = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn()
+        lat.append(time.perf_counter() - t0)
+    return {"p50_ms": round(percentile(lat, 50) * 1000, 3), "p99_ms": round(percentile(lat, 99) * 1000, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=300000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--unread", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    users = [f"user{i}" for i in range(args.users)]
+    with tempfile.TemporaryDirectory(prefix="bench-") as d:
+        writer = LogWriter(batch_max=4096)
+        store = SegmentStore(os.path.join(d, "messages"), writer, segment_bytes=16 * 1024 * 1024)
+        inbox = InboxIndex(os.path.join(d, "inbox"), store, writer).open()
+
+        t0 = time.perf_counter()
+        batch, futs = [], []
+        for clock in range(1, args.records + 1):
+            dst = rnd.choice(users)
+            batch.append((dst, clock, msgpack.packb({
+                "type": "message", "src": "bench", "dst": dst, "message": f"msg {clock}", "clock": clock})))
+            if len(batch) == 512:
+                futs.append(store.append_many(batch))
+                batch = []
+        if batch:
+            futs.append(store.append_many(batch))
+        for fut in futs:
+            fut.result()
+        inbox.flush()
+        build_s = time.perf_counter() - t0
+
+        # usuário com mensagens espalhadas: confirma tudo menos as últimas --unread
+        user = users[0]
+        clocks = inbox.fetch(user, 10 ** 9)["clocks"]
+        acked = clocks[-args.unread - 1] if len(clocks) > args.unread else 0
+        inbox.ack(user, acked).result()
+
+        page = inbox.fetch(user, args.unread)
+        views = store.read_views(user, acked, args.unread)
+        assert [bytes(v) for v in page["messages"]] == [bytes(v) for v in views]
+
+        out = {
+            "records": args.records,
+            "users": args.users,
+            "unread": len(page["messages"]),
+            "log_span": args.records - acked,
+            "build_s": round(build_s, 2),
+            "inbox_fetch": timed(lambda: inbox.fetch(user, args.unread), args.rounds),
+            "sparse_index_scan": timed(lambda: store.read_views(user, acked, args.unread), args.rounds),
+        }
+        # sem cache: o array do usuário sai do disco
+        out["inbox_fetch_cold"] = timed(lambda: (inbox._cache.clear(), inbox.fetch(user, args.unread)), args.rounds)
+        out["speedup"] = round(out["sparse_index_scan"]["p50_ms"] / max(1e-6, out["inbox_fetch"]["p50_ms"]), 1)
+        print(json.dumps(out))
+        store.close()
+        writer.close()
+
+
+if __name__ == "__main__":
+    main()
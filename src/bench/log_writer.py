@@ -0,0 +1,106 @@
+"""
+Benchmark da persistência: append() antigo (open/append/close por
+mensagem) x LogWriter com group commit, com e sem fsync.
+
+Cada produtor simula uma requisição em voo: grava um registro e espera
+ele ficar gravado antes de mandar o próximo (malha fechada).
+
+Uso:
+    python bench/log_writer.py [--records 20000] [--producers 16]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from common import latency_summary  # noqa: E402
+from log_writer import LogWriter  # noqa: E402
+
+
+def legacy_append(path: str, obj: dict, fsync: bool = False) -> None:
+    """Cópia do append() original do servidor (com fsync opcional)."""
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def record(i: int) -> dict:
+    return {
+        "type": "publish",
+        "origin": "bench",
+        "channel": "general",
+        "user": "bench",
+        "message": f"mensagem de teste {i}",
+        "timestamp": "2025-01-01T00:00:00Z",
+        "clock": i,
+    }
+
+
+def run(name: str, write_one, records: int, producers: int) -> dict:
+    per_producer = records // producers
+    latencies = [[] for _ in range(producers)]
+
+    def producer(k):
+        lat = latencies[k]
+        base = k * per_producer
+        for i in range(per_producer):
+            t = time.perf_counter()
+            write_one(record(base + i))
+            lat.append(time.perf_counter() - t)
+
+    threads = [threading.Thread(target=producer, args=(k,)) for k in range(producers)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - t0
+
+    all_lat = [x for lat in latencies for x in lat]
+    result = {"name": name, "records": len(all_lat), "msgs_per_sec": round(len(all_lat) / elapsed, 1)}
+    result.update(latency_summary(all_lat))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--producers", type=int, default=16)
+    parser.add_argument("--batch", type=int, default=512)
+    parser.add_argument("--flush-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-log-") as tmp:
+        for fsync in (False, True):
+            suffix = "+fsync" if fsync else ""
+
+            path = os.path.join(tmp, f"legacy{suffix}.jsonl")
+            results.append(run(
+                f"append{suffix}",
+                lambda obj: legacy_append(path, obj, fsync),
+                args.records, args.producers,
+            ))
+
+            writer = LogWriter(batch_max=args.batch, flush_ms=args.flush_ms, fsync=fsync)
+            gpath = os.path.join(tmp, f"group{suffix}.jsonl")
+            results.append(run(
+                f"group_commit{suffix}",
+                lambda obj: writer.append(gpath, obj).result(),
+                args.records, args.producers,
+            ))
+            writer.close()
+
+    print(json.dumps({"producers": args.producers, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
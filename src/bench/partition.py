@@ -0,0 +1,126 @@
+"""
+Particionamento: vazão e volume gravado por servidor, com e sem PARTITION_RF.
+
+Sobe N servidores e envia mensagens diretas para muitos destinatários
+(cada destinatário é uma chave do anel). Sem particionamento todo
+servidor grava 100% do tráfego; com PARTITION_RF=k cada registro é
+gravado em k servidores e o resto é repassado ao dono.
+
+Com particionamento também confere o history raw (cabeçalho + um frame
+por registro) pedido a quem não é dono do canal: a resposta repassada
+precisa chegar inteira e dentro do prazo. Sai com código 1 se não chegar.
+
+Uso:
+    python bench/partition.py --servers 3 --rf 1 --requests 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import msgpack
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def stored_bytes(cluster: LocalCluster, i: int) -> int:
+    """Bytes nos segmentos do store do servidor i."""
+    root = os.path.join(cluster.server_dir(i), "store")
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(dirpath, f))
+                     for f in files if f.endswith(".seg"))
+    return total
+
+
+def check_raw_history(cluster: LocalCluster, servers: int, per_channel: int = 5) -> dict:
+    """
+    Publica em cada canal e pede o history raw várias vezes: o broker
+    reveza os servidores, então parte dos pedidos cai em quem não é dono.
+    """
+    channels = ["general", "random", "dev"]
+    req = cluster.ctx.socket(zmq.REQ)
+    req.setsockopt(zmq.LINGER, 0)
+    req.setsockopt(zmq.RCVTIMEO, 10000)
+    req.connect(cluster.router)
+    for ch in channels:
+        for i in range(per_channel):
+            req.send(msgpack.packb({"service": "publish", "data": {
+                "user": "bench", "channel": ch, "message": f"raw {i}"}}))
+            req.recv()
+
+    errors, lat = 0, []
+    for ch in channels:
+        for _ in range(servers * 2):
+            t0 = time.perf_counter()
+            req.send(msgpack.packb({"service": "history", "data": {"channel": ch, "raw": True}}))
+            frames = req.recv_multipart()
+            lat.append(time.perf_counter() - t0)
+            head = msgpack.unpackb(frames[0], raw=False)["data"]
+            records = [msgpack.unpackb(f, raw=False) for f in frames[1:]]
+            if (head.get("status") != "OK" or head.get("count") != len(records)
+                    or len(records) < per_channel or any(r.get("channel") != ch for r in records)):
+                errors += 1
+    req.close(0)
+    out = {"requests": len(lat), "errors": errors}
+    out.update(latency_summary(lat))
+    return out
+
+
+def run(servers: int, rf: int, args) -> dict:
+    env = {"SERVER_MODE": args.mode, "PARTITION_RF": str(rf), "SNAPSHOT_INTERVAL": "0"}
+
+    def make_request(i):
+        return {"service": "message", "data": {
+            "src": "bench", "dst": f"user{i % args.keys}", "message": "x" * args.size,
+        }}
+
+    with LocalCluster(servers=servers, server_env=env) as cluster:
+        # espera todos os servidores se verem no anel (lista do ref no heartbeat)
+        time.sleep(args.settle)
+        elapsed, lat, errors = closed_loop(cluster.ctx, cluster.router, make_request,
+                                           args.concurrency, args.requests)
+        time.sleep(1.0)  # deixa a replicação assentar antes de medir o disco
+        per_node = [stored_bytes(cluster, i) for i in range(servers)]
+        raw_history = check_raw_history(cluster, servers) if rf > 0 else None
+
+    out = {
+        "servers": servers,
+        "rf": rf,
+        "throughput": round(args.requests / elapsed, 1),
+        "errors": errors,
+        "stored_mb_per_node": [round(b / 1e6, 2) for b in per_node],
+        "stored_mb_total": round(sum(per_node) / 1e6, 2),
+    }
+    if raw_history is not None:
+        out["raw_history"] = raw_history
+    out.update(latency_summary(lat))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--rf", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--mode", default="dealer")
+    parser.add_argument("--settle", type=float, default=6.0)
+    args = parser.parse_args()
+
+    failed = False
+    for rf in (0, args.rf):
+        out = run(args.servers, rf, args)
+        failed = failed or bool(out.get("raw_history", {}).get("errors"))
+        print(json.dumps(out))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
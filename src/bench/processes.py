@@ -0,0 +1,64 @@
+"""
+Vazão de um host com SERVER_PROCESSES = 1, 2, 4... (supervisor + N
+workers, ver server/supervisor.py), com a mesma carga de publish
+espalhada pelos canais padrão.
+
+Com N > 1 cada canal tem um dono entre os workers (PARTITION_RF=1): o
+broker entrega o pedido a qualquer worker e o que não é dono repassa.
+A vazão só cresce com N se o host tiver núcleos livres (o bench mostra
+quantos o sistema tem).
+
+Uso:
+    python bench/processes.py [--processes 1,2,4] [--requests 20000]
+                              [--concurrency 64]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+CHANNELS = ["general", "random", "dev"]
+
+
+def run(processes: int, args) -> dict:
+    env = {"SERVER_MODE": "dealer", "SERVER_PROCESSES": str(processes), "SNAPSHOT_INTERVAL": "0"}
+    with LocalCluster(servers=1, server_env=env) as cluster:
+        def make_request(i):
+            return {"service": "publish", "data": {
+                "user": "bench", "channel": CHANNELS[i % len(CHANNELS)], "message": f"msg {i}"}}
+
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, args.requests)
+
+    out = {
+        "processes": processes,
+        "requests": args.requests,
+        "errors": errors,
+        "msgs_per_sec": round(args.requests / elapsed, 1),
+    }
+    out.update(latency_summary(lat))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", default="1,2,4")
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    base = None
+    for n in [int(p) for p in args.processes.split(",") if p]:
+        out = run(n, args)
+        base = base or out["msgs_per_sec"]
+        out["scaling"] = round(out["msgs_per_sec"] / base, 2)
+        out["cpus"] = os.cpu_count()
+        print(json.dumps(out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+publish (uma requisição por mensagem) x publish_batch (N mensagens por
+requisição): mensagens/s, requisições e latência por requisição.
+
+Uso:
+    python bench/publish_batch.py [--messages 20000] [--batch 10]
+                                  [--servers 2] [--concurrency 4]
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def run(mode: str, args) -> dict:
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": "0"}
+    size = 1 if mode == "publish" else args.batch
+    requests = args.messages // size
+    with LocalCluster(servers=args.servers, server_env=env) as cluster:
+        def make_request(i):
+            if mode == "publish":
+                return {"service": "publish", "data": {
+                    "user": "bench", "channel": "general", "message": f"msg {i}"}}
+            return {"service": "publish_batch", "data": {
+                "user": "bench", "channel": "general",
+                "messages": [{"message": f"msg {i}.{j}"} for j in range(size)]}}
+
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, requests,
+        )
+
+    out = {
+        "mode": mode,
+        "batch": size,
+        "requests": requests,
+        "messages_per_s": round(requests * size / elapsed, 1),
+        "errors": errors,
+    }
+    out.update(latency_summary(lat))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=10)
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    for mode in ("publish", "publish_batch"):
+        print(json.dumps(run(mode, args)))
+
+
+if __name__ == "__main__":
+    main()
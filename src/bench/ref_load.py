@@ -0,0 +1,101 @@
+"""
+Carga no servidor de referência: N servidores simulados (um REQ cada)
+mandando heartbeats, mais pedidos de list completos e incrementais.
+
+Mede heartbeats/s atendidos e o tamanho da resposta do list com e sem
+`since_version`, e quantas vezes o ref_servers.json foi regravado.
+
+Uso:
+    python bench/ref_load.py [--servers 300] [--seconds 5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import SRC, free_port  # noqa: E402
+
+
+def call(sock, service: str, data: dict) -> dict:
+    sock.send_json({"service": service, "data": data})
+    return sock.recv_json()["data"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=300)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory(prefix="bench-ref-")
+    addr = f"tcp://127.0.0.1:{free_port()}"
+    env = dict(os.environ, PERSIST_DIR=tmp.name, REF_BIND=addr, PYTHONUNBUFFERED="1")
+    ref = subprocess.Popen([sys.executable, os.path.join(SRC, "ref/main.py")],
+                           env=env, stdout=subprocess.DEVNULL)
+    ctx = zmq.Context()
+    try:
+        socks = []
+        for i in range(args.servers):
+            s = ctx.socket(zmq.REQ)
+            s.setsockopt(zmq.LINGER, 0)
+            s.connect(addr)
+            call(s, "rank", {"user": f"srv-{i}", "addr": f"tcp://srv-{i}:5570"})
+            socks.append(s)
+
+        path = os.path.join(tmp.name, "ref_servers.json")
+        mtime = os.stat(path).st_mtime_ns
+        writes = 0
+
+        # todos mandam heartbeat ao mesmo tempo, em malha fechada
+        poller = zmq.Poller()
+        for i, s in enumerate(socks):
+            poller.register(s, zmq.POLLIN)
+            s.send_json({"service": "heartbeat", "data": {"user": f"srv-{i}"}})
+        names = {s: f"srv-{i}" for i, s in enumerate(socks)}
+        beats = 0
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < args.seconds:
+            for s, _ in poller.poll(1000):
+                s.recv()
+                beats += 1
+                s.send_json({"service": "heartbeat", "data": {"user": names[s]}})
+            m = os.stat(path).st_mtime_ns
+            if m != mtime:
+                writes += 1
+                mtime = m
+        elapsed = time.perf_counter() - t0
+        waiting = len(socks)
+        while waiting:
+            for s, _ in poller.poll(5000):
+                s.recv()
+                poller.unregister(s)
+                waiting -= 1
+
+        full = call(socks[0], "list", {})
+        call(socks[1], "rank", {"user": "srv-1", "addr": "tcp://srv-1:5571"})
+        delta = call(socks[0], "list", {"since_version": full["version"]})
+
+        print(json.dumps({
+            "servers": args.servers,
+            "heartbeats_per_s": round(beats / elapsed, 1),
+            "file_writes": writes,
+            "list_full_bytes": len(json.dumps(full)),
+            "list_delta_bytes": len(json.dumps(delta)),
+            "delta_entries": len(delta["list"]),
+        }))
+    finally:
+        ctx.destroy(linger=0)
+        ref.terminate()
+        ref.wait()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
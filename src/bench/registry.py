@@ -0,0 +1,110 @@
+"""
+Cadastro de muitos usuários: taxa do register_user, tamanho da resposta,
+paginação com list_users e convergência do registro entre servidores
+(o broker distribui os cadastros; a réplica leva o resto).
+
+No fim o último servidor cai, perde o diretório e volta: com o buffer da
+réplica (--retain) menor que o número de cadastros, só a sincronização
+do registro na partida traz os antigos. Sai com código 1 se ele não
+chegar ao total.
+
+Uso:
+    python bench/registry.py [--users 20000] [--servers 2] [--concurrency 8]
+                             [--retain 1000]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+
+import msgpack
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def call(sock, service: str, data: dict) -> dict:
+    sock.send(msgpack.packb({"service": service, "data": data}))
+    return msgpack.unpackb(sock.recv(), raw=False)["data"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page", type=int, default=1000)
+    parser.add_argument("--retain", type=int, default=1000)
+    args = parser.parse_args()
+
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": "0", "REPL_RETAIN": str(args.retain)}
+    with LocalCluster(servers=args.servers, server_env=env) as cluster:
+        def make_request(i):
+            return {"service": "register_user", "data": {"user": f"user-{i}"}}
+
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, args.users,
+        )
+
+        req = cluster.ctx.socket(zmq.REQ)
+        req.setsockopt(zmq.LINGER, 0)
+        req.connect(cluster.router)
+        last = call(req, "register_user", {"user": "user-0"})
+        reply_bytes = len(msgpack.packb(last))
+
+        # cada servidor precisa ver todos os cadastros (round-robin: um
+        # pedido por servidor a cada rodada)
+        def wait_totals():
+            t0 = time.perf_counter()
+            totals = []
+            while time.perf_counter() - t0 < 10:
+                totals = [call(req, "list_users", {"limit": 1})["total"] for _ in range(args.servers)]
+                if min(totals) >= args.users:
+                    break
+                time.sleep(0.05)
+            return totals, time.perf_counter() - t0
+
+        totals, converge = wait_totals()
+
+        t0 = time.perf_counter()
+        seen, offset, pages = 0, 0, 0
+        while offset is not None:
+            page = call(req, "list_users", {"offset": offset, "limit": args.page})
+            seen += len(page["users"])
+            offset = page["next_offset"]
+            pages += 1
+        paging = time.perf_counter() - t0
+
+        # último servidor volta vazio
+        last_server = args.servers - 1
+        cluster.kill_server(last_server)
+        shutil.rmtree(cluster.server_dir(last_server), ignore_errors=True)
+        cluster.start_server(last_server)
+        cluster.wait_ready()
+        rejoin_totals, rejoin = wait_totals()
+
+    out = {
+        "users": args.users,
+        "servers": args.servers,
+        "register_per_s": round(args.users / elapsed, 1),
+        "errors": errors,
+        "register_reply_bytes": reply_bytes,
+        "totals_per_server": totals,
+        "converge_ms": round(converge * 1000, 1),
+        "list_users_pages": pages,
+        "list_users_seen": seen,
+        "list_users_ms": round(paging * 1000, 1),
+        "rejoin_totals": rejoin_totals,
+        "rejoin_ms": round(rejoin * 1000, 1),
+    }
+    out.update(latency_summary(lat))
+    print(json.dumps(out))
+    sys.exit(0 if min(rejoin_totals) >= args.users else 1)
+
+
+if __name__ == "__main__":
+    main()
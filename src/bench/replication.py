@@ -0,0 +1,106 @@
+"""
+Vazão de aplicação das réplicas x vazão de publicação local.
+
+Com N servidores, cada um aplica as publicações dos outros N-1: a
+réplica precisa andar (N-1)x mais rápido que a publicação local de um
+servidor, senão o atraso só cresce. A carga (publish, espalhado pelos
+servidores pelo broker) roda em malha fechada; depois o bench espera
+cada servidor terminar de aplicar o que recebeu e mede, pelo serviço
+stats de cada um: mensagens/s publicadas, registros/s aplicados na
+réplica, quanto tempo a réplica levou para alcançar depois do fim da
+carga e descartes/reparos no caminho.
+
+Uso:
+    python bench/replication.py [--messages 30000] [--servers 3]
+                                [--concurrency 8] [--batch 1]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import msgpack
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def stats_by_server(ctx, endpoint: str, servers: int) -> dict:
+    """stats de cada servidor (o broker reveza os pedidos entre eles)."""
+    req = ctx.socket(zmq.REQ)
+    req.setsockopt(zmq.LINGER, 0)
+    req.connect(endpoint)
+    out = {}
+    for _ in range(servers * 4):
+        req.send(msgpack.packb({"service": "stats", "data": {}}, use_bin_type=True))
+        data = msgpack.unpackb(req.recv(), raw=False)["data"]
+        out[data["server"]] = data["counters"]
+        if len(out) == servers:
+            break
+    req.close(0)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=30000)
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=1, help="mensagens por publish_batch (1 = publish)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": "0"}
+    size = max(1, args.batch)
+    requests = args.messages // size
+    total = requests * size
+
+    def make_request(i):
+        if size == 1:
+            return {"service": "publish", "data": {
+                "user": "bench", "channel": "general", "message": f"msg {i}"}}
+        return {"service": "publish_batch", "data": {
+            "user": "bench", "channel": "general",
+            "messages": [{"message": f"msg {i}.{j}"} for j in range(size)]}}
+
+    with LocalCluster(servers=args.servers, server_env=env) as cluster:
+        t0 = time.perf_counter()
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, requests)
+        t_load = time.perf_counter()
+
+        # cada servidor aplica tudo o que os outros gravaram
+        while True:
+            stats = stats_by_server(cluster.ctx, cluster.router, args.servers)
+            sent = {name: c.get("replica_records_sent_total", 0) for name, c in stats.items()}
+            behind = {name: sum(sent.values()) - sent[name] - c.get("replica_records_applied_total", 0)
+                      for name, c in stats.items()}
+            if all(b <= 0 for b in behind.values()) or time.perf_counter() - t_load > args.timeout:
+                break
+            time.sleep(0.02)
+        t_caught = time.perf_counter()
+
+    applied = {name: c.get("replica_records_applied_total", 0) for name, c in stats.items()}
+    out = {
+        "servers": args.servers,
+        "batch": size,
+        "messages": total,
+        "publish_msgs_per_s": round(total / elapsed, 1),
+        "publish_msgs_per_s_per_server": round(total / elapsed / args.servers, 1),
+        "replica_applied_per_s_per_server": round(
+            sum(applied.values()) / len(applied) / (t_caught - t0), 1),
+        "replica_catchup_ms": round((t_caught - t_load) * 1000, 1),
+        "replica_behind_at_end": sum(max(0, b) for b in behind.values()),
+        "replica_apply_dropped": sum(c.get("replica_apply_dropped_total", 0) for c in stats.values()),
+        "replica_repairs": sum(c.get("replica_repairs_requested_total", 0) for c in stats.values()),
+        "errors": errors,
+    }
+    out.update(latency_summary(lat))
+    print(json.dumps(out))
+
+
+if __name__ == "__main__":
+    main()
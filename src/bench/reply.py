@@ -0,0 +1,105 @@
+"""
+Custo por requisição da montagem da resposta no servidor, antes e depois
+do caminho rápido (server/wire.py).
+
+"before" é o caminho antigo: datetime.utcnow().isoformat() a cada
+carimbo, dict {"service", "data"} e msgpack.packb (um Packer novo por
+chamada). "after" usa o timestamp em cache (WallClock), o Packer da
+thread (packb) e o prefixo pré-codificado das respostas (ReplyTemplates).
+Mede em ns por operação cada parte (timestamp, payload, resposta OK,
+resposta de erro) e o publish inteiro (carimbo + payload + resposta OK),
+e confere que as respostas decodificam para o mesmo dict e que serviços
+vindos do cliente (lista, dict, nomes desconhecidos) não quebram nem
+enchem o cache (código 1 se algo falhar).
+
+Uso:
+    python bench/reply.py [--ops 200000] [--ts-cache-ms 1]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import msgpack
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from wire import ReplyTemplates, WallClock, packb  # noqa: E402
+
+
+def per_op_ns(fn, ops: int) -> float:
+    t0 = time.perf_counter_ns()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter_ns() - t0) / ops
+
+
+def old_ts() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def old_reply(service, status, message, t, clock) -> bytes:
+    return msgpack.packb({"service": service, "data": {
+        "status": status, "message": message, "timestamp": t, "clock": clock,
+    }}, use_bin_type=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200000)
+    parser.add_argument("--ts-cache-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    wall = WallClock(args.ts_cache_ms / 1000.0)
+    replies = ReplyTemplates(("publish",))
+    t = old_ts()
+    clock = 123456
+    payload = {
+        "type": "publish", "origin": "server-001", "channel": "general", "user": "ana",
+        "message": "olá, mundo", "timestamp": t, "clock": clock,
+    }
+
+    fast = replies.encode("publish", "OK", "", t, clock).raw
+    same = msgpack.unpackb(fast, raw=False) == msgpack.unpackb(old_reply("publish", "OK", "", t, clock), raw=False)
+
+    def old_publish():
+        ts = old_ts()
+        msgpack.packb(dict(payload, timestamp=ts), use_bin_type=True)
+        old_reply("publish", "OK", "", ts, clock)
+
+    def new_publish():
+        ts = wall.now()
+        packb(dict(payload, timestamp=ts))
+        replies.encode("publish", "OK", "", ts, clock)
+
+    cases = {
+        "timestamp": (old_ts, wall.now),
+        "pack_payload": (lambda: msgpack.packb(payload, use_bin_type=True), lambda: packb(payload)),
+        "reply_ok": (lambda: old_reply("publish", "OK", "", t, clock),
+                     lambda: replies.encode("publish", "OK", "", t, clock)),
+        "reply_error": (lambda: old_reply("publish", "erro", "canal inexistente", t, clock),
+                        lambda: replies.encode("publish", "erro", "canal inexistente", t, clock)),
+        "publish_total": (old_publish, new_publish),
+    }
+    for name, (before, after) in cases.items():
+        b, a = per_op_ns(before, args.ops), per_op_ns(after, args.ops)
+        print(json.dumps({"case": name, "before_ns": round(b, 1), "after_ns": round(a, 1),
+                          "speedup": round(b / a, 2)}))
+
+    # serviço/mensagem arbitrários: codificados inteiros, fora do cache
+    cached = len(replies._prefixes)
+    odd = [(["publish"], "erro", "x"), ({"a": 1}, "erro", "x"), ("nao-existe", "erro", "x")]
+    odd += [("publish", "erro", f"requisição inválida: {i}") for i in range(3)]
+    odd_ok = all(
+        msgpack.unpackb(replies.encode(sv, st, msg, t, clock, cache=not msg.startswith("req")).raw,
+                        raw=False) == msgpack.unpackb(old_reply(sv, st, msg, t, clock), raw=False)
+        for sv, st, msg in odd
+    ) and len(replies._prefixes) == cached
+    print(json.dumps({"same_reply": same, "odd_services_ok": odd_ok, "ts_cache_ms": args.ts_cache_ms}))
+    sys.exit(0 if same and odd_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Queda e volta de um servidor: réplicas gravadas duas vezes?
+
+Dois servidores com replicação completa recebem publicações; o segundo
+cai (SIGKILL) no meio da carga e volta com o mesmo diretório. Na volta
+ele não tem offsets de replicação (sem snapshot, ou com a queda antes
+do primeiro) e as origens reenviam o que ainda têm no buffer circular:
+o que já estava no log não pode ser gravado de novo.
+
+Lê os segmentos dos dois servidores direto do disco e compara os pares
+(origem, clock): o que voltou precisa ter os mesmos registros do outro,
+cada um uma vez só. Sai com código 1 se houver duplicados ou faltas.
+
+Uso:
+    python bench/restart.py [--messages 3000] [--snapshot-interval 0]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from common import LocalCluster, closed_loop  # noqa: E402
+from store import iter_records  # noqa: E402
+
+
+def records(cluster: LocalCluster, i: int) -> Counter:
+    """(origem, clock) de cada publicação gravada pelo servidor i."""
+    pattern = os.path.join(cluster.server_dir(i), "store", f"bench-{i + 1}", "publications", "*.seg")
+    out = Counter()
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "rb") as f:
+            buf = f.read()
+        for _, clock, pstart, pend, _ in iter_records(buf, 0, len(buf)):
+            out[(msgpack.unpackb(buf[pstart:pend], raw=False).get("origin"), clock)] += 1
+    return out
+
+
+def wait_same(cluster: LocalCluster, timeout: float) -> tuple:
+    """Espera o servidor 2 ter tudo o que o servidor 1 tem."""
+    deadline = time.monotonic() + timeout
+    while True:
+        first, second = records(cluster, 0), records(cluster, 1)
+        if set(first) <= set(second) or time.monotonic() > deadline:
+            return first, second
+        time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--snapshot-interval", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    env = {"SERVER_MODE": "dealer", "SNAPSHOT_INTERVAL": str(args.snapshot_interval),
+           "PARTITION_RF": "0"}
+
+    def make_request(i):
+        return {"service": "publish", "data": {"user": "bench", "channel": "general", "message": f"msg {i}"}}
+
+    with LocalCluster(servers=2, server_env=env) as cluster:
+        half = args.messages // 2
+        closed_loop(cluster.ctx, cluster.router, make_request, 4, half)
+        wait_same(cluster, args.timeout)
+
+        cluster.kill_server(1)
+        _, _, errors = closed_loop(cluster.ctx, cluster.router, make_request, 4, args.messages - half)
+        cluster.start_server(1)
+        first, second = wait_same(cluster, args.timeout)
+
+    duplicates = sum(n - 1 for n in second.values() if n > 1)
+    missing = len(set(first) - set(second))
+    print(json.dumps({
+        "messages": args.messages,
+        "snapshot_interval": args.snapshot_interval,
+        "records": sum(second.values()),
+        "unique": len(second),
+        "duplicates": duplicates,
+        "missing": missing,
+        "errors_while_down": errors,
+    }))
+    sys.exit(1 if duplicates or missing else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Arquivamento em segundo plano x latência das gravações.
+
+Enche um store com --mb MiB em segmentos de --segment-kb KiB, depois
+grava em malha fechada (append + espera do group commit) enquanto a
+thread de retenção arquiva todos os segmentos selados. Compara a
+latência das gravações sem arquivamento, com arquivamento sem limite de
+I/O e com --io-rate MiB/s, e mostra a razão de compressão do codec.
+
+Uso:
+    python bench/retention.py [--mb 64] [--segment-kb 1024] [--io-rate 8]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import msgpack
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "server"))
+
+from common import latency_summary  # noqa: E402
+from log_writer import LogWriter  # noqa: E402
+from retention import RetentionEngine, RetentionPolicy  # noqa: E402
+from store import SegmentStore  # noqa: E402
+
+
+def fill(store, mb: int) -> int:
+    """Grava `mb` lotes de ~1 MiB de publicações; devolve o último clock."""
+    clock, size, records = 0, 0, []
+    while size < 1 << 20:
+        clock += 1
+        payload = msgpack.packb({
+            "type": "publish", "channel": f"canal-{clock % 16}", "user": "bench",
+            "message": f"mensagem {clock}", "clock": clock}, use_bin_type=True)
+        records.append((f"canal-{clock % 16}", clock, payload))
+        size += len(payload)
+    for _ in range(mb):
+        store.append_many([(k, c + clock, p) for k, c, p in records]).result()
+        clock += len(records)
+    return clock
+
+
+def run(label: str, io_rate, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-") as d:
+        writer = LogWriter(batch_max=512, flush_ms=0)
+        store = SegmentStore(d, writer, segment_bytes=args.segment_kb * 1024, segment_seconds=1e9)
+        clock = fill(store, args.mb)
+        time.sleep(0.01)
+
+        engine = RetentionEngine({"publications": store}, RetentionPolicy(), archive_after_s=0.001,
+                                 io_rate=(io_rate or 0) * 1024 * 1024, log=lambda msg, level="info": None)
+        done = {}
+        worker = None
+        if io_rate is not None:
+            worker = threading.Thread(target=lambda: done.update(engine.run_once()))
+            worker.start()
+
+        lat = []
+        t_end = time.perf_counter() + args.seconds
+        payload = msgpack.packb({"message": "x" * 100}, use_bin_type=True)
+        while time.perf_counter() < t_end or (worker is not None and worker.is_alive()):
+            clock += 1
+            t0 = time.perf_counter()
+            store.append("canal-0", clock, payload).result()
+            lat.append(time.perf_counter() - t0)
+        if worker is not None:
+            worker.join()
+
+        usage = store.disk_usage()
+        out = {"case": label, "codec": engine.codec, "appends": len(lat)}
+        out.update(latency_summary(lat))
+        if done:
+            out["archived_segments"] = done["archived"]
+            raw = sum(seg.size for seg in store.segments if seg.archived)
+            out["compression_ratio"] = round(raw / max(1, usage["archive"]), 1)
+        store.close()
+        writer.close()
+        return out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mb", type=int, default=64)
+    parser.add_argument("--segment-kb", type=int, default=1024)
+    parser.add_argument("--io-rate", type=float, default=8.0, help="MiB/s da thread de retenção")
+    parser.add_argument("--seconds", type=float, default=2.0, help="duração mínima da carga")
+    args = parser.parse_args()
+
+    for label, rate in (("sem arquivamento", None), ("sem limite de I/O", 0), (f"{args.io_rate:g} MiB/s", args.io_rate)):
+        print(json.dumps(run(label, rate, args), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
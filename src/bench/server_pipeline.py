@@ -0,0 +1,90 @@
+"""
+Benchmark do modo de atendimento do servidor: REP (lockstep) x DEALER
+(pipeline), com a mesma carga de publish. O atraso do ref simula a
+latência de rede até o servidor de referência (a coordenação com o ref
+roda numa thread própria nos dois modos, fora do caminho da requisição).
+No fim de cada modo manda pedidos com "service" lista/dict: cada um tem
+de voltar como erro e o servidor seguir atendendo (código 1 se não).
+
+Uso:
+    python bench/server_pipeline.py [--requests 20000] [--concurrency 64]
+                                    [--ref-delay-ms 2] [--workers 0]
+"""
+import argparse
+import json
+import os
+import sys
+
+import msgpack
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import LocalCluster, closed_loop, latency_summary  # noqa: E402
+
+
+def bad_services(cluster: LocalCluster) -> bool:
+    """Serviço que não é texto vira resposta de erro; depois um publish ainda passa."""
+    req = cluster.ctx.socket(zmq.REQ)
+    req.setsockopt(zmq.LINGER, 0)
+    req.setsockopt(zmq.RCVTIMEO, 5000)
+    req.connect(cluster.router)
+    bodies = [{"service": ["publish"], "data": {}}, {"service": {"a": 1}, "data": {}},
+              {"service": "publish", "data": {"user": "bench", "channel": "general", "message": "ok"}}]
+    statuses = []
+    try:
+        for body in bodies:
+            req.send(msgpack.packb(body))
+            statuses.append(msgpack.unpackb(req.recv(), raw=False)["data"]["status"])
+    except zmq.Again:
+        pass
+    req.close()
+    return statuses == ["erro", "erro", "OK"]
+
+
+def run_mode(mode: str, args) -> dict:
+    env = {"SERVER_MODE": mode, "SERVER_WORKERS": str(args.workers)}
+    with LocalCluster(servers=1, server_env=env, ref_delay_ms=args.ref_delay_ms) as cluster:
+        def make_request(i):
+            return {
+                "service": "publish",
+                "data": {"user": "bench", "channel": "general", "message": f"msg {i}"},
+            }
+
+        elapsed, lat, errors = closed_loop(
+            cluster.ctx, cluster.router, make_request, args.concurrency, args.requests
+        )
+        bad_ok = bad_services(cluster)
+
+    result = {
+        "mode": mode,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "ref_delay_ms": args.ref_delay_ms,
+        "errors": errors,
+        "msgs_per_sec": round(args.requests / elapsed, 1),
+        "bad_services_ok": bad_ok,
+    }
+    result.update(latency_summary(lat))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--ref-delay-ms", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    results = [run_mode(m, args) for m in ("rep", "dealer")]
+    rep, dealer = results
+    print(json.dumps({
+        "results": results,
+        "speedup": round(dealer["msgs_per_sec"] / rep["msgs_per_sec"], 2),
+    }, indent=2))
+    sys.exit(0 if all(r["bad_services_ok"] for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
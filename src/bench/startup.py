@@ -0,0 +1,149 @@
+"""
+Benchmark de partida do servidor com um log sintético grande.
+
+Gera N registros (padrão 1.2M) no store segmentado e mede quanto tempo
+leva para reabrir o estado em três situações:
+  - cold:     sem .idx e sem snapshot (reindexa todos os segmentos);
+  - indexed:  com .idx nos segmentos selados, sem snapshot (o log
+              inteiro é relido para reconhecer réplicas reenviadas);
+  - snapshot: com .idx e snapshot, reprocessando só a cauda.
+
+Uso:
+    python bench/startup.py [--records 1200000] [--tail 10000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SRC, "server"))
+
+import msgpack  # noqa: E402
+
+import snapshot  # noqa: E402
+from store import SegmentStore  # noqa: E402
+
+CHANNELS = [f"canal-{i}" for i in range(50)] + ["general", "random", "dev"]
+ORIGINS = ["bench-1", "bench-2", "bench-3"]
+
+
+class SyncWriter:
+    """Escritor síncrono mínimo com a interface do LogWriter (só para gerar dados)."""
+
+    def __init__(self):
+        self.files = {}
+
+    def append_raw(self, path, data, result=None):
+        f = self.files.get(path)
+        if f is None:
+            f = self.files[path] = open(path, "ab")
+        f.write(data)
+        fut = Future()
+        fut.set_result(result)
+        return fut
+
+    def release(self, path):
+        f = self.files.pop(path, None)
+        if f is not None:
+            f.close()
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
+def generate(directory: str, records: int, tail: int, segment_bytes: int) -> str:
+    """Gera o log e um snapshot tirado `tail` registros antes do fim."""
+    writer = SyncWriter()
+    store = SegmentStore(os.path.join(directory, "publications"), writer,
+                         segment_bytes=segment_bytes)
+    rnd = random.Random(42)
+    state = None
+    for i in range(1, records + 1):
+        if i == records - tail + 1:
+            writer.flush()
+            state = {
+                "stores": {"publications": store.checkpoint()},
+                "clock": i - 1,
+                "high_water": {},
+                "replication": {},
+            }
+        channel = rnd.choice(CHANNELS)
+        payload = {
+            "type": "publish",
+            "origin": rnd.choice(ORIGINS),
+            "channel": channel,
+            "user": f"user{rnd.randint(1000, 9999)}",
+            "message": f"mensagem sintética número {i}",
+            "timestamp": "2025-01-01T00:00:00Z",
+            "clock": i,
+        }
+        store.append(channel, i, msgpack.packb(payload, use_bin_type=True))
+    writer.close()
+
+    path = os.path.join(directory, "snapshot.msgpack")
+    snapshot.save(path, state)
+    return path
+
+
+def open_state(directory: str, snap_path: str = None) -> tuple:
+    t0 = time.perf_counter()
+    state = snapshot.load(snap_path) if snap_path else None
+    cp = (state or {}).get("stores", {}).get("publications")
+    store = SegmentStore(os.path.join(directory, "publications"), SyncWriter(), checkpoint=cp)
+    max_clock, _, _ = snapshot.replay_tail({"publications": store}, state, "bench-0")
+    return time.perf_counter() - t0, max_clock
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=1_200_000)
+    parser.add_argument("--tail", type=int, default=10_000)
+    parser.add_argument("--segment-bytes", type=int, default=64 * 1024 * 1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as tmp:
+        t0 = time.perf_counter()
+        snap_path = generate(tmp, args.records, args.tail, args.segment_bytes)
+        gen_s = time.perf_counter() - t0
+        seg_dir = os.path.join(tmp, "publications")
+        log_bytes = sum(os.path.getsize(os.path.join(seg_dir, f))
+                        for f in os.listdir(seg_dir) if f.endswith(".seg"))
+
+        results = []
+
+        # snapshot primeiro: abrir o store remove o .idx do segmento ativo,
+        # o que não muda nada para os outros cenários
+        secs, clock = open_state(tmp, snap_path)
+        results.append({"scenario": "snapshot", "seconds": round(secs, 3), "clock": clock})
+
+        secs, clock = open_state(tmp)
+        results.append({"scenario": "indexed", "seconds": round(secs, 3), "clock": clock})
+
+        for name in os.listdir(seg_dir):
+            if name.endswith(".idx"):
+                os.remove(os.path.join(seg_dir, name))
+        secs, clock = open_state(tmp)
+        results.append({"scenario": "cold", "seconds": round(secs, 3), "clock": clock})
+
+    print(json.dumps({
+        "records": args.records,
+        "tail": args.tail,
+        "log_mb": round(log_bytes / 1e6, 1),
+        "generate_seconds": round(gen_s, 1),
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Suíte de carga ponta a ponta, reproduzível (semente fixa) e sem Docker:
+sobe ref + N servidores como subprocessos, com broker e proxy em threads
+(ver LocalCluster), e roda cada carga num cluster novo.
+
+Cargas:
+  publish   publicações espalhadas pelos canais
+  dm        mensagens diretas entre usuários cadastrados
+  mixed     60% publish, 30% dm, 10% history
+  fanout    publish com muitos assinantes SUB (mede a entrega a eles)
+  catchup   leitura de histórico acumulado (history a partir de clocks aleatórios)
+
+Em malha fechada (--loop closed) cada um de --concurrency clientes tem um
+pedido em voo; em malha aberta (--loop open) os pedidos saem a --rate
+por segundo, respondidos ou não, e a latência conta do horário previsto.
+
+Saída: uma linha JSON por carga com vazão, latência (p50/p99/p999),
+atraso de replicação (envio -> registro visto no fluxo de réplica),
+entrega do fanout, CPU/memória de cada processo e a configuração usada.
+Com --baseline compara com um resultado anterior (mesma carga e malha) e
+sai com código 1 se a vazão cair ou o p99 subir mais que --tolerance.
+
+Uso:
+    python bench/suite.py [--workloads publish,dm,mixed,fanout,catchup]
+                          [--loop closed|open] [--rate 1000] [--requests 10000]
+                          [--concurrency 8] [--servers 2] [--broker proxy|lb]
+                          [--env LOG_FSYNC=1] [--out resultado.jsonl]
+                          [--baseline anterior.jsonl] [--tolerance 0.15]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import msgpack
+import zmq
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import (  # noqa: E402
+    LocalCluster, closed_loop, latency_summary, open_loop, percentile, proc_sample, proc_usage,
+)
+
+WORKLOADS = ("publish", "dm", "mixed", "fanout", "catchup")
+CHANNELS = ["general", "random", "dev"]
+REPLICA_TOPIC = b"replica"
+
+
+def stamp(i: int) -> str:
+    """Texto da mensagem com o instante de envio (ns, relógio monotônico deste processo)."""
+    return f"{i}@{time.perf_counter_ns()}"
+
+
+def sent_at(payload: dict):
+    try:
+        return int(str(payload.get("message")).rsplit("@", 1)[1]) / 1e9
+    except (IndexError, ValueError):
+        return None
+
+
+class _Watcher:
+    """
+    Thread com sockets SUB no proxy: mede o atraso até cada registro
+    aparecer no fluxo de réplica e, no fanout, a entrega aos assinantes.
+    """
+
+    def __init__(self, ctx, xpub: str, subscribers: int = 0, channel: str = "general"):
+        self.ctx = ctx
+        self.xpub = xpub
+        self.subscribers = subscribers
+        self.channel = channel.encode("utf-8")
+        self.replica_lag = []
+        self.delivery = []
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "_Watcher":
+        self._thread.start()
+        self._ready.wait()
+        time.sleep(0.5)   # assinaturas chegam ao proxy antes da carga
+        return self
+
+    def stop(self, settle: float = 0.5) -> None:
+        time.sleep(settle)  # últimos lotes de réplica / entregas
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        poller = zmq.Poller()
+        socks = []
+        replica = self.ctx.socket(zmq.SUB)
+        replica.connect(self.xpub)
+        replica.setsockopt(zmq.SUBSCRIBE, REPLICA_TOPIC)
+        poller.register(replica, zmq.POLLIN)
+        socks.append(replica)
+        for _ in range(self.subscribers):
+            s = self.ctx.socket(zmq.SUB)
+            s.setsockopt(zmq.RCVHWM, 0)
+            s.connect(self.xpub)
+            s.setsockopt(zmq.SUBSCRIBE, self.channel)
+            poller.register(s, zmq.POLLIN)
+            socks.append(s)
+        self._ready.set()
+
+        while not self._stop.is_set():
+            for sock, _ in poller.poll(100):
+                while True:
+                    try:
+                        frames = sock.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    now = time.perf_counter()
+                    if sock is replica:
+                        self._on_replica(frames, now)
+                    elif len(frames) > 1:
+                        t = sent_at(msgpack.unpackb(frames[1], raw=False))
+                        if t is not None:
+                            self.delivery.append(now - t)
+        for s in socks:
+            s.close(0)
+
+    def _on_replica(self, frames, now: float) -> None:
+        if len(frames) < 3 or frames[0] != REPLICA_TOPIC:
+            return
+        head = msgpack.unpackb(frames[1], raw=False)
+        if head.get("repair"):
+            return
+        for raw in frames[2:]:
+            t = sent_at(msgpack.unpackb(raw, raw=False))
+            if t is not None:
+                self.replica_lag.append(now - t)
+
+
+def lag_summary(values) -> dict:
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3) if values else 0.0,
+    }
+
+
+def call(sock, service: str, data: dict) -> dict:
+    sock.send(msgpack.packb({"service": service, "data": data}, use_bin_type=True))
+    return msgpack.unpackb(sock.recv(), raw=False)["data"]
+
+
+# ---------------------------
+# Preparação e geradores de cada carga
+# ---------------------------
+
+def prepare(cluster, workload: str, args, rng: random.Random):
+    """Cadastra usuários / pré-carrega histórico; devolve make_request(i)."""
+    req = cluster.ctx.socket(zmq.REQ)
+    req.setsockopt(zmq.LINGER, 0)
+    req.connect(cluster.router)
+    users = [f"u{k}" for k in range(args.users)]
+    if workload in ("dm", "mixed"):
+        for u in users:
+            call(req, "register_user", {"user": u})
+        time.sleep(0.5)   # cadastros replicados para todos os servidores
+
+    max_clock = 0
+    if workload == "catchup":
+        batch = 500
+        for first in range(0, args.preload, batch):
+            reply = call(req, "publish_batch", {"user": "seed", "channel": "general", "messages": [
+                {"message": f"seed {i}"} for i in range(first, min(first + batch, args.preload))]})
+            max_clock = max([max_clock] + [r.get("clock", 0) for r in reply["results"]])
+        time.sleep(1.0)   # réplicas gravadas nos outros servidores
+    req.close(0)
+
+    def publish(i):
+        return {"service": "publish", "data": {
+            "user": "bench", "channel": rng.choice(CHANNELS), "message": stamp(i)}}
+
+    def dm(i):
+        src, dst = rng.sample(users, 2)
+        return {"service": "message", "data": {"src": src, "dst": dst, "message": stamp(i)}}
+
+    def history(_):
+        return {"service": "history", "data": {"channel": rng.choice(CHANNELS), "limit": 20}}
+
+    if workload == "publish":
+        return publish
+    if workload == "dm":
+        return dm
+    if workload == "mixed":
+        def mixed(i):
+            r = rng.random()
+            return publish(i) if r < 0.6 else dm(i) if r < 0.9 else history(i)
+        return mixed
+    if workload == "fanout":
+        def fanout(i):
+            return {"service": "publish", "data": {
+                "user": "bench", "channel": "general", "message": stamp(i)}}
+        return fanout
+
+    def catchup(_):
+        return {"service": "history", "data": {
+            "channel": "general", "since_clock": rng.randint(0, max_clock), "limit": args.page}}
+    return catchup
+
+
+def run(workload: str, args, env: dict) -> dict:
+    rng = random.Random(args.seed)
+    with LocalCluster(servers=args.servers, server_env=env, broker=args.broker) as cluster:
+        make_request = prepare(cluster, workload, args, rng)
+        watcher = _Watcher(cluster.ctx, cluster.xpub,
+                           subscribers=args.subscribers if workload == "fanout" else 0).start()
+
+        records = 0
+
+        def on_reply(reply):
+            nonlocal records
+            records += len((reply.get("data") or {}).get("messages") or [])
+
+        procs = dict({name: p.pid for name, p in cluster.labels.items()}, harness=os.getpid())
+        before = {name: proc_sample(pid) for name, pid in procs.items()}
+        if args.loop == "open":
+            elapsed, lat, errors = open_loop(
+                cluster.ctx, cluster.router, make_request, args.rate, args.requests, on_reply)
+        else:
+            elapsed, lat, errors = closed_loop(
+                cluster.ctx, cluster.router, make_request, args.concurrency, args.requests, on_reply)
+        after = {name: proc_sample(pid) for name, pid in procs.items()}
+        watcher.stop()
+
+    out = {
+        "workload": workload,
+        "loop": args.loop,
+        "servers": args.servers,
+        "broker": args.broker,
+        "requests": args.requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(args.requests / elapsed, 1),
+        "errors": errors,
+    }
+    out.update(latency_summary(lat))
+    if args.servers > 1 and workload != "catchup":
+        out["replication_lag"] = lag_summary(watcher.replica_lag)
+    if workload == "fanout":
+        out["delivery"] = dict(lag_summary(watcher.delivery),
+                               subscribers=args.subscribers,
+                               expected=args.requests * args.subscribers)
+    if workload == "catchup":
+        out["records_per_s"] = round(records / elapsed, 1)
+    out["processes"] = proc_usage(before, after, elapsed)
+    out["config"] = dict(env, concurrency=args.concurrency, rate=args.rate, seed=args.seed)
+    return out
+
+
+# ---------------------------
+# Comparação com um resultado anterior
+# ---------------------------
+
+def gate(results: list, baseline_path: str, tolerance: float) -> list:
+    """Regressões de vazão ou p99 em relação ao baseline (mesma carga e malha)."""
+    base = {}
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                if "workload" in r:
+                    base[(r["workload"], r["loop"])] = r
+
+    regressions = []
+    for r in results:
+        b = base.get((r["workload"], r["loop"]))
+        if b is None:
+            continue
+        if r["throughput"] < b["throughput"] * (1 - tolerance):
+            regressions.append({"workload": r["workload"], "metric": "throughput",
+                                "baseline": b["throughput"], "current": r["throughput"]})
+        if r["p99_ms"] > b["p99_ms"] * (1 + tolerance):
+            regressions.append({"workload": r["workload"], "metric": "p99_ms",
+                                "baseline": b["p99_ms"], "current": r["p99_ms"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--loop", choices=("closed", "open"), default="closed")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000.0)
+    parser.add_argument("--servers", type=int, default=2)
+    parser.add_argument("--broker", choices=("proxy", "lb"), default="proxy")
+    parser.add_argument("--server-mode", choices=("dealer", "rep"), default="dealer")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--preload", type=int, default=20000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--env", action="append", default=[],
+                        help="variável extra dos servidores (KEY=VALOR, repetível)")
+    parser.add_argument("--out")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    env = {"SERVER_MODE": args.server_mode}
+    env.update(kv.split("=", 1) for kv in args.env)
+
+    results = []
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    for workload in args.workloads.split(","):
+        if workload not in WORKLOADS:
+            parser.error(f"carga desconhecida: {workload}")
+        result = run(workload, args, env)
+        results.append(result)
+        line = json.dumps(result)
+        print(line, flush=True)
+        if out:
+            out.write(line + "\n")
+    if out:
+        out.close()
+
+    if args.baseline:
+        regressions = gate(results, args.baseline, args.tolerance)
+        print(json.dumps({"gate": "fail" if regressions else "ok", "regressions": regressions}))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
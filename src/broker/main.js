@@ -1,10 +1,40 @@
 // ROUTER (5555) <-> DEALER (5556)
+//
+// BROKER_MODE=proxy (padrão): repassa ROUTER -> DEALER, round-robin cego.
+// BROKER_MODE=lb: o lado dos servidores vira ROUTER e o broker escolhe o
+// servidor que deve responder antes: (em aberto + 1) x latência média
+// (EWMA) de cada um (fila LRU/Paranoid Pirate com custo por carga).
+//
+// Protocolo dos servidores no modo lb (DEALER -> ROUTER):
+//   ["", "READY", capacidade]    anuncia/renova o servidor (heartbeat)
+//   [cliente, "", resposta]      resposta a uma requisição
+// e o broker entrega [cliente, "", corpo] a cada servidor.
+//
+// Fila cheia ou servidor que expira com pedidos em aberto: o cliente
+// recebe {"service", "data": {"status": "erro", "message"}} em vez de
+// ficar sem resposta (um REQ travaria). A resposta atrasada de um
+// servidor expirado é descartada.
+//
+// BROKER_AFFINITY dá só aderência (o mesmo canal tende ao mesmo
+// servidor, bom para o cache de histórico e o cursor do replay): o hash
+// é sobre os ids dos servidores conectados ao broker, não o anel de
+// partições dos servidores, então com PARTITION_RF o servidor escolhido
+// ainda pode repassar o pedido ao dono.
+import { createHash } from "node:crypto";
 import { Router, Dealer, Poller } from "zeromq";
+import { decode, encode } from "@msgpack/msgpack";
 
 const ROUTER_ADDR = process.env.ROUTER_ADDR || "tcp://*:5555"; // clientes REQ conectam
 const DEALER_ADDR = process.env.DEALER_ADDR || "tcp://*:5556"; // servidores REP conectam
 
-async function main() {
+const MODE = process.env.BROKER_MODE || "proxy";
+const AFFINITY = process.env.BROKER_AFFINITY === "1";              // mesmo canal -> mesmo servidor
+const AFFINITY_SLACK = Number(process.env.BROKER_AFFINITY_SLACK || 2); // custo tolerado (x o melhor)
+const WORKER_TIMEOUT_MS = Number(process.env.WORKER_TIMEOUT_MS || 3000);
+const QUEUE_MAX = Number(process.env.BROKER_QUEUE_MAX || 10000);
+const EWMA_ALPHA = 0.2;
+
+async function proxy() {
   const router = new Router();
   const dealer = new Dealer();
 
@@ -34,6 +64,191 @@ async function main() {
   }
 }
 
+// envios serializados: dois loops podem escrever no mesmo socket
+function writer(sock) {
+  let chain = Promise.resolve();
+  return (frames) => (chain = chain.then(() => sock.send(frames)));
+}
+
+function score(key, id) {
+  return createHash("md5").update(key).update(id).digest().readUInt32BE(0);
+}
+
+// chave do pedido para afinidade: canal (publish/publish_batch/history) ou destinatário;
+// replay vai sempre ao mesmo servidor, que entende o cursor da página anterior
+function requestKey(body) {
+  try {
+    const req = decode(body);
+    const data = (req && req.data) || {};
+    if (req.service === "publish" || req.service === "publish_batch" || req.service === "history") return data.channel;
+    if (req.service === "message") return data.dst;
+    if (req.service === "replay") return data.channel || data.user;
+    if (req.service === "inbox_fetch" || req.service === "inbox_ack") return data.user;
+  } catch (err) {
+    // corpo inválido: o servidor responde com erro
+  }
+  return null;
+}
+
+// resposta de erro no contrato dos servidores, com o envelope do pedido
+function errorReply(frames, message) {
+  let service = null;
+  try {
+    const req = decode(frames[frames.length - 1]);
+    if (req && typeof req.service === "string") service = req.service;
+  } catch (err) {
+    // corpo inválido: responde sem serviço
+  }
+  const delim = frames.findIndex((f) => f.length === 0);
+  const envelope = delim >= 0 ? frames.slice(0, delim + 1) : frames.slice(0, -1);
+  return [...envelope, encode({
+    service,
+    data: { status: "erro", message, timestamp: new Date().toISOString() },
+  })];
+}
+
+// envelope do pedido (identidade + id de requisição, até o frame vazio):
+// um cliente DEALER pode ter vários pedidos em voo no mesmo servidor
+function envelopeKey(frames) {
+  const parts = [];
+  for (const f of frames) {
+    if (f.length === 0) break;
+    parts.push(f.toString("hex"));
+  }
+  return parts.join(".");
+}
+
+async function loadBalance() {
+  const frontend = new Router();
+  const backend = new Router();
+
+  await frontend.bind(ROUTER_ADDR);
+  await backend.bind(DEALER_ADDR);
+
+  console.log(`[broker] ROUTER on ${ROUTER_ADDR} | ROUTER (lb) on ${DEALER_ADDR}`);
+
+  const toClient = writer(frontend);
+  const toServer = writer(backend);
+  // id (hex) -> { id, outstanding, capacity, seen, ewma (ms), sent: envelope -> { t0, frames } }
+  const workers = new Map();
+  const queue = [];          // pedidos esperando um servidor com folga
+
+  const cost = (w) => (w.outstanding + 1) * Math.max(w.ewma, 0.1);
+
+  function pick(frames) {
+    let best = null;
+    for (const w of workers.values()) {
+      if (w.outstanding >= w.capacity) continue;
+      if (best === null || cost(w) < cost(best)) best = w;
+    }
+    if (best === null || !AFFINITY) return best;
+
+    const key = requestKey(frames[frames.length - 1]);
+    if (key == null) return best;
+    let home = null;
+    let homeScore = -1;
+    for (const [hex, w] of workers) {
+      const s = score(String(key), hex);
+      if (s > homeScore) {
+        home = w;
+        homeScore = s;
+      }
+    }
+    // afinidade só enquanto o servidor "dono" não estiver bem mais carregado
+    if (home.outstanding < home.capacity && cost(home) <= cost(best) * AFFINITY_SLACK) {
+      return home;
+    }
+    return best;
+  }
+
+  function dispatch(frames) {
+    const w = pick(frames);
+    if (w === null) return false;
+    w.outstanding += 1;
+    w.sent.set(envelopeKey(frames), { t0: performance.now(), frames });
+    toServer([w.id, ...frames]);
+    return true;
+  }
+
+  function drain() {
+    while (queue.length > 0 && dispatch(queue[0])) queue.shift();
+  }
+
+  // remove servidores sem heartbeat; os pedidos em aberto neles falham
+  // (não são reenviados: um publish pode já ter sido gravado)
+  setInterval(() => {
+    const now = Date.now();
+    for (const [hex, w] of workers) {
+      if (now - w.seen > WORKER_TIMEOUT_MS) {
+        workers.delete(hex);
+        console.log(`[broker] servidor ${hex} expirou (${w.outstanding} em aberto)`);
+        for (const { frames } of w.sent.values()) {
+          toClient(errorReply(frames, "servidor parou de responder; o pedido pode ou não ter sido processado"));
+        }
+      }
+    }
+    // sem nenhum servidor a fila não anda: falha o que está esperando
+    if (workers.size === 0) {
+      for (const frames of queue.splice(0)) toClient(errorReply(frames, "nenhum servidor disponível"));
+    }
+  }, WORKER_TIMEOUT_MS / 2);
+
+  async function clients() {
+    for await (const frames of frontend) {
+      if (queue.length > 0 || !dispatch(frames)) {
+        if (queue.length >= QUEUE_MAX) {
+          // sem folga em lugar nenhum: recusa na hora
+          toClient(errorReply(frames, "broker sobrecarregado, tente novamente"));
+          continue;
+        }
+        queue.push(frames);
+      }
+    }
+  }
+
+  async function servers() {
+    for await (const [id, ...rest] of backend) {
+      const hex = id.toString("hex");
+      let w = workers.get(hex);
+      if (rest.length > 0 && rest[0].length === 0) {
+        // controle: ["", "READY", capacidade]
+        if (rest[1] && rest[1].toString() === "READY") {
+          const capacity = Math.max(1, Number(rest[2] ? rest[2].toString() : 1) || 1);
+          if (!w) {
+            w = { id, outstanding: 0, capacity, seen: 0, ewma: 0, sent: new Map() };
+            workers.set(hex, w);
+            console.log(`[broker] servidor ${hex} pronto (capacidade ${capacity})`);
+          }
+          w.capacity = capacity;
+          w.seen = Date.now();
+        }
+      } else {
+        const key = envelopeKey(rest);
+        const entry = w && w.sent.get(key);
+        if (entry) {
+          w.sent.delete(key);
+          w.ewma += EWMA_ALPHA * (performance.now() - entry.t0 - w.ewma);
+          w.outstanding = Math.max(0, w.outstanding - 1);
+          w.seen = Date.now();
+          toClient(rest);
+        }
+        // sem registro: servidor expirado, o cliente já recebeu o erro
+      }
+      drain();
+    }
+  }
+
+  await Promise.all([clients(), servers()]);
+}
+
+async function main() {
+  if (MODE === "lb") {
+    await loadBalance();
+  } else {
+    await proxy();
+  }
+}
+
 main().catch((err) => {
   console.error("[broker] error:", err);
   process.exit(1);
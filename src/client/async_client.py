@@ -0,0 +1,196 @@
+"""
+Cliente assíncrono (asyncio) sobre DEALER, com várias requisições em voo.
+
+Cada pedido sai como [id, "", corpo]: o broker e o servidor devolvem o
+envelope inteiro, então a resposta volta com o mesmo id e é casada com o
+Future certo, em qualquer ordem. No máximo `window` pedidos ficam em
+aberto; sem resposta em `timeout_ms` o pedido é reenviado (mesmo id) até
+`retries` vezes e depois falha com TimeoutError, em vez de travar o
+cliente como um REQ que perdeu a resposta.
+
+publish/publish_batch/message não são idempotentes: um reenvio cuja
+primeira resposta só se atrasou grava a mensagem duas vezes (o servidor
+não descarta ids repetidos). Por isso o `retries` do cliente só vale para
+os outros serviços; esses saem uma vez, a não ser que o pedido passe
+`retries` explicitamente.
+
+Uso:
+    client = AsyncClient("tcp://localhost:5555", window=64)
+    reply = await client.request("publish", {"user": "ana", "channel": "general", "message": "oi"})
+    futs = [client.submit("history", {"channel": "general"}) for _ in range(10)]
+"""
+import asyncio
+import itertools
+import os
+import sys
+from datetime import datetime
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+
+from clock import LamportClock  # noqa: E402
+
+
+# serviços que gravam de novo a cada reenvio
+NOT_IDEMPOTENT = frozenset(("publish", "publish_batch", "message"))
+
+
+def ts() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+class _Pending:
+    """Pedido em aberto: Future da resposta, frames para reenvio e timer."""
+
+    __slots__ = ("fut", "frames", "left", "timer", "service", "timeout_s")
+
+    def __init__(self, fut, frames, left, service, timeout_s):
+        self.fut = fut
+        self.frames = frames
+        self.left = left          # reenvios restantes
+        self.timer = None
+        self.service = service
+        self.timeout_s = timeout_s
+
+
+class AsyncClient:
+    def __init__(self, addr: str, window: int = 64, timeout_ms: float = 3000.0,
+                 retries: int = 1, ctx: zmq.asyncio.Context = None):
+        self.ctx = ctx or zmq.asyncio.Context.instance()
+        self.sock = self.ctx.socket(zmq.DEALER)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.connect(addr)
+        # mesmo socket, API síncrona: esvazia as respostas já recebidas
+        self._drain = zmq.Socket.shadow(self.sock.underlying)
+
+        self.window = max(1, int(window))
+        self.timeout_s = timeout_ms / 1000.0
+        self.retries = max(0, int(retries))
+        self._clock = LamportClock()   # relógio lógico do cliente
+
+        self._slots = asyncio.Semaphore(self.window)
+        self._ids = itertools.count(1)
+        self._pending = {}       # id -> _Pending
+        self._reader = None
+
+    # ---------------------------
+    # Relógio lógico
+    # ---------------------------
+
+    @property
+    def clock(self) -> int:
+        return self._clock.value
+
+    def observe(self, remote_clock) -> None:
+        """Atualiza o relógio com o clock de uma resposta ou publicação."""
+        self._clock.observe(remote_clock)
+
+    def next_clock(self) -> int:
+        return self._clock.tick()
+
+    # ---------------------------
+    # API
+    # ---------------------------
+
+    async def request(self, service: str, data: dict = None,
+                      timeout_ms: float = None, retries: int = None) -> dict:
+        """
+        Envia {"service", "data"} e devolve a resposta decodificada. Em
+        respostas de vários frames (history com raw), os registros vêm
+        em `reply["frames"]`. TimeoutError depois das retentativas
+        (nenhuma, por padrão, em NOT_IDEMPOTENT).
+        """
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read())
+        timeout_s = self.timeout_s if timeout_ms is None else timeout_ms / 1000.0
+        if retries is None:
+            retries = 0 if service in NOT_IDEMPOTENT else self.retries
+        attempts = 1 + max(0, int(retries))
+
+        async with self._slots:
+            data = dict(data or {})
+            data.setdefault("timestamp", ts())
+            data.setdefault("clock", self.next_clock())
+            frames = [next(self._ids).to_bytes(8, "big"), b"",
+                      msgpack.packb({"service": service, "data": data}, use_bin_type=True)]
+
+            loop = asyncio.get_running_loop()
+            p = _Pending(loop.create_future(), frames, attempts - 1, service, timeout_s)
+            self._pending[frames[0]] = p
+            try:
+                await self.sock.send_multipart(frames)
+                # timer em vez de wait_for: sem uma task extra por pedido
+                p.timer = loop.call_later(timeout_s, self._expire, frames[0])
+                return await p.fut
+            finally:
+                self._pending.pop(frames[0], None)
+                if p.timer is not None:
+                    p.timer.cancel()
+
+    def _expire(self, rid: bytes) -> None:
+        """Prazo de um pedido estourou: reenvia ou falha com TimeoutError."""
+        p = self._pending.get(rid)
+        if p is None or p.fut.done():
+            return
+        if p.left <= 0:
+            p.fut.set_exception(TimeoutError(f"{p.service}: sem resposta no prazo"))
+            return
+        p.left -= 1
+        self.sock.send_multipart(p.frames)
+        p.timer = asyncio.get_running_loop().call_later(p.timeout_s, self._expire, rid)
+
+    def submit(self, service: str, data: dict = None, **kwargs) -> asyncio.Future:
+        """Dispara o pedido sem esperar; devolve o Future da resposta."""
+        return asyncio.ensure_future(self.request(service, data, **kwargs))
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._pending)
+
+    async def close(self) -> None:
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+        for p in self._pending.values():
+            if not p.fut.done():
+                p.fut.set_exception(ConnectionError("cliente fechado"))
+        self._pending.clear()
+        self.sock.close(0)
+
+    # ---------------------------
+    # Recebimento
+    # ---------------------------
+
+    def _deliver(self, frames: list) -> None:
+        if len(frames) < 3 or frames[1] != b"":
+            return
+        p = self._pending.get(frames[0])
+        if p is None or p.fut.done():
+            return  # resposta atrasada de um pedido já respondido ou expirado
+        try:
+            reply = msgpack.unpackb(frames[2], raw=False)
+        except Exception as e:
+            p.fut.set_exception(e)
+            return
+        self.observe((reply.get("data") or {}).get("clock", 0))
+        if len(frames) > 3:
+            reply["frames"] = frames[3:]
+        p.fut.set_result(reply)
+
+    async def _read(self) -> None:
+        while True:
+            self._deliver(await self.sock.recv_multipart())
+            # esvazia o que já chegou sem voltar ao loop de eventos
+            while True:
+                try:
+                    frames = self._drain.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                self._deliver(frames)
@@ -0,0 +1,186 @@
+"""
+Modo de alta vazão do SUB, para bots que seguem muitos canais.
+
+O Subscriber (subscriber.py) decodifica cada mensagem no loop asyncio,
+o mesmo que publica e faz os pedidos: com canais movimentados a fila do
+SUB enche e o proxy descarta no HWM. Aqui:
+
+  - uma thread só lê o SUB: espera a primeira mensagem e esvazia o que
+    já chegou com NOBLOCK, até `batch_max` por lote;
+  - outra thread entrega os lotes aos handlers (callbacks por tópico,
+    ou "*" para todos), longe do loop que publica;
+  - nada é decodificado na leitura: Message.payload decodifica sob
+    demanda, decode_all() decodifica um lote inteiro com um Unpacker
+    só, e o clock (o último campo do payload, como o servidor monta)
+    é lido direto dos bytes, para o relógio lógico acompanhar sem
+    decodificar.
+
+Sem replay: o que se perde numa queda não volta (use o Subscriber se
+precisar de retomada).
+
+Uso:
+    fan = FanIn(ctx, "tcp://localhost:5558", observe=client.observe)
+    fan.on("general", lambda msgs: ...)     # lote de Message do tópico
+    fan.on("*", lambda msgs: ...)           # tópicos sem handler próprio
+    fan.subscribe("general"); fan.subscribe("dev")
+    fan.start()
+"""
+import queue
+import threading
+
+import msgpack
+import zmq
+
+_CLOCK_KEY = b"\xa5clock"
+_UINT_SIZES = {0xcc: 1, 0xcd: 2, 0xce: 4, 0xcf: 8}
+
+
+class Message:
+    """Mensagem recebida, com o payload decodificado só quando pedido."""
+
+    __slots__ = ("topic", "raw", "_payload")
+
+    def __init__(self, topic: str, raw: bytes):
+        self.topic = topic
+        self.raw = raw
+        self._payload = None
+
+    @property
+    def payload(self) -> dict:
+        if self._payload is None:
+            self._payload = msgpack.unpackb(self.raw, raw=False)
+        return self._payload
+
+    @property
+    def clock(self) -> int:
+        """Clock lógico do payload, sem decodificar o resto (0 se não achar)."""
+        if self._payload is not None:
+            return int(self._payload.get("clock") or 0)
+        return peek_clock(self.raw)
+
+
+def peek_clock(raw: bytes) -> int:
+    """Valor da chave "clock" do map MessagePack (último campo nos payloads do servidor)."""
+    i = raw.rfind(_CLOCK_KEY)
+    if i < 0:
+        return 0
+    i += len(_CLOCK_KEY)
+    if i >= len(raw):
+        return 0
+    tag = raw[i]
+    if tag <= 0x7f:                          # positive fixint
+        return tag
+    size = _UINT_SIZES.get(tag)
+    if size is None:
+        return 0
+    return int.from_bytes(raw[i + 1:i + 1 + size], "big")
+
+
+def decode_all(messages: list) -> list:
+    """Decodifica um lote com um Unpacker em streaming (preenche Message.payload)."""
+    unpacker = msgpack.Unpacker(raw=False)
+    unpacker.feed(b"".join(m.raw for m in messages))
+    for m, payload in zip(messages, unpacker):
+        m._payload = payload
+    return [m._payload for m in messages]
+
+
+class FanIn:
+    def __init__(self, ctx, xpub: str, observe=None, batch_max: int = 1024,
+                 rcvhwm: int = 100000, queue_max: int = 64):
+        self.observe = observe               # observe(clock): relógio lógico do cliente
+        self.batch_max = max(1, int(batch_max))
+        self.handlers = {}                   # tópico -> [handler(lista de Message)]
+
+        self.sub = ctx.socket(zmq.SUB)
+        self.sub.setsockopt(zmq.RCVHWM, int(rcvhwm))
+        self.sub.setsockopt(zmq.LINGER, 0)
+        self.sub.connect(xpub)
+
+        # lotes entre a leitura e a entrega; cheia, a leitura espera e a
+        # fila do SUB (RCVHWM) absorve
+        self._batches = queue.Queue(maxsize=max(1, int(queue_max)))
+        self._stopping = threading.Event()
+        self._threads = []
+
+        self.received = 0
+        self.batches = 0
+        self.handler_errors = 0
+
+    # ---------------------------
+    # API
+    # ---------------------------
+
+    def subscribe(self, topic: str) -> None:
+        # só antes do start(): o socket passa a ser da thread de leitura
+        self.sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+
+    def on(self, topic: str, handler) -> None:
+        """handler(mensagens) recebe cada lote de Message do tópico ("*" = os demais)."""
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def start(self) -> "FanIn":
+        for target, name in ((self._read, "fanin-recv"), (self._dispatch, "fanin-dispatch")):
+            t = threading.Thread(target=target, name=name, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self) -> None:
+        self._stopping.set()
+        for t in self._threads:
+            t.join(timeout=2)
+        self.sub.close(0)
+
+    # ---------------------------
+    # Threads
+    # ---------------------------
+
+    def _read(self) -> None:
+        sub, batch_max = self.sub, self.batch_max
+        while not self._stopping.is_set():
+            if not sub.poll(200):
+                continue
+            batch = []
+            try:
+                while len(batch) < batch_max:
+                    frames = sub.recv_multipart(zmq.NOBLOCK)
+                    if len(frames) >= 2:
+                        batch.append((frames[0], frames[1]))
+            except zmq.Again:
+                pass
+            if not batch:
+                continue
+            while not self._stopping.is_set():
+                try:
+                    self._batches.put(batch, timeout=0.2)
+                    break
+                except queue.Full:
+                    continue
+
+    def _dispatch(self) -> None:
+        topics = {}                          # bytes do tópico -> str (poucos tópicos, muitas mensagens)
+        while not self._stopping.is_set():
+            try:
+                batch = self._batches.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            groups = {}
+            for rtopic, raw in batch:
+                topic = topics.get(rtopic)
+                if topic is None:
+                    topic = topics[rtopic] = rtopic.decode("utf-8", "replace")
+                groups.setdefault(topic, []).append(Message(topic, raw))
+            if self.observe is not None:
+                # um observe por lote, pelo maior clock (sem decodificar)
+                self.observe(max(peek_clock(raw) for _, raw in batch))
+            self.received += len(batch)
+            self.batches += 1
+
+            fallback = self.handlers.get("*", ())
+            for topic, messages in groups.items():
+                for handler in self.handlers.get(topic, fallback):
+                    try:
+                        handler(messages)
+                    except Exception:
+                        self.handler_errors += 1
@@ -1,10 +1,15 @@
 import os
+import asyncio
 import random
+import threading
 import time
-from datetime import datetime
 
 import zmq
-import msgpack
+import zmq.asyncio
+
+from async_client import AsyncClient
+from fanin import FanIn
+from subscriber import Subscriber
 
 # Endereços (podem ser sobrescritos por variáveis de ambiente)
 BROKER = os.getenv("BROKER_REQ", "tcp://localhost:5555")   # broker (ROUTER)
@@ -12,115 +17,175 @@ XPUB   = os.getenv("PROXY_XPUB", "tcp://localhost:5558")   # proxy (XPUB)
 
 USERNAME = os.getenv("USERNAME", f"user{random.randint(1000,9999)}")  # nome do usuário
 AUTO = os.getenv("AUTO_CLIENT", "0") == "1"                           # cliente automático?
-
-logical_clock = 0  # relógio lógico local (Lamport)
-
-
-def ts() -> str:
-    """Timestamp físico simples."""
-    return datetime.utcnow().isoformat() + "Z"
-
-
-def update_clock(remote_clock: int) -> None:
-    """Atualiza relógio lógico com base em outro clock."""
-    global logical_clock
-    logical_clock = max(logical_clock, int(remote_clock or 0)) + 1
-
-
-def next_clock() -> int:
-    """Incrementa o relógio lógico e devolve valor atual."""
-    global logical_clock
-    logical_clock += 1
-    return logical_clock
-
-
-def send_req(sock, service: str, data: dict) -> dict:
+AUTO_BATCH = os.getenv("AUTO_BATCH", "0") == "1"                      # rajadas num publish_batch?
+
+# Pedidos em voo, timeout por pedido e reenvios (DEALER com id por pedido)
+CLIENT_WINDOW     = int(os.getenv("CLIENT_WINDOW", "16"))
+CLIENT_TIMEOUT_MS = float(os.getenv("CLIENT_TIMEOUT_MS", "3000"))
+CLIENT_RETRIES    = int(os.getenv("CLIENT_RETRIES", "1"))
+
+# Retomada do SUB: arquivo com o último clock visto por tópico (vazio = só
+# em memória), folga em ticks pedida a mais no replay e atraso aleatório
+# máximo antes do replay depois de uma reconexão
+CLIENT_STATE     = os.getenv("CLIENT_STATE", "")
+REPLAY_SLACK     = int(os.getenv("REPLAY_SLACK", "0"))
+REPLAY_JITTER_MS = float(os.getenv("REPLAY_JITTER_MS", "2000"))
+CLIENT_RCVHWM    = int(os.getenv("CLIENT_RCVHWM", "10000"))   # fila do SUB, em mensagens
+
+# Modo de alta vazão do SUB (bots em muitos canais movimentados): leitura
+# em lotes numa thread, entrega noutra, sem decodificar nem imprimir cada
+# mensagem de canal; um resumo a cada FANIN_REPORT_S segundos (ver fanin.py)
+FANIN          = os.getenv("CLIENT_FANIN", "0") == "1"
+FANIN_BATCH    = int(os.getenv("FANIN_BATCH", "1024"))
+FANIN_RCVHWM   = int(os.getenv("FANIN_RCVHWM", "100000"))
+FANIN_REPORT_S = float(os.getenv("FANIN_REPORT_S", "5"))
+
+
+async def send_req(client: AsyncClient, service: str, data: dict) -> dict:
     """
-    Envia requisição em MessagePack para o servidor,
-    já incluindo timestamp e clock.
+    Envia requisição em MessagePack para o servidor (timestamp e clock
+    são preenchidos pelo cliente). Sem resposta: avisa e devolve {}.
     """
-    # incrementa clock antes de enviar
-    data = dict(data or {})
-    data.setdefault("timestamp", ts())
-    data.setdefault("clock", next_clock())
-
-    payload = {"service": service, "data": data}
-    sock.send(msgpack.packb(payload, use_bin_type=True))
+    try:
+        return await client.request(service, data)
+    except TimeoutError as e:
+        print(f"[{USERNAME}] {e}")
+        return {}
 
-    # recebe resposta e atualiza clock com o clock recebido
-    rep_raw = sock.recv()
-    reply = msgpack.unpackb(rep_raw, raw=False)
-    rdata = reply.get("data", {}) or {}
-    update_clock(rdata.get("clock", 0))
-    return reply
 
+def show(topic: str, payload: dict) -> None:
+    """Mostra uma mensagem recebida (ao vivo ou do replay, sem repetir)."""
+    print(f"[{USERNAME}] <- ({topic}) {payload}")
 
-def main():
-    ctx = zmq.Context()
 
-    # REQ para falar com o servidor via broker
-    req = ctx.socket(zmq.REQ)
-    req.connect(BROKER)
-
-    # SUB para receber mensagens do proxy
-    sub = ctx.socket(zmq.SUB)
-    sub.connect(XPUB)
-
-    # registra usuário no servidor
-    send_req(req, "register_user", {"user": USERNAME})
+async def drain_inbox(client: AsyncClient) -> None:
+    """
+    Mensagens diretas que chegaram com o cliente fora do ar (inbox_fetch),
+    página a página, confirmando cada página com inbox_ack.
+    """
+    while True:
+        resp = await send_req(client, "inbox_fetch", {"user": USERNAME})
+        data = resp.get("data", {}) or {}
+        if data.get("status") != "OK":
+            return
+        for payload in data.get("messages", []):
+            show(USERNAME, payload)
+        if data.get("messages"):
+            await send_req(client, "inbox_ack", {"user": USERNAME, "last_clock": data["last_clock"]})
+        if not data.get("more"):
+            return
+
+
+async def auto_publish(client: AsyncClient, channels: list) -> None:
+    # modo automático: manda 10 mensagens por vez em canais aleatórios;
+    # com AUTO_BATCH=1 as 10 vão numa requisição só (publish_batch)
+    while True:
+        canal = random.choice(channels)
+        if AUTO_BATCH:
+            await send_req(
+                client,
+                "publish_batch",
+                {
+                    "user": USERNAME,
+                    "channel": canal,
+                    "messages": [
+                        {"message": f"auto-msg {i} de {USERNAME} em #{canal}"}
+                        for i in range(10)
+                    ],
+                },
+            )
+            await asyncio.sleep(0.5)
+            continue
+        for i in range(10):
+            await send_req(
+                client,
+                "publish",
+                {
+                    "user": USERNAME,
+                    "channel": canal,
+                    "message": f"auto-msg {i} de {USERNAME} em #{canal}",
+                },
+            )
+            await asyncio.sleep(0.05)
+
+
+def start_fanin(client: AsyncClient, ctx, channels: list) -> FanIn:
+    """SUB de alta vazão: mensagens diretas impressas, canais só contados."""
+    fan = FanIn(zmq.Context.shadow(ctx.underlying), XPUB, observe=client.observe,
+                batch_max=FANIN_BATCH, rcvhwm=FANIN_RCVHWM)
+    counts = {}
+
+    def count(messages):
+        topic = messages[0].topic
+        counts[topic] = counts.get(topic, 0) + len(messages)
+
+    def direct(messages):
+        for m in messages:
+            show(USERNAME, m.payload)
+
+    fan.on(USERNAME, direct)
+    fan.on("*", count)
+    fan.subscribe(USERNAME)
+    for ch in channels:
+        fan.subscribe(ch)
+    fan.start()
 
-    # obtém lista de canais
-    ch_resp = send_req(req, "list_channels", {})
+    def report():
+        nonlocal counts
+        while True:
+            time.sleep(FANIN_REPORT_S)
+            snapshot, counts = counts, {}
+            if not snapshot:
+                continue
+            total = sum(snapshot.values())
+            top = ", ".join(f"{t}: {n}" for t, n in sorted(snapshot.items(), key=lambda kv: -kv[1])[:5])
+            print(f"[{USERNAME}] {total / FANIN_REPORT_S:.0f} msg/s ({top})")
+
+    threading.Thread(target=report, name="fanin-report", daemon=True).start()
+    return fan
+
+
+async def main():
+    ctx = zmq.asyncio.Context()
+
+    # DEALER para falar com o servidor via broker (vários pedidos em voo)
+    client = AsyncClient(BROKER, window=CLIENT_WINDOW, timeout_ms=CLIENT_TIMEOUT_MS,
+                         retries=CLIENT_RETRIES, ctx=ctx)
+
+    # registra usuário e obtém lista de canais (em paralelo)
+    _, ch_resp = await asyncio.gather(
+        send_req(client, "register_user", {"user": USERNAME}),
+        send_req(client, "list_channels", {}),
+    )
     channels = (ch_resp.get("data", {}) or {}).get("channels", []) or ["general"]
-
-    # assina o próprio nome (mensagens diretas) e todos os canais
-    sub.setsockopt_string(zmq.SUBSCRIBE, USERNAME)
+    await drain_inbox(client)
+
+    if FANIN:
+        start_fanin(client, ctx, channels)
+        print(f"[{USERNAME}] assinando {USERNAME} + {channels} (alta vazão)")
+        if AUTO:
+            await auto_publish(client, channels)
+        else:
+            await asyncio.Event().wait()
+        return
+
+    # SUB no proxy com retomada: assina o próprio nome (mensagens diretas)
+    # e todos os canais; o que veio antes da assinatura ou durante uma queda
+    # chega pelo replay, a partir do clock atual (ou do salvo em CLIENT_STATE)
+    sub = Subscriber(client, ctx, XPUB, show, state_path=CLIENT_STATE or None,
+                     slack=REPLAY_SLACK, jitter_ms=REPLAY_JITTER_MS, rcvhwm=CLIENT_RCVHWM)
+    sub.add(USERNAME, "user", since=client.clock)
     for ch in channels:
-        sub.setsockopt_string(zmq.SUBSCRIBE, ch)
+        sub.add(ch, "channel", since=client.clock)
 
     print(f"[{USERNAME}] assinando {USERNAME} + {channels}")
 
-    poller = zmq.Poller()
-    poller.register(sub, zmq.POLLIN)
-
     if AUTO:
-        # modo automático: manda 10 mensagens por vez em canais aleatórios
-        while True:
-            canal = random.choice(channels)
-            for i in range(10):
-                send_req(
-                    req,
-                    "publish",
-                    {
-                        "user": USERNAME,
-                        "channel": canal,
-                        "message": f"auto-msg {i} de {USERNAME} em #{canal}",
-                    },
-                )
-                time.sleep(0.05)
-
-            # vê se chegaram publicações enquanto isso
-            socks = dict(poller.poll(50))
-            if socks.get(sub) == zmq.POLLIN:
-                topic, raw = sub.recv_multipart()
-                try:
-                    payload = msgpack.unpackb(raw, raw=False)
-                    # atualiza relógio com clock da msg recebida
-                    update_clock(payload.get("clock", 0))
-                    print(f"[{USERNAME}] <- ({topic.decode()}) {payload}")
-                except Exception:
-                    pass
+        await asyncio.gather(auto_publish(client, channels), sub.run())
     else:
         # modo "somente ouvindo"
-        while True:
-            topic, raw = sub.recv_multipart()
-            try:
-                payload = msgpack.unpackb(raw, raw=False)
-                update_clock(payload.get("clock", 0))
-                print(f"[{USERNAME}] <- ({topic.decode()}) {payload}")
-            except Exception:
-                pass
+        await sub.run()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+"""
+Assinatura com retomada: SUB no proxy + catch-up pelo serviço replay.
+
+O SUB sozinho perde o que foi publicado antes da assinatura chegar ao
+proxy (slow joiner) ou enquanto a conexão estava caída. Aqui o cliente
+guarda o maior clock visto em cada tópico (canal ou o próprio nome, para
+mensagens diretas) e, a cada (re)conexão do SUB:
+
+  1. passa a guardar o que chega ao vivo num buffer;
+  2. pede ao servidor, em páginas, tudo de cada tópico depois desse clock
+     (serviço replay, seguindo o cursor de cada página);
+  3. entrega o buffer e volta ao modo ao vivo.
+
+Como a mesma mensagem pode vir pelo replay e pelo SUB, a entrega descarta
+repetições por (origin, clock). Reconexões esperam um atraso aleatório
+(até `jitter_ms`) antes do replay e respeitam o "busy" do servidor, para
+que todos os clientes de um proxy reiniciado não voltem de uma vez.
+
+Uso:
+    subs = Subscriber(client, ctx, "tcp://localhost:5558", on_message)
+    subs.add("general", "channel", since=client.clock)
+    subs.add("ana", "user", since=client.clock)
+    await subs.run()
+"""
+import asyncio
+import json
+import os
+import random
+import time
+from collections import OrderedDict
+
+import msgpack
+import zmq
+from zmq.utils.monitor import parse_monitor_message
+
+
+class Subscriber:
+    def __init__(self, client, ctx, xpub: str, on_message, state_path: str = None,
+                 page: int = 200, slack: int = 0, jitter_ms: float = 2000.0,
+                 buffer_max: int = 10000, dedup_max: int = 100000, rcvhwm: int = 10000):
+        self.client = client                 # AsyncClient (pedidos de replay)
+        self.on_message = on_message         # on_message(topic, payload)
+        self.state_path = state_path
+        self.page = max(1, int(page))
+        self.slack = max(0, int(slack))      # ticks a mais pedidos para trás no replay
+        self.jitter_s = jitter_ms / 1000.0
+        self.buffer_max = max(1, int(buffer_max))
+        self.dedup_max = max(1, int(dedup_max))
+
+        self.sub = ctx.socket(zmq.SUB)
+        # fila limitada: um cliente lento perde mensagens no proxy em vez de
+        # fazer a memória crescer sem limite (o replay só cobre reconexões)
+        self.sub.setsockopt(zmq.RCVHWM, int(rcvhwm))
+        self._monitor = self.sub.get_monitor_socket(zmq.EVENT_CONNECTED | zmq.EVENT_DISCONNECTED)
+        self.sub.connect(xpub)
+
+        self.topics = {}                     # tópico -> "channel" | "user"
+        self.last = self._load_state()       # tópico -> maior clock entregue
+        self._seen = OrderedDict()           # (origin, clock) já entregues
+        self._buffer = None                  # lista enquanto o replay roda
+        self._overflow = False
+        self._resume_wanted = asyncio.Event()
+        self._saved_at = 0.0
+
+    # ---------------------------
+    # Estado persistido (maior clock por tópico)
+    # ---------------------------
+
+    def _load_state(self) -> dict:
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not self.state_path or (not force and now - self._saved_at < 1.0):
+            return
+        self._saved_at = now
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.last, f)
+        os.replace(tmp, self.state_path)
+
+    # ---------------------------
+    # API
+    # ---------------------------
+
+    def add(self, topic: str, kind: str, since: int = 0) -> None:
+        """
+        Assina `topic` (kind "channel" ou "user"). `since` vale só para
+        um tópico sem clock salvo: o replay começa depois dele.
+        """
+        self.topics[topic] = kind
+        self.last.setdefault(topic, int(since))
+        self.sub.setsockopt_string(zmq.SUBSCRIBE, topic)
+
+    async def run(self) -> None:
+        """Lê o SUB, acompanha (re)conexões e faz o replay de cada uma."""
+        await asyncio.gather(self._read(), self._watch(), self._resumer())
+
+    def close(self) -> None:
+        self._save_state(force=True)
+        self.sub.disable_monitor()
+        self._monitor.close(0)
+        self.sub.close(0)
+
+    # ---------------------------
+    # Entrega (sem repetir)
+    # ---------------------------
+
+    def _deliver(self, topic: str, payload: dict) -> None:
+        key = (payload.get("origin"), payload.get("clock"))
+        if key in self._seen:
+            return
+        self._seen[key] = None
+        if len(self._seen) > self.dedup_max:
+            self._seen.popitem(last=False)
+
+        clock = int(payload.get("clock") or 0)
+        if clock > self.last.get(topic, 0):
+            self.last[topic] = clock
+        self.client.observe(clock)
+        self.on_message(topic, payload)
+        self._save_state()
+
+    async def _read(self) -> None:
+        while True:
+            frames = await self.sub.recv_multipart()
+            if len(frames) < 2:
+                continue
+            try:
+                topic = frames[0].decode("utf-8")
+                payload = msgpack.unpackb(frames[1], raw=False)
+            except Exception:
+                continue
+            if self._buffer is None:
+                self._deliver(topic, payload)
+            elif len(self._buffer) < self.buffer_max:
+                self._buffer.append((topic, payload))
+            else:
+                # o que ficou de fora está no log: o replay passa de novo
+                self._overflow = True
+
+    # ---------------------------
+    # Reconexão e replay
+    # ---------------------------
+
+    async def _watch(self) -> None:
+        first = True
+        while True:
+            event = parse_monitor_message(await self._monitor.recv_multipart())
+            if event["event"] != zmq.EVENT_CONNECTED:
+                continue
+            if not first:
+                # todos os clientes de um proxy reiniciado reconectam juntos
+                await asyncio.sleep(random.uniform(0, self.jitter_s))
+            first = False
+            # as assinaturas chegam ao proxy antes do replay ler o fim do log
+            await asyncio.sleep(0.1)
+            self._resume_wanted.set()
+
+    async def _resumer(self) -> None:
+        while True:
+            await self._resume_wanted.wait()
+            self._resume_wanted.clear()
+            self._buffer = []
+            # ponto de partida fixo: uma segunda passada (buffer cheio) não
+            # pode começar do maior clock já entregue e pular os menores
+            starts = {t: max(0, self.last.get(t, 0) - self.slack) for t in self.topics}
+            try:
+                while True:
+                    self._overflow = False
+                    for topic, kind in list(self.topics.items()):
+                        await self._replay(topic, kind, starts.get(topic, 0))
+                    if not self._overflow:
+                        break
+                    self._buffer = []
+            finally:
+                buffered, self._buffer = self._buffer, None
+                for topic, payload in buffered:
+                    self._deliver(topic, payload)
+                self._save_state(force=True)
+
+    async def _replay(self, topic: str, kind: str, since: int) -> None:
+        cursor = None
+        while True:
+            try:
+                reply = await self.client.request("replay", {
+                    "channel" if kind == "channel" else "user": topic,
+                    "since_clock": since,
+                    "cursor": cursor,
+                    "limit": self.page,
+                })
+            except TimeoutError:
+                await asyncio.sleep(random.uniform(0.5, 1.0) * self.jitter_s)
+                continue
+            data = reply.get("data") or {}
+            if data.get("status") == "busy":
+                delay = float(data.get("retry_after_ms") or 100) / 1000.0
+                await asyncio.sleep(delay * random.uniform(1.0, 2.0))
+                continue
+            if data.get("status") != "OK":
+                return
+            for payload in data.get("messages") or []:
+                self._deliver(topic, payload)
+            if not data.get("more"):
+                return
+            cursor = data.get("cursor")
@@ -1,15 +1,44 @@
 import os
+import sys
 import json
+import time
 from datetime import datetime
 
 import zmq
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+
+from clock import LamportClock  # noqa: E402
+
 DATA = os.getenv("PERSIST_DIR", "./data")
+BIND = os.getenv("REF_BIND", "tcp://*:6000")
 os.makedirs(DATA, exist_ok=True)
 
 SERVERS_FILE = os.path.join(DATA, "ref_servers.json")
 
-logical_clock = 0
+# heartbeats ficam em memória; o arquivo é gravado a cada N segundos (se
+# algo mudou) e na hora quando um servidor novo se registra
+CHECKPOINT_INTERVAL = float(os.getenv("REF_CHECKPOINT_S", "5"))
+# servidor sem heartbeat por esse tempo sai da lista (e da eleição)
+EXPIRE_AFTER = float(os.getenv("REF_EXPIRE_S", "15"))
+# mudanças guardadas para o list incremental; mais antigas = lista completa
+CHANGES_MAX = 4096
+
+logical_clock = LamportClock()
+
+# ---------------------------
+# Estado dos servidores
+# ---------------------------
+
+servers = {}        # nome -> {"rank", "last_beat", "addr"} (o que vai para o arquivo)
+beats = {}          # nome -> instante do último heartbeat (monotônico)
+alive = set()       # servidores que estão na lista
+version = 0         # versão da lista; muda a cada entrada/saída/alteração
+changes = []        # (versão, nome) em ordem, para o list incremental
+horizon = 0         # versões <= horizon já não estão em `changes`
+dirty = False
+last_checkpoint = 0.0
+last_sweep = 0.0
 
 
 def ts() -> str:
@@ -23,108 +52,204 @@ def load_servers():
 
 
 def save_servers(servers):
-    json.dump(servers, open(SERVERS_FILE, "w", encoding="utf-8"))
+    tmp = SERVERS_FILE + ".tmp"
+    json.dump(servers, open(tmp, "w", encoding="utf-8"))
+    os.replace(tmp, SERVERS_FILE)
 
 
-def update_clock(remote_clock: int):
-    global logical_clock
-    logical_clock = max(logical_clock, int(remote_clock or 0)) + 1
+def changed(name: str) -> None:
+    """Registra uma mudança na lista (entrada, saída ou novo endereço)."""
+    global version, horizon
+    version += 1
+    changes.append((version, name))
+    if len(changes) > CHANGES_MAX:
+        drop = len(changes) - CHANGES_MAX // 2
+        horizon = changes[drop - 1][0]
+        del changes[:drop]
 
 
-def next_clock() -> int:
-    global logical_clock
-    logical_clock += 1
-    return logical_clock
+def listing(since):
+    """
+    Lista de servidores vivos. Com `since` dentro do histórico de
+    mudanças, devolve só o que mudou depois dele (e quem saiu).
+    """
+    if since is None or since < horizon or since > version:
+        return {n: servers[n] for n in alive}, [], False
 
+    names = set()
+    for v, name in reversed(changes):
+        if v <= since:
+            break
+        names.add(name)
+    delta = {n: servers[n] for n in names if n in alive}
+    removed = sorted(n for n in names if n not in alive)
+    return delta, removed, True
 
-def main():
-    ctx = zmq.Context.instance()
-    rep = ctx.socket(zmq.REP)
-    rep.bind("tcp://*:6000")
 
-    servers = load_servers()
+def expire(now: float) -> None:
+    """Tira da lista quem parou de mandar heartbeat (varredura a cada 1s)."""
+    global last_sweep
+    if now - last_sweep < 1.0:
+        return
+    last_sweep = now
+    for name in [n for n in alive if now - beats.get(n, 0) > EXPIRE_AFTER]:
+        alive.discard(name)
+        changed(name)
+        print(f"[ref] servidor {name} sem heartbeat há {EXPIRE_AFTER:.0f}s; removido da lista")
 
-    print("[ref] servidor de referência iniciado em tcp://*:6000")
 
-    while True:
-        msg = rep.recv_json()
-        service = msg.get("service")
-        data = msg.get("data", {}) or {}
-
-        update_clock(data.get("clock", 0))
-
-        if service == "rank":
-            # registra servidor se ainda não existir, com próximo rank
-            name = data.get("user")
-            if name and name not in servers:
-                rank = len(servers) + 1
-                servers[name] = {
-                    "rank": rank,
-                    "last_beat": ts(),
-                }
-                save_servers(servers)
+def checkpoint(now: float, force: bool = False) -> None:
+    global dirty, last_checkpoint
+    if dirty and (force or now - last_checkpoint >= CHECKPOINT_INTERVAL):
+        save_servers(servers)
+        dirty = False
+        last_checkpoint = now
 
-            reply = {
-                "service": "rank",
-                "data": {
-                    "rank": servers.get(name, {}).get("rank"),
-                    "timestamp": ts(),
-                    "clock": next_clock(),
-                },
-            }
-            rep.send_json(reply)
-
-        elif service == "list":
-            # devolve lista de servidores e ranks
-            reply = {
-                "service": "list",
-                "data": {
-                    "list": servers,
-                    "timestamp": ts(),
-                    "clock": next_clock(),
-                },
-            }
-            rep.send_json(reply)
-
-        elif service == "heartbeat":
-            # atualiza last_beat do servidor
-            name = data.get("user")
-            if name in servers:
-                servers[name]["last_beat"] = ts()
-                save_servers(servers)
-
-            reply = {
-                "service": "heartbeat",
-                "data": {
-                    "timestamp": ts(),
-                    "clock": next_clock(),
-                },
+
+# ---------------------------
+# Serviços
+# ---------------------------
+
+def handle(service: str, data: dict) -> dict:
+    global dirty
+    now = time.monotonic()
+
+    if service == "rank":
+        # registra servidor se ainda não existir, com próximo rank
+        name = data.get("user")
+        if name and name not in servers:
+            rank = len(servers) + 1
+            servers[name] = {
+                "rank": rank,
+                "last_beat": ts(),
             }
-            rep.send_json(reply)
-
-        elif service == "clock":
-            # usado para sincronização de relógio (Berkeley simpli.)
-            reply = {
-                "service": "clock",
-                "data": {
-                    "time": ts(),
+            dirty = True
+        # endereço de repasse entre servidores (particionamento)
+        addr = data.get("addr")
+        if name in servers and addr and servers[name].get("addr") != addr:
+            servers[name]["addr"] = addr
+            dirty = True
+            if name in alive:
+                changed(name)
+        if name in servers:
+            beats[name] = now
+            if name not in alive:
+                alive.add(name)
+                changed(name)
+        # registro novo vai para o disco na hora
+        checkpoint(now, force=True)
+
+        return {
+            "rank": servers.get(name, {}).get("rank"),
+            "version": version,
+            "timestamp": ts(),
+        }
+
+    if service == "list":
+        # lista completa, ou só o que mudou desde `since_version`
+        since = data.get("since_version")
+        if since is not None:
+            try:
+                since = int(since)
+            except (TypeError, ValueError):
+                return {
+                    "status": "erro",
+                    "message": "since_version inválido",
                     "timestamp": ts(),
-                    "clock": next_clock(),
-                },
-            }
-            rep.send_json(reply)
+                }
+        entries, removed, is_delta = listing(since)
+        return {
+            "list": entries,
+            "removed": removed,
+            "delta": is_delta,
+            "version": version,
+            "timestamp": ts(),
+        }
+
+    if service == "heartbeat":
+        # só em memória: o arquivo é gravado no próximo checkpoint. Um
+        # supervisor (SERVER_PROCESSES) manda um só por todos os workers
+        names = data.get("users") or [data.get("user")]
+        for name in names:
+            if name not in servers:
+                continue
+            beats[name] = now
+            servers[name]["last_beat"] = ts()
+            dirty = True
+            if name not in alive:
+                alive.add(name)
+                changed(name)
+                print(f"[ref] servidor {name} voltou")
+
+        return {
+            "version": version,   # o servidor só pede o list se a versão mudou
+            "timestamp": ts(),
+        }
 
-        else:
-            reply = {
-                "service": service,
-                "data": {
+    if service == "clock":
+        # usado para sincronização de relógio (Berkeley simpli.)
+        return {
+            "time": ts(),
+            "timestamp": ts(),
+        }
+
+    return {
+        "status": "erro",
+        "message": "serviço desconhecido",
+        "timestamp": ts(),
+    }
+
+
+def main():
+    global version, horizon
+    ctx = zmq.Context.instance()
+    # ROUTER: atende vários servidores intercalados (cada um com seu REQ)
+    router = ctx.socket(zmq.ROUTER)
+    router.bind(BIND)
+
+    # versões partem do relógio: depois de um restart do ref, versões
+    # antigas em cache nos servidores ficam abaixo do horizonte (lista completa)
+    version = horizon = int(time.time() * 1000)
+
+    servers.update(load_servers())
+    # quem estava no arquivo ganha um prazo para mandar o primeiro heartbeat
+    now = time.monotonic()
+    for name in servers:
+        beats[name] = now
+        alive.add(name)
+        changed(name)
+
+    print(f"[ref] servidor de referência iniciado em {BIND}")
+
+    while True:
+        if router.poll(1000):
+            frames = router.recv_multipart()
+            envelope, body = frames[:-1], frames[-1]
+            try:
+                msg = json.loads(body)
+                service = msg.get("service")
+                data = msg.get("data", {}) or {}
+            except (ValueError, AttributeError):
+                service, data = None, {}
+
+            # o ref atende todos os servidores: um pedido inválido vira
+            # resposta de erro, sem derrubar o loop
+            try:
+                logical_clock.observe(data.get("clock", 0))
+                rdata = handle(service, data)
+            except Exception as e:
+                rdata = {
                     "status": "erro",
-                    "message": "serviço desconhecido",
+                    "message": f"requisição inválida: {e}",
                     "timestamp": ts(),
-                    "clock": next_clock(),
-                },
-            }
-            rep.send_json(reply)
+                }
+            rdata["clock"] = logical_clock.tick()
+            reply = {"service": service, "data": rdata}
+            router.send_multipart(envelope + [json.dumps(reply).encode("utf-8")])
+
+        now = time.monotonic()
+        expire(now)
+        checkpoint(now)
 
 
 if __name__ == "__main__":
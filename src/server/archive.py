@@ -0,0 +1,71 @@
+"""
+Compressão dos segmentos arquivados.
+
+Usa zstd (pacote `zstandard`) ou lz4 (pacote `lz4`) se estiverem
+instalados e, sem eles, zlib da biblioteca padrão. O codec vai na
+extensão do arquivo (.zst, .lz4, .z), então um arquivo gravado com um
+codec continua legível depois de trocar a preferência, desde que o
+pacote dele esteja instalado.
+
+Uso:
+    codec = pick("auto")
+    comp = compressor(codec)
+    out.write(comp.compress(chunk)); out.write(comp.flush())
+    data = decompress(codec, raw)
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4frame
+except ImportError:
+    lz4frame = None
+
+# preferência do "auto": melhor razão/velocidade primeiro
+PREFERENCE = ("zst", "lz4", "z")
+
+
+def available() -> list:
+    """Codecs com o pacote instalado, na ordem de preferência."""
+    have = {"zst": zstandard is not None, "lz4": lz4frame is not None, "z": True}
+    return [c for c in PREFERENCE if have[c]]
+
+
+def pick(preferred: str = "auto") -> str:
+    """Codec pedido ("zst", "lz4", "z") se disponível; senão o melhor que houver."""
+    codecs = available()
+    return preferred if preferred in codecs else codecs[0]
+
+
+class _Lz4:
+    def __init__(self):
+        self._comp = lz4frame.LZ4FrameCompressor()
+        self._header = self._comp.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        header, self._header = self._header, b""
+        return header + self._comp.compress(data)
+
+    def flush(self) -> bytes:
+        return self._header + self._comp.flush()
+
+
+def compressor(codec: str):
+    """Objeto com compress(bloco) e flush(), para comprimir em blocos."""
+    if codec == "zst":
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    if codec == "lz4":
+        return _Lz4()
+    return zlib.compressobj(6)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zst":
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if codec == "lz4":
+        return lz4frame.decompress(data)
+    return zlib.decompress(data)
@@ -0,0 +1,215 @@
+"""
+Cache das mensagens recentes de cada canal (histórico quente).
+
+Quem entra ou reconecta pede as últimas N mensagens dos canais mais
+usados (general, random, dev...). Sem cache, cada pedido relê o fim do
+log. Aqui cada canal consultado tem um anel com os últimos
+`per_key` registros, como os bytes MessagePack do log (prontos para
+sair num frame ou dentro de uma resposta, sem decodificar):
+
+  - o anel é alimentado pelo gancho do SegmentStore (on_append), então
+    recebe tanto as publicações locais quanto as réplicas aplicadas, na
+    ordem do log;
+  - um canal entra no cache na primeira leitura (o fim do log é lido
+    uma vez) e sai quando a soma dos anéis passa de `max_bytes`: sai o
+    canal lido há mais tempo (LRU). Um anel sozinho nunca passa de
+    `max_bytes` (perde os registros mais antigos), senão seria despejado
+    logo depois de montado e remontado a cada leitura;
+  - a montagem não espera o group commit: o anel passa a receber as
+    gravações na hora, mas o fim do log só é lido quando o disco tiver o
+    que já estava na fila antes dele (SegmentStore.queued_ends); até lá
+    as leituras do canal vão ao log;
+  - `floor` é o maior clock do canal que não está no anel. Uma leitura
+    "clock > since" com since >= floor sai toda do anel; "últimas N"
+    sai do anel se ele tiver N registros ou o canal inteiro;
+  - o anel guarda o primeiro segmento visível do canal quando foi
+    montado. Se a retenção (set_floors) ou o limite de disco (drop)
+    esconder segmentos depois disso, o anel pode ter registros que o
+    log já não devolve: ele é descartado e remontado na próxima leitura.
+
+Acertos e faltas vão para as métricas hot_cache_hits_total/misses_total.
+"""
+import threading
+from collections import OrderedDict, deque
+from itertools import islice
+
+import metrics
+
+ENTRY_OVERHEAD = 96          # bytes por registro além do payload (tupla, objeto bytes)
+
+
+class _Ring:
+    __slots__ = ("records", "nbytes", "floor", "cut", "warming", "pending", "loading")
+
+    def __init__(self):
+        self.records = deque()   # (clock, payload) na ordem do log
+        self.nbytes = 0
+        self.floor = 0           # maior clock do canal fora do anel
+        self.cut = 0             # primeiro segmento visível do canal na montagem
+        self.warming = []        # gravações que chegam enquanto o fim do log é lido (None = pronto)
+        self.pending = None      # {seq: fim} enfileirado antes do anel, a esperar no disco
+        self.loading = False     # uma thread está lendo o fim do log
+
+
+class HotCache:
+    def __init__(self, store, max_bytes: int = 64 * 1024 * 1024, per_key: int = 1000):
+        self.store = store                   # SegmentStore das publicações
+        self.max_bytes = int(max_bytes)
+        self.per_key = max(1, int(per_key))
+
+        self.lock = threading.Lock()
+        self._rings = OrderedDict()          # canal -> _Ring (LRU pelas leituras)
+        self.nbytes = 0
+
+        self._hits = metrics.counter("hot_cache_hits_total")
+        self._misses = metrics.counter("hot_cache_misses_total")
+        self._evictions = metrics.counter("hot_cache_evictions_total")
+        metrics.gauge("hot_cache_bytes", fn=lambda: self.nbytes)
+        metrics.gauge("hot_cache_channels", fn=lambda: len(self._rings))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    # ---------------------------
+    # Alimentação (gancho do store)
+    # ---------------------------
+
+    def add(self, records: list) -> None:
+        """Gancho do SegmentStore: [(canal, clock, seq, offset, payload)] recém-gravados."""
+        with self.lock:
+            for key, clock, seq, pos, payload in records:
+                ring = self._rings.get(key)
+                if ring is None:
+                    continue
+                if ring.warming is not None:
+                    ring.warming.append((seq, pos, clock, bytes(payload)))
+                    continue
+                self._push(ring, clock, bytes(payload))
+            self._evict()
+
+    def _push(self, ring: _Ring, clock: int, raw: bytes) -> None:
+        ring.records.append((clock, raw))
+        size = len(raw) + ENTRY_OVERHEAD
+        ring.nbytes += size
+        self.nbytes += size
+        while len(ring.records) > self.per_key or (ring.nbytes > self.max_bytes and ring.records):
+            old, raw = ring.records.popleft()
+            if old > ring.floor:
+                ring.floor = old
+            size = len(raw) + ENTRY_OVERHEAD
+            ring.nbytes -= size
+            self.nbytes -= size
+
+    def _evict(self) -> None:
+        while self.nbytes > self.max_bytes and self._rings:
+            _, ring = self._rings.popitem(last=False)
+            self.nbytes -= ring.nbytes
+            self._evictions.inc()
+
+    def warm(self, key: str) -> bool:
+        """
+        Põe o canal no cache com os últimos `per_key` registros do log.
+        Não bloqueia: devolve False enquanto o que foi enfileirado antes
+        do anel não estiver no disco (a próxima leitura tenta de novo).
+        """
+        with self.lock:
+            ring = self._rings.get(key)
+            if ring is None:
+                ring = self._rings[key] = _Ring()
+                new = True
+            elif ring.warming is None:
+                return True
+            else:
+                new = False
+        if new:
+            # capturado depois de o anel existir: o que for enfileirado
+            # daqui em diante passa pelo gancho (warming)
+            ring.pending = self.store.queued_ends()
+        if ring.pending is None or not self.store.written_to(ring.pending):
+            return False
+        with self.lock:
+            if self._rings.get(key) is not ring or ring.warming is None or ring.loading:
+                return False
+            ring.loading = True
+        try:
+            cut = self.store.first_seq(key)
+            clocks = []
+            views, floor, ends = self.store.tail(key, self.per_key, clocks)
+            records = [(clock, bytes(v)) for clock, v in zip(clocks, views)]
+        except Exception:
+            with self.lock:
+                if self._rings.get(key) is ring:
+                    del self._rings[key]
+            raise
+
+        with self.lock:
+            if self._rings.get(key) is not ring:
+                return False     # despejado enquanto lia
+            ring.floor = floor
+            ring.cut = cut
+            for clock, raw in records:
+                self._push(ring, clock, raw)
+            # o que ficou depois do fim lido de cada segmento chegou pelo gancho
+            for seq, pos, clock, raw in ring.warming:
+                if pos >= ends.get(seq, 0):
+                    self._push(ring, clock, raw)
+            ring.warming = None
+            ring.pending = None
+            self._evict()
+        return True
+
+    # ---------------------------
+    # Leituras
+    # ---------------------------
+
+    def read(self, key: str, since: int, limit: int, last: bool = False,
+             max_bytes: int = None, clocks: list = None):
+        """
+        Payloads do canal do anel: as últimas `limit` (last=True) ou as
+        com clock > since, até `limit` e `max_bytes`, na ordem do log.
+        Canal fora do cache entra nele (lendo o fim do log uma vez).
+        Devolve None se o anel não cobrir o pedido (leia do log).
+        """
+        out = self._read(key, since, limit, last, max_bytes, clocks)
+        if out is not None:
+            self._hits.inc()
+            return out
+        self._misses.inc()
+        ring = self._rings.get(key)
+        if ring is not None and ring.warming is None:
+            return None          # anel pronto, mas não cobre o pedido
+        if not self.warm(key):
+            return None
+        return self._read(key, since, limit, last, max_bytes, clocks)
+
+    def _read(self, key, since, limit, last, max_bytes, clocks):
+        with self.lock:
+            ring = self._rings.get(key)
+            if ring is None or ring.warming is not None:
+                return None
+            if self.store.first_seq(key) > ring.cut:
+                # a retenção escondeu parte do canal: o anel sai e é remontado
+                del self._rings[key]
+                self.nbytes -= ring.nbytes
+                return None
+            if last:
+                if len(ring.records) < limit and ring.floor > 0:
+                    return None
+                records = list(islice(ring.records, max(0, len(ring.records) - limit), None))
+            else:
+                if since < ring.floor:
+                    return None
+                records, taken = [], 0
+                for clock, raw in ring.records:
+                    if clock <= since:
+                        continue
+                    if len(records) >= limit or (max_bytes is not None and records
+                                                 and taken + len(raw) > max_bytes):
+                        break
+                    records.append((clock, raw))
+                    taken += len(raw)
+            self._rings.move_to_end(key)
+        if clocks is not None:
+            clocks.extend(clock for clock, _ in records)
+        return [raw for _, raw in records]
@@ -0,0 +1,348 @@
+"""
+Caixa de entrada das mensagens diretas: índice denso por destinatário.
+
+As mensagens diretas ficam no store `messages/`, misturadas de todos os
+destinatários. O índice esparso do store acha onde começar, mas a
+leitura ainda passa pelos registros dos outros usuários no caminho.
+Aqui cada destinatário tem um array com (clock, segmento, offset) de
+cada mensagem dele, então buscar as não lidas custa proporcional ao que
+volta: bisect no array + leitura direta de cada posição
+(SegmentStore.read_at).
+
+  - disco: `inbox/<hash do usuário>.inbox`, registros fixos de 20 bytes
+    (clock u64, segmento u32, offset u64), só com append. O checkpoint
+    (`inbox/checkpoint.json`) diz até onde do log os arrays estão
+    gravados; na partida o que veio depois é reindexado a partir do
+    próprio log (o índice é derivado dele);
+  - memória: os arrays dos últimos `cache_users` usuários consultados
+    (LRU), ordenados por clock e só com as mensagens não lidas;
+  - confirmação (ack): um clock por usuário, "li tudo até aqui". Fica
+    num dict em memória e num journal (`acks.<geração>.journal` +
+    `acks.json`, como o registry) e é replicada; como só cresce
+    (máximo), os servidores convergem em qualquer ordem de entrega.
+
+Uma réplica que chega com clock abaixo do ack do destinatário conta
+como lida, como no since_clock do history.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+ENTRY = struct.Struct(">QIQ")
+
+_JOURNAL_RE = re.compile(r"\.(\d+)\.journal$")
+
+
+class _Inbox:
+    """Mensagens não lidas de um usuário, em ordem de clock."""
+
+    __slots__ = ("clocks", "seqs", "positions")
+
+    def __init__(self):
+        self.clocks = array("Q")
+        self.seqs = array("I")
+        self.positions = array("Q")
+
+    def add(self, clock: int, seq: int, pos: int) -> None:
+        if not self.clocks or clock >= self.clocks[-1]:
+            self.clocks.append(clock)
+            self.seqs.append(seq)
+            self.positions.append(pos)
+            return
+        # réplica atrasada: entra no lugar do seu clock
+        i = bisect_right(self.clocks, clock)
+        self.clocks.insert(i, clock)
+        self.seqs.insert(i, seq)
+        self.positions.insert(i, pos)
+
+    def trim(self, acked: int) -> None:
+        """Descarta as já lidas (clock <= acked)."""
+        i = bisect_right(self.clocks, acked)
+        if i:
+            del self.clocks[:i]
+            del self.seqs[:i]
+            del self.positions[:i]
+
+
+class InboxIndex:
+    def __init__(self, directory: str, store, writer, cache_users: int = 1024,
+                 compact_every: int = 10000, fsync: bool = False):
+        self.directory = directory
+        self.store = store                   # SegmentStore das mensagens diretas
+        self.writer = writer
+        self.cache_users = max(1, int(cache_users))
+        self.compact_every = max(1, int(compact_every))
+        self.fsync = fsync
+
+        self.lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # gravação dos arrays x carga de um usuário
+        self._cache = OrderedDict()          # usuário -> _Inbox (LRU)
+        self._pending = {}                   # usuário -> [(clock, seq, offset)] ainda não gravados
+        self._position = None                # (seq, offset) do último registro indexado
+        self._saved = None                   # posição do último checkpoint gravado
+        self.acks = {}                       # usuário -> maior clock confirmado
+        self.generation = 0
+        self.pending_acks = 0                # linhas no journal da geração atual
+
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.acks_path = os.path.join(directory, "acks.json")
+        os.makedirs(directory, exist_ok=True)
+
+    # ---------------------------
+    # Partida
+    # ---------------------------
+
+    def _path(self, user: str) -> str:
+        digest = hashlib.blake2b(user.encode("utf-8"), digest_size=12).hexdigest()
+        return os.path.join(self.directory, f"{digest}.inbox")
+
+    def _journal(self, gen: int) -> str:
+        return os.path.join(self.directory, f"acks.{gen}.journal")
+
+    def open(self) -> "InboxIndex":
+        """
+        Carrega as confirmações, reindexa a cauda do log depois do
+        checkpoint e passa a receber as gravações do store.
+        """
+        self._load_acks()
+
+        seq, pos = 0, 0
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                seq, pos = json.load(f)["position"]
+            self._saved = (seq, pos)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        # arrays podem ter sido gravados depois do checkpoint (queda entre
+        # um e outro): o último registro de cada arquivo evita duplicar
+        last = {}
+        for key, clock, rseq, rpos in self.store.locations(seq, pos):
+            if (rseq, rpos) == self._saved:
+                continue
+            if key not in last:
+                last[key] = self._last_entry(key)
+            if (rseq, rpos) > last[key]:
+                self._pending.setdefault(key, []).append((clock, rseq, rpos))
+            self._position = (rseq, rpos)
+        self.flush()
+
+        self.store.on_append = self.add
+        return self
+
+    def _last_entry(self, user: str) -> tuple:
+        """(seq, offset) do último registro gravado no array do usuário."""
+        try:
+            with open(self._path(user), "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                size -= size % ENTRY.size
+                if size == 0:
+                    return (-1, -1)
+                f.seek(size - ENTRY.size)
+                _, seq, pos = ENTRY.unpack(f.read(ENTRY.size))
+                return (seq, pos)
+        except FileNotFoundError:
+            return (-1, -1)
+
+    def _load_acks(self) -> None:
+        if os.path.exists(self.acks_path):
+            with open(self.acks_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            self.acks = {u: int(c) for u, c in state.get("acks", {}).items()}
+            self.generation = int(state.get("journal", 0))
+
+        journals = []
+        for path in glob.glob(glob.escape(self.directory) + "/acks.*.journal"):
+            m = _JOURNAL_RE.search(path)
+            if m:
+                journals.append((int(m.group(1)), path))
+
+        replayed = 0
+        for gen, path in sorted(journals):
+            if gen < self.generation:
+                os.remove(path)      # já está no acks.json
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break        # última linha incompleta
+                    user, clock = entry.get("user"), int(entry.get("clock") or 0)
+                    if clock > self.acks.get(user, 0):
+                        self.acks[user] = clock
+                    replayed += 1
+            self.generation = max(self.generation, gen)
+        if replayed:
+            self.compact()
+
+    # ---------------------------
+    # Índice
+    # ---------------------------
+
+    def add(self, records: list) -> None:
+        """Gancho do SegmentStore: [(destinatário, clock, seq, offset, payload)] recém-gravados."""
+        with self.lock:
+            for user, clock, seq, pos, _ in records:
+                self._pending.setdefault(user, []).append((clock, seq, pos))
+                inbox = self._cache.get(user)
+                if inbox is not None and clock > self.acks.get(user, 0):
+                    inbox.add(clock, seq, pos)
+            self._position = (records[-1][2], records[-1][3])
+
+    def _get(self, user: str) -> _Inbox:
+        """Array de não lidas do usuário (do LRU ou do disco)."""
+        with self.lock:
+            inbox = self._cache.get(user)
+            if inbox is not None:
+                self._cache.move_to_end(user)
+                return inbox
+
+        with self._flush_lock:
+            path = self._path(user)
+            try:
+                with open(path, "rb") as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                raw = b""
+            raw = raw[:len(raw) - len(raw) % ENTRY.size]
+            entries = list(ENTRY.iter_unpack(raw))
+
+            with self.lock:
+                acked = self.acks.get(user, 0)
+                first = self.store.segments[0].seq
+                unread = [e for e in entries + self._pending.get(user, [])
+                          if e[0] > acked and e[1] >= first]
+                unread.sort(key=lambda e: e[0])
+                inbox = _Inbox()
+                for clock, seq, pos in unread:
+                    inbox.add(clock, seq, pos)
+                self._cache[user] = inbox
+                while len(self._cache) > self.cache_users:
+                    self._cache.popitem(last=False)
+
+            # mais da metade do arquivo já lida ou apagada: reescreve só o resto
+            kept = [e for e in entries if e[0] > acked and e[1] >= first]
+            if len(entries) >= 256 and len(kept) * 2 < len(entries):
+                tmp = path + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(b"".join(ENTRY.pack(*e) for e in kept))
+                os.replace(tmp, path)
+        return inbox
+
+    def flush(self) -> None:
+        """Grava nos arrays do disco o que foi indexado desde o último flush."""
+        with self._flush_lock:
+            with self.lock:
+                pending, self._pending = self._pending, {}
+                position = self._position
+            for user, entries in pending.items():
+                with open(self._path(user), "ab") as f:
+                    f.write(b"".join(ENTRY.pack(*e) for e in entries))
+                    if self.fsync:
+                        f.flush()
+                        os.fsync(f.fileno())
+            if position is not None and position != self._saved:
+                tmp = self.checkpoint_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"position": list(position)}, f)
+                os.replace(tmp, self.checkpoint_path)
+                self._saved = position
+
+    def start(self, interval_s: float = 1.0) -> "InboxIndex":
+        """Thread que grava os arrays a cada `interval_s` segundos."""
+        def run():
+            while True:
+                time.sleep(interval_s)
+                self.flush()
+        threading.Thread(target=run, name="inbox", daemon=True).start()
+        return self
+
+    # ---------------------------
+    # Consultas
+    # ---------------------------
+
+    def fetch(self, user: str, limit: int, max_bytes: int = None) -> dict:
+        """
+        Até `limit` mensagens não lidas do usuário, em ordem de clock:
+        {"messages": [payloads], "clocks", "unread" (antes desta página), "more"}.
+        """
+        inbox = self._get(user)
+        with self.lock:
+            acked = self.acks.get(user, 0)
+            i = bisect_right(inbox.clocks, acked)
+            n = min(limit, len(inbox.clocks) - i)
+            locations = list(zip(inbox.seqs[i:i + n], inbox.positions[i:i + n]))
+            unread = len(inbox.clocks) - i
+        clocks = []
+        views, used = self.store.read_at(user, locations, max_bytes, clocks)
+        return {"messages": views, "clocks": clocks, "unread": unread, "more": used < unread}
+
+    def unread(self, user: str) -> int:
+        inbox = self._get(user)
+        with self.lock:
+            return len(inbox.clocks) - bisect_right(inbox.clocks, self.acks.get(user, 0))
+
+    def acked(self, user: str) -> int:
+        return self.acks.get(user, 0)
+
+    # ---------------------------
+    # Confirmações
+    # ---------------------------
+
+    def ack(self, user: str, clock: int, result=None):
+        """
+        Marca como lidas as mensagens do usuário com clock <= `clock`.
+        Devolve o Future da linha no journal (com `result`), ou None se
+        não avançou (confirmação repetida ou mais antiga).
+        """
+        if not user:
+            return None
+        clock = int(clock)
+        compact = False
+        with self.lock:
+            if clock <= self.acks.get(user, 0):
+                return None
+            self.acks[user] = clock
+            inbox = self._cache.get(user)
+            if inbox is not None:
+                inbox.trim(clock)
+            fut = self.writer.append(self._journal(self.generation), {"user": user, "clock": clock}, result)
+            self.pending_acks += 1
+            if self.pending_acks >= self.compact_every:
+                compact = True
+                self.pending_acks = 0
+        if compact:
+            self.compact()
+        return fut
+
+    def compact(self) -> None:
+        """Grava todas as confirmações em acks.json e passa o journal para uma geração nova."""
+        with self.lock:
+            old = self.generation
+            self.generation += 1
+            self.pending_acks = 0
+            state = {"acks": dict(self.acks), "journal": self.generation}
+
+        tmp = self.acks_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.acks_path)
+
+        path = self._journal(old)
+        self.writer.release(path).add_done_callback(lambda _: _remove(path))
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,171 @@
+"""
+Escritor de log com group commit.
+
+Substitui o open/append/close por mensagem: os registros entram numa fila
+e uma thread dedicada grava em lotes nos arquivos (mantidos abertos),
+com fsync opcional por lote. Cada append devolve um Future que só é
+resolvido quando o lote que contém o registro foi gravado.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+
+
+class LogWriter:
+    """
+    Política de flush:
+      - batch_max: grava assim que o lote atinge N registros;
+      - flush_ms:  espera no máximo T ms por mais registros depois do
+                   primeiro do lote (0 = grava o que já estiver na fila);
+      - fsync:     faz os.fsync em cada arquivo tocado pelo lote.
+
+    `on_batch`, se definido, é chamado na thread de escrita depois que os
+    Futures de cada lote foram resolvidos (um aviso por lote, não por registro).
+    """
+
+    def __init__(self, batch_max: int = 512, flush_ms: float = 0.0, fsync: bool = False):
+        self.batch_max = max(1, int(batch_max))
+        self.flush_s = max(0.0, float(flush_ms)) / 1000.0
+        self.fsync = fsync
+        self.on_batch = None
+
+        self._queue = queue.SimpleQueue()
+        self._write_ms = metrics.histogram("log_write_ms")
+        self._records = metrics.counter("log_records_total")
+        metrics.gauge("log_queue_depth", fn=self._queue.qsize)
+        self._files = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    # ---------------------------
+    # API
+    # ---------------------------
+
+    def append(self, path: str, obj: dict, result=None) -> Future:
+        """
+        Enfileira uma linha JSONL para `path`. O Future devolvido recebe
+        `result` quando o lote estiver gravado (ou a exceção de I/O).
+        """
+        line = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        return self.append_raw(path, line, result)
+
+    def append_raw(self, path: str, data: bytes, result=None) -> Future:
+        """Enfileira bytes já codificados (o chamador inclui o separador)."""
+        fut = Future()
+        if self._closed:
+            fut.set_exception(RuntimeError("log fechado"))
+            return fut
+        self._queue.put((path, data, result, fut))
+        return fut
+
+    def release(self, path: str) -> Future:
+        """Fecha o arquivo depois de gravar o que já foi enfileirado para ele."""
+        fut = Future()
+        self._queue.put((path, None, None, fut))
+        return fut
+
+    def flush(self, timeout: float = None) -> None:
+        """Bloqueia até tudo o que foi enfileirado antes desta chamada ser gravado."""
+        self.append_raw(None, b"").result(timeout)
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    # ---------------------------
+    # Thread de escrita
+    # ---------------------------
+
+    def _file(self, path: str):
+        f = self._files.get(path)
+        if f is None:
+            f = self._files[path] = open(path, "ab")
+        return f
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.monotonic() + self.flush_s
+        while len(batch) < self.batch_max:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch: list) -> None:
+        # agrupa por arquivo preservando a ordem de chegada
+        chunks = {}
+        released = []
+        for path, data, _, _ in batch:
+            if path is None:
+                continue
+            if data is None:
+                released.append(path)
+            else:
+                chunks.setdefault(path, []).append(data)
+
+        for path, parts in chunks.items():
+            f = self._file(path)
+            f.write(b"".join(parts))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+        for path in released:
+            f = self._files.pop(path, None)
+            if f is not None:
+                f.close()
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = self._collect(first)
+            t0 = time.perf_counter()
+            try:
+                self._write(batch)
+            except Exception as e:
+                # reabre os arquivos no próximo lote
+                self._close_files()
+                for _, _, _, fut in batch:
+                    fut.set_exception(e)
+                if self.on_batch is not None:
+                    self.on_batch()
+                continue
+            self._write_ms.observe_since(t0, time.perf_counter())
+            self._records.inc(len(batch))
+            for _, _, result, fut in batch:
+                fut.set_result(result)
+            if self.on_batch is not None:
+                self.on_batch()
+
+        self._close_files()
+
+    def _close_files(self) -> None:
+        for f in self._files.values():
+            try:
+                f.close()
+            except OSError:
+                pass
+        self._files.clear()
@@ -1,11 +1,33 @@
 import os
+import sys
 import json
+import socket
 import time
-from datetime import datetime
 
 import zmq
 import msgpack
+import itertools
 import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+
+from clock import make_clock  # noqa: E402
+import metrics
+import snapshot
+from hot_cache import HotCache
+from inbox import InboxIndex
+from log_writer import LogWriter
+from partition import Forwards, Partitioner, Peers
+from publisher import Publisher
+from ref_client import RefClient
+from registry import Registry
+from replication import ReplicaStream
+from retention import RetentionEngine, RetentionPolicy, parse_overrides
+from store import SegmentStore
+from supervisor import Supervisor
+from wire import PackedReply, ReplyTemplates, WallClock, packb, splice
 
 # Endereços principais (podem ser sobrescritos via docker-compose/env)
 BROKER = os.getenv("BROKER_ENDPOINT", "tcp://localhost:5556")     # REP <-> DEALER (broker)
@@ -14,14 +36,135 @@ XPUB   = os.getenv("PROXY_XPUB", "tcp://localhost:5558")          # SUB <- XPUB
 
 DATA   = os.getenv("PERSIST_DIR", "./data")
 
-SERVER_NAME = os.getenv("SERVER_NAME", f"server-{int(time.time()) % 1000}")
+# nome estável entre reinícios (o hostname do container): o store e o
+# snapshot ficam em um diretório por servidor e são retomados na partida
+SERVER_NAME = os.getenv("SERVER_NAME") or socket.gethostname() or f"server-{int(time.time()) % 1000}"
 REF_HOST    = os.getenv("REF_HOST", "localhost")
 REF_PORT    = os.getenv("REF_PORT", "6000")
 REF_ADDR    = f"tcp://{REF_HOST}:{REF_PORT}"
 
+# Coordenação com o ref (thread própria): timeout por pedido, tentativas
+# com socket novo e espera crescente enquanto o ref estiver fora
+REF_TIMEOUT_MS   = float(os.getenv("REF_TIMEOUT_MS", "1000"))
+REF_RETRIES      = int(os.getenv("REF_RETRIES", "2"))
+REF_BACKOFF_MAX  = float(os.getenv("REF_BACKOFF_MAX", "30"))
+REF_STARTUP_WAIT = float(os.getenv("REF_STARTUP_WAIT", "5"))
+
 LOG_PUB = os.path.join(DATA, "publications.jsonl")
 LOG_MSG = os.path.join(DATA, "messages.jsonl")
-REG     = os.path.join(DATA, "registry.json")
+REG     = os.path.join(DATA, "registry.json")   # formato antigo: só semeia o registro novo
+
+# Modo de atendimento: "rep" (lockstep, uma requisição por vez) ou
+# "dealer" (pipeline com várias requisições em voo e pool de workers)
+SERVER_MODE  = os.getenv("SERVER_MODE", "rep")
+WORKERS      = int(os.getenv("SERVER_WORKERS", "0"))
+MAX_INFLIGHT = int(os.getenv("SERVER_MAX_INFLIGHT", "256"))
+OUTBOX_ADDR  = "inproc://server-outbox"
+
+# Protocolo com o broker: "proxy" (round-robin cego) ou "lb" (o servidor
+# se anuncia com READY e o broker escolhe o que tem menos pedidos em aberto)
+BROKER_MODE    = os.getenv("BROKER_MODE", "proxy")
+READY_INTERVAL = float(os.getenv("WORKER_READY_INTERVAL", "1"))
+
+# Group commit dos logs: grava a cada N registros ou T ms, fsync opcional
+LOG_BATCH    = int(os.getenv("LOG_BATCH", "512"))
+LOG_FLUSH_MS = float(os.getenv("LOG_FLUSH_MS", "0"))
+LOG_FSYNC    = os.getenv("LOG_FSYNC", "0") == "1"
+LOG_JSONL    = os.getenv("LOG_JSONL", "0") == "1"   # mantém também os .jsonl antigos
+
+# Store segmentado (MessagePack + índice esparso por canal/clock)
+STORE_DIR       = os.getenv("STORE_DIR", os.path.join(DATA, "store", SERVER_NAME))
+SEGMENT_BYTES   = int(os.getenv("SEGMENT_BYTES", str(64 * 1024 * 1024)))
+SEGMENT_SECONDS = float(os.getenv("SEGMENT_SECONDS", "3600"))
+INDEX_EVERY     = int(os.getenv("INDEX_EVERY", "64"))
+# Retenção por canal/destinatário (segundos e bytes por chave, 0 = sem
+# limite; exceções "canal=segundos:bytes,..."), arquivamento comprimido dos
+# segmentos selados há ARCHIVE_AFTER_S e teto de disco por store. A thread
+# de retenção lê no máximo RETENTION_IO_RATE bytes/s (ver retention.py)
+RETENTION_SECONDS   = float(os.getenv("RETENTION_SECONDS", "0"))
+RETENTION_BYTES     = int(os.getenv("RETENTION_BYTES", "0"))
+RETENTION_OVERRIDES = os.getenv("RETENTION_OVERRIDES", "")
+ARCHIVE_AFTER_S     = float(os.getenv("ARCHIVE_AFTER_S", "0"))
+ARCHIVE_CODEC       = os.getenv("ARCHIVE_CODEC", "auto")       # zst, lz4, z ou auto
+RETENTION_IO_RATE   = float(os.getenv("RETENTION_IO_RATE", str(8 * 1024 * 1024)))
+STORE_MAX_BYTES     = int(os.getenv("STORE_MAX_BYTES", "0"))
+RETENTION_INTERVAL  = float(os.getenv("RETENTION_INTERVAL", "60"))
+HISTORY_LIMIT   = 100        # padrão do serviço history
+HISTORY_MAX     = 1000       # teto por requisição
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(4 * 1024 * 1024)))
+# Cache das mensagens recentes por canal (history): até HOT_CACHE_RECORDS
+# por canal e HOT_CACHE_BYTES no total, saindo o canal lido há mais
+# tempo (0 = desliga; ver hot_cache.py)
+HOT_CACHE_BYTES   = int(os.getenv("HOT_CACHE_BYTES", str(64 * 1024 * 1024)))
+HOT_CACHE_RECORDS = int(os.getenv("HOT_CACHE_RECORDS", "1000"))
+PUBLISH_BATCH_MAX = int(os.getenv("PUBLISH_BATCH_MAX", "1000"))   # itens por publish_batch
+
+# Retomada de assinantes (serviço replay): páginas limitadas e um teto de
+# registros/s para todos os clientes juntos, para uma onda de reconexões
+# (proxy reiniciado) não derrubar o servidor
+REPLAY_LIMIT = 200           # padrão por página
+REPLAY_MAX   = 1000          # teto por página
+REPLAY_RATE  = float(os.getenv("REPLAY_RATE", "20000"))   # registros/s (0 = sem teto)
+
+# Caixa de entrada das mensagens diretas (inbox_fetch/inbox_ack): arrays
+# por destinatário em disco, os de INBOX_CACHE_USERS usuários em memória,
+# gravados a cada INBOX_FLUSH_S segundos (ver inbox.py)
+INBOX_CACHE_USERS = int(os.getenv("INBOX_CACHE_USERS", "1024"))
+INBOX_FLUSH_S     = float(os.getenv("INBOX_FLUSH_S", "1"))
+INBOX_LIMIT       = 100      # padrão por página
+INBOX_MAX         = 1000     # teto por página
+
+# Replicação em lotes: N registros ou T ms por lote, buffer para reparo
+REPL_BATCH    = int(os.getenv("REPL_BATCH", "256"))
+REPL_FLUSH_MS = float(os.getenv("REPL_FLUSH_MS", "2"))
+REPL_RETAIN   = int(os.getenv("REPL_RETAIN", "100000"))
+
+# Backpressure: filas (HWM, em mensagens) dos PUB/SUB. Publicação que
+# encontra a fila para o proxy cheia é descartada e contada por tópico;
+# canais em PUB_COALESCE guardam só a última mensagem sob pressão. Entre
+# o recebimento e a aplicação das réplicas fica uma fila de N lotes
+PUB_SNDHWM       = int(os.getenv("PUB_SNDHWM", "10000"))
+PUB_COALESCE     = [c for c in os.getenv("PUB_COALESCE", "").split(",") if c]
+REPL_SNDHWM      = int(os.getenv("REPL_SNDHWM", "10000"))
+REPL_RCVHWM      = int(os.getenv("REPL_RCVHWM", "10000"))
+REPL_APPLY_QUEUE = int(os.getenv("REPL_APPLY_QUEUE", "1024"))
+DROP_REPORT_S    = float(os.getenv("DROP_REPORT_S", "10"))    # intervalo do aviso de descartes
+
+# Snapshot periódico do estado (registro, clocks, offsets de replicação)
+SNAPSHOT_PATH     = os.path.join(STORE_DIR, "snapshot.msgpack")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "30"))
+
+# Registro de usuários/canais: índice em memória + journal por servidor,
+# consolidado em registry.json a cada N cadastros
+REGISTRY_PATH          = os.path.join(STORE_DIR, "registry.json")
+REGISTRY_COMPACT_EVERY = int(os.getenv("REGISTRY_COMPACT_EVERY", "10000"))
+USERS_PAGE_LIMIT       = 100         # padrão do serviço list_users
+USERS_PAGE_MAX         = 1000        # teto por requisição
+
+# Particionamento: cada canal/destinatário fica em PARTITION_RF servidores
+# (0 = todos guardam tudo); pedidos de chaves de outros são repassados
+PARTITION_RF       = int(os.getenv("PARTITION_RF", "0"))
+PEER_BIND          = os.getenv("PEER_BIND", "tcp://*:5570")
+PEER_ADDR          = os.getenv("PEER_ADDR", f"tcp://{socket.gethostname()}:5570")
+FORWARD_TIMEOUT_MS = float(os.getenv("FORWARD_TIMEOUT_MS", "2000"))
+SUSPECT_SECONDS    = 10.0    # quanto tempo evitar um dono que não respondeu
+
+# Modo multiprocesso: com SERVER_PROCESSES > 1 este processo vira um
+# supervisor que roda N servidores (SERVER_NAME-1..N) no host, cada um com
+# seu store, sua partição e seu relógio (ver supervisor.py). Os workers
+# mandam o heartbeat ao supervisor (HEARTBEAT_ENDPOINT), que o agrega ao ref
+SERVER_PROCESSES   = int(os.getenv("SERVER_PROCESSES", "1"))
+HEARTBEAT_ENDPOINT = os.getenv("HEARTBEAT_ENDPOINT", "")
+
+# Telemetria: nível dos logs (debug mostra uma linha por lote replicado,
+# sincronização de clock etc.) e porta do /metrics do Prometheus (0 = desligado)
+LOG_LEVELS   = {"debug": 10, "info": 20, "warn": 30}
+LOG_LEVEL    = LOG_LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), 20)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Carimbo físico (ISO) das respostas e payloads: o texto é refeito no
+# máximo a cada TS_CACHE_MS (0 = a cada chamada)
+TS_CACHE_MS  = float(os.getenv("TS_CACHE_MS", "1"))
 
 os.makedirs(DATA, exist_ok=True)
 
@@ -29,7 +172,10 @@ os.makedirs(DATA, exist_ok=True)
 # Relógio lógico e controle
 # ---------------------------
 
-logical_clock = 0            # relógio lógico Lamport
+# "lamport" (padrão) ou "hlc" (relógio lógico híbrido: acompanha o tempo
+# físico, mesmo campo inteiro); todos os servidores devem usar o mesmo
+CLOCK_MODE = os.getenv("CLOCK_MODE", "lamport")
+logical_clock = make_clock(CLOCK_MODE)   # seguro entre threads (common/clock.py)
 msg_count = 0
 SYNC_EVERY = 10              # a cada N mensagens tentamos sincronizar clock e atualizar coordenador
 last_heartbeat = 0.0
@@ -37,113 +183,257 @@ HEARTBEAT_INTERVAL = 5.0
 
 rank = None
 servers_info = {}            # info retornada pelo ref
+servers_version = 0          # versão da lista que temos em cache
+ref_version = 0              # versão da lista informada no último heartbeat
 coordinator = None           # nome do servidor coordenador
+# rank, servers_info e coordinator são o cache da thread do ref: o
+# atendimento só lê, nunca espera pelo ref
+sync_wanted = threading.Event()   # pedido de sincronização (a cada SYNC_EVERY mensagens)
+registered = threading.Event()    # primeiro registro no ref concluído
 
-
-def ts() -> str:
-    """Timestamp físico em ISO."""
-    return datetime.utcnow().isoformat() + "Z"
+# o contador de mensagens e o high-water dos canais são atualizados pelos
+# workers e pela thread de réplica (o relógio e o registro têm lock próprio)
+state_lock = threading.Lock()
 
 
-def append(path: str, obj: dict) -> None:
-    """Persistência simples em JSONL."""
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+wall_clock = WallClock(TS_CACHE_MS / 1000.0)
+ts = wall_clock.now                 # timestamp físico em ISO (em cache, ver wire.py)
 
 
-def load_registry() -> dict:
-    """Carrega canais/usuários ou cria default."""
-    if os.path.exists(REG):
-        return json.load(open(REG, "r", encoding="utf-8"))
-    reg = {"channels": ["general", "random", "dev"], "users": []}
-    json.dump(reg, open(REG, "w", encoding="utf-8"))
-    return reg
+def log(msg: str, level: str = "info") -> None:
+    if LOG_LEVELS[level] >= LOG_LEVEL:
+        print(f"[{SERVER_NAME}] {msg}")
 
 
-def save_registry(reg: dict) -> None:
-    json.dump(reg, open(REG, "w", encoding="utf-8"))
+def log_debug(msg: str) -> None:
+    log(msg, "debug")
 
 
 # ---------------------------
-# Relógio lógico (Lamport)
+# Métricas do caminho quente (instrumentos pegos uma vez)
 # ---------------------------
 
-def update_clock(remote_clock: int) -> None:
-    """Atualiza o relógio lógico local."""
-    global logical_clock
-    logical_clock = max(logical_clock, int(remote_clock or 0)) + 1
+SERVICES = ("publish", "publish_batch", "message", "register_user", "list_users",
+            "list_channels", "history", "replay", "inbox_fetch", "inbox_ack",
+            "clock", "election", "stats")
+# respostas {status, message, timestamp} pré-codificadas (só desses serviços)
+replies = ReplyTemplates(SERVICES)
+_request_metrics = {
+    s: (metrics.histogram("request_ms", service=s),
+        metrics.counter("requests_total", service=s),
+        metrics.counter("request_errors_total", service=s))
+    for s in SERVICES + ("other",)
+}
+_fanout_ms = metrics.histogram("publish_fanout_ms")
+_replica_clock_lag = metrics.gauge("replica_clock_lag")
+_replica_applied = metrics.counter("replica_records_applied_total")
+_forwarded = metrics.counter("requests_forwarded_total")
+_forward_timeouts = metrics.counter("forward_timeouts_total")
+_replay_records = metrics.counter("replay_records_total")
+_replay_throttled = metrics.counter("replay_throttled_total")
+
+
+def observe_request(service, t0: float, reply) -> None:
+    """Latência por serviço; com Future, até o lote com a gravação ficar pronto."""
+    hist, total, errors = _request_metrics.get(service) or _request_metrics["other"]
+    total.inc()
+    if isinstance(reply, Future):
+        def done(fut):
+            hist.observe_since(t0, time.perf_counter())
+            if fut.exception() is not None:
+                errors.inc()
+        reply.add_done_callback(done)
+        return
+    hist.observe_since(t0, time.perf_counter())
+    if isinstance(reply, PackedReply):
+        if reply.status == "erro":
+            errors.inc()
+    elif isinstance(reply, dict) and (reply.get("data") or {}).get("status") == "erro":
+        errors.inc()
+
+
+log_writer = None            # LogWriter criado no main()
+pub_store = None             # publicações por canal
+msg_store = None             # mensagens diretas por destinatário
+replication = None           # ReplicaStream criado no main()
+channel_clock = {}           # maior clock visto por canal (high-water)
+recovered = set()            # (origem, clock) de réplicas já gravadas antes de cair
+partitioner = None           # Partitioner criado no main()
+registry = None              # Registry criado no main()
+inbox = None                 # InboxIndex das mensagens diretas
+hot_cache = None             # HotCache das publicações recentes por canal
+
+
+def append(path: str, obj: dict, result=None) -> Future:
+    """
+    Persistência em JSONL via group commit. Devolve um Future que recebe
+    `result` quando o lote com este registro estiver gravado.
+    """
+    return log_writer.append(path, obj, result)
+
+
+def persist(payload: dict, raw: bytes, result=None) -> Future:
+    """
+    Grava um registro (publish/message) no store segmentado usando os
+    bytes MessagePack já codificados. Devolve o Future da gravação.
+    """
+    if payload.get("type") == "publish":
+        store, key, log = pub_store, payload.get("channel"), LOG_PUB
+    else:
+        store, key, log = msg_store, payload.get("dst"), LOG_MSG
+    if LOG_JSONL:
+        append(log, payload)
+    return store.append(str(key or ""), int(payload.get("clock") or 0), raw, result)
+
+
+def persist_publications(records: list, result=None) -> Future:
+    """Grava várias publicações [(payload, raw)] numa escrita só."""
+    if LOG_JSONL:
+        for payload, _ in records:
+            append(LOG_PUB, payload)
+    return pub_store.append_many(
+        [(str(p.get("channel") or ""), int(p["clock"]), raw) for p, raw in records], result,
+    )
+
+
+def persist_messages(records: list, result=None) -> Future:
+    """Grava várias mensagens diretas [(payload, raw)] numa escrita só."""
+    if LOG_JSONL:
+        for payload, _ in records:
+            append(LOG_MSG, payload)
+    return msg_store.append_many(
+        [(str(p.get("dst") or ""), int(p.get("clock") or 0), raw) for p, raw in records], result,
+    )
 
 
-def next_clock() -> int:
-    """Incrementa o relógio lógico e retorna o valor."""
-    global logical_clock
-    logical_clock += 1
-    return logical_clock
+def load_registry(fallback: dict = None) -> Registry:
+    """
+    Carrega canais/usuários do registro deste servidor; na primeira
+    partida usa os do snapshot ou o registry.json antigo (ou o default).
+    """
+    if fallback is None and os.path.exists(REG):
+        fallback = json.load(open(REG, "r", encoding="utf-8"))
+    return Registry(REGISTRY_PATH, log_writer, REGISTRY_COMPACT_EVERY).load(fallback)
 
 
 # ---------------------------
 # Helpers de MessagePack
 # ---------------------------
 
+class MultipartReply:
+    """
+    Resposta em vários frames: o primeiro é o cabeçalho {"service","data"}
+    em MessagePack e os demais são registros MessagePack prontos (por
+    exemplo memoryviews de segmentos mapeados), enviados sem cópia.
+    """
+
+    __slots__ = ("header", "frames")
+
+    def __init__(self, header: dict, frames: list):
+        self.header = header
+        self.frames = frames
+
+    def encode(self) -> list:
+        return [packb(self.header)] + list(self.frames)
+
+
 def recv_msgpack(sock) -> dict:
     raw = sock.recv()
     return msgpack.unpackb(raw, raw=False)
 
 
-def send_msgpack(sock, obj: dict) -> None:
-    sock.send(msgpack.packb(obj, use_bin_type=True))
+def send_msgpack(sock, obj) -> None:
+    if isinstance(obj, MultipartReply):
+        sock.send_multipart(obj.encode(), copy=False)
+    elif isinstance(obj, PackedReply):
+        sock.send(obj.raw)
+    else:
+        sock.send(packb(obj))
 
 
 def pub_msgpack(pub, topic: str, obj: dict) -> None:
     pub.send_multipart([
         topic.encode("utf-8"),
-        msgpack.packb(obj, use_bin_type=True),
+        packb(obj),
     ])
 
 
+def open_pub(ctx, name: str, coalesce=()) -> Publisher:
+    """PUB conectado ao XSUB do proxy, com HWM e contagem de descartes."""
+    pub = Publisher(ctx.socket(zmq.PUB), name, PUB_SNDHWM, coalesce, label=topic_label,
+                    report_s=DROP_REPORT_S, log=lambda msg: log(msg, "warn"))
+    pub.sock.connect(XSUB)
+    return pub
+
+
+def topic_label(topic: str) -> str:
+    """Label das métricas de descarte: o canal, ou "dm" (um por usuário seria demais)."""
+    if topic == "servers" or (registry is not None and registry.has_channel(topic)):
+        return topic
+    return "dm"
+
+
+def pub_raw(pub, topic: str, raw: bytes) -> None:
+    """Publica bytes MessagePack já codificados."""
+    t0 = time.perf_counter()
+    pub.send_multipart([topic.encode("utf-8"), raw])
+    _fanout_ms.observe_since(t0, time.perf_counter())
+
+
 # ---------------------------
 # Comunicação com servidor de referência (ref)
 # ---------------------------
 
-def ref_request(sock, service: str, data: dict) -> dict:
+def ref_request(client: RefClient, service: str, data: dict) -> dict:
     """
     Envia requisição JSON para o servidor de referência
     e atualiza o clock lógico com a resposta.
+    TimeoutError se o ref não responder.
     """
     data = dict(data or {})
     data.setdefault("timestamp", ts())
-    data.setdefault("clock", next_clock())
+    data.setdefault("clock", logical_clock.tick())
 
-    sock.send_json({"service": service, "data": data})
-    reply = sock.recv_json()
+    t0 = time.perf_counter()
+    reply = client.request({"service": service, "data": data})
+    metrics.histogram("ref_rtt_ms", service=service).observe_since(t0, time.perf_counter())
     rdata = reply.get("data", {}) or {}
-    update_clock(rdata.get("clock", 0))
+    logical_clock.observe(rdata.get("clock", 0))
     return reply
 
 
 def register_with_ref(ref_sock) -> None:
     """Pede rank e lista de servidores para o ref."""
-    global rank, servers_info, coordinator
+    global rank, servers_info, servers_version, coordinator
 
-    reply_rank = ref_request(ref_sock, "rank", {"user": SERVER_NAME})
+    info = {"user": SERVER_NAME}
+    if partitioner.enabled:
+        info["addr"] = PEER_ADDR      # onde os outros repassam pedidos
+    reply_rank = ref_request(ref_sock, "rank", info)
     rank = reply_rank.get("data", {}).get("rank")
-    print(f"[{SERVER_NAME}] rank obtido: {rank}")
+    log(f"rank obtido: {rank}")
 
     reply_list = ref_request(ref_sock, "list", {})
     servers_info = reply_list.get("data", {}).get("list", {}) or {}
+    servers_version = reply_list.get("data", {}).get("version", 0)
+    update_partitions()
 
     if servers_info:
         coordinator_name = min(servers_info.items(), key=lambda kv: kv[1]["rank"])[0]
         coordinator = coordinator_name
-        print(f"[{SERVER_NAME}] coordenador inicial: {coordinator}")
+        log(f"coordenador inicial: {coordinator}")
 
 
 def maybe_send_heartbeat(ref_sock) -> None:
-    """Envia heartbeat periódico ao servidor de referência."""
-    global last_heartbeat
+    """
+    Envia heartbeat periódico ao servidor de referência. A resposta traz
+    a versão da lista de servidores, para só pedirmos o list se mudou.
+    """
+    global last_heartbeat, ref_version
     now = time.time()
     if now - last_heartbeat >= HEARTBEAT_INTERVAL:
-        ref_request(ref_sock, "heartbeat", {"user": SERVER_NAME})
+        reply = ref_request(ref_sock, "heartbeat", {"user": SERVER_NAME})
+        ref_version = (reply.get("data", {}) or {}).get("version", ref_version)
         last_heartbeat = now
 
 
@@ -157,27 +447,38 @@ def sync_clock_with_ref(ref_sock) -> None:
     reply = ref_request(ref_sock, "clock", {})
     data = reply.get("data", {}) or {}
     remote_time = data.get("time")
-    print(f"[{SERVER_NAME}] sincronizou clock com ref (time={remote_time}, clock={logical_clock})")
+    log_debug(f"sincronizou clock com ref (time={remote_time}, clock={logical_clock.value})")
 
 
 def refresh_servers_and_maybe_elect(ref_sock, pub_sock) -> None:
     """
     Atualiza lista de servidores a partir do ref e, se houver mudança,
     elege novo coordenador (menor rank) e publica no tópico 'servers'.
+    Pede só o que mudou desde a versão em cache; o ref tira da lista
+    quem parou de mandar heartbeat, então a eleição só vê servidores vivos.
     """
-    global servers_info, coordinator
-
-    reply_list = ref_request(ref_sock, "list", {})
-    new_info = reply_list.get("data", {}).get("list", {}) or {}
+    global servers_info, servers_version, coordinator
+
+    query = {"since_version": servers_version} if servers_version else {}
+    data = ref_request(ref_sock, "list", query).get("data", {}) or {}
+    if data.get("delta"):
+        new_info = dict(servers_info)
+        new_info.update(data.get("list") or {})
+        for name in data.get("removed") or []:
+            new_info.pop(name, None)
+    else:
+        new_info = data.get("list", {}) or {}
+    servers_version = data.get("version", 0)
     if not new_info:
         return
 
     servers_info = new_info
+    update_partitions()
     new_coord = min(servers_info.items(), key=lambda kv: kv[1]["rank"])[0]
 
     if new_coord != coordinator:
         coordinator = new_coord
-        print(f"[{SERVER_NAME}] novo coordenador eleito: {coordinator}")
+        log(f"novo coordenador eleito: {coordinator}")
 
         # avisa os demais via publicação no tópico 'servers'
         payload = {
@@ -185,264 +486,1070 @@ def refresh_servers_and_maybe_elect(ref_sock, pub_sock) -> None:
             "data": {
                 "coordinator": coordinator,
                 "timestamp": ts(),
-                "clock": next_clock(),
+                "clock": logical_clock.tick(),
             },
         }
         pub_msgpack(pub_sock, "servers", payload)
 
 
+def coordinate(ctx) -> None:
+    """
+    Thread de coordenação com o ref: registro, heartbeat, sincronização
+    do relógio (a cada SYNC_EVERY mensagens) e eleição do coordenador.
+    Tem seu próprio REQ (com timeout) e seu próprio PUB; se o ref cair,
+    tenta de novo com espera crescente sem afetar o atendimento.
+    """
+    client = RefClient(ctx, REF_ADDR, REF_TIMEOUT_MS, REF_RETRIES)
+    # worker de um supervisor: o heartbeat vai para ele, não para o ref
+    beats = RefClient(ctx, HEARTBEAT_ENDPOINT, REF_TIMEOUT_MS, REF_RETRIES) if HEARTBEAT_ENDPOINT else client
+    pub = open_pub(ctx, "ref")
+    backoff = 0.0
+
+    while True:
+        try:
+            if not registered.is_set():
+                register_with_ref(client)
+                registered.set()
+
+            sync_due = sync_wanted.is_set()
+            if sync_due:
+                sync_wanted.clear()
+                sync_clock_with_ref(client)
+                refresh_servers_and_maybe_elect(client, pub)
+
+            # o heartbeat traz a versão da lista: se mudou (servidor novo ou
+            # expirado), atualiza membros e coordenador mesmo sem tráfego
+            maybe_send_heartbeat(beats)
+            if ref_version != servers_version:
+                refresh_servers_and_maybe_elect(client, pub)
+            backoff = 0.0
+        except TimeoutError:
+            backoff = min(REF_BACKOFF_MAX, max(0.5, backoff * 2))
+            metrics.counter("ref_timeouts_total").inc()
+            log(f"ref sem resposta; nova tentativa em {backoff:.1f}s", "warn")
+            time.sleep(backoff)
+            continue
+
+        # dorme até o próximo heartbeat ou até pedirem sincronização
+        sync_wanted.wait(max(0.0, last_heartbeat + HEARTBEAT_INTERVAL - time.time()))
+
+
+# ---------------------------
+# Particionamento
+# ---------------------------
+
+class Forward:
+    """Marca uma requisição que deve ser repassada ao dono da chave."""
+
+    __slots__ = ("owner",)
+
+    def __init__(self, owner: str):
+        self.owner = owner
+
+
+def update_partitions() -> None:
+    """Reconstrói o anel de hash com a lista de servidores do ref."""
+    if partitioner.enabled and partitioner.update(servers_info):
+        log(f"anel de partições: {len(partitioner.ring.members)} "
+            f"servidor(es), rf={PARTITION_RF}")
+
+
+def request_key(req: dict):
+    """Chave de particionamento da requisição (None = atende em qualquer servidor)."""
+    service = req.get("service")
+    data = req.get("data") or {}
+    if service in ("publish", "history"):
+        return data.get("channel")
+    if service == "replay":
+        return data.get("channel") or data.get("user")
+    if service in ("inbox_fetch", "inbox_ack"):
+        return data.get("user")
+    if service == "publish_batch":
+        # lote de um canal só vai para o dono; misto é atendido onde chegar
+        items = data.get("messages")
+        if not isinstance(items, list) or not all(isinstance(m, dict) for m in items):
+            return None
+        channels = {m.get("channel", data.get("channel")) for m in items}
+        return channels.pop() if len(channels) == 1 else None
+    if service == "message":
+        return data.get("dst")
+    return None
+
+
+def record_key(payload: dict):
+    """Chave de um registro gravado: canal da publicação ou destinatário."""
+    if payload.get("type") == "publish":
+        return payload.get("channel")
+    return payload.get("dst")
+
+
+def forward_error(service: str) -> PackedReply:
+    return reply_status(service, "erro", "servidor dono da partição indisponível")
+
+
 # ---------------------------
-# THREAD de replicação 
+# Replicação
 # ---------------------------
 
-def replica_listener():
+def track_channel_clock(channel: str, clock: int) -> None:
+    # atendimento e aplicação de réplicas atualizam em threads diferentes
+    if clock > channel_clock.get(channel, 0):
+        with state_lock:
+            if clock > channel_clock.get(channel, 0):
+                channel_clock[channel] = clock
+
+
+def merge_users(users: list) -> None:
     """
-    Escuta o tópico interno 'replica' e grava localmente
-    logs que vieram de outros servidores.
+    Junta uma página do registro de um par (anti-entropia na partida):
+    cobre os cadastros que o buffer circular da réplica já não tem.
     """
-    ctx = zmq.Context.instance()
-    sub = ctx.socket(zmq.SUB)
-    sub.connect(XPUB)                       # XPUB do proxy
-    sub.setsockopt_string(zmq.SUBSCRIBE, "replica")
+    added = 0
+    for u in users:
+        if isinstance(u, str) and registry.add_user(u) is not None:
+            added += 1
+    if added:
+        log(f"{added} usuário(s) recebidos de outro servidor")
 
-    print(f"[{SERVER_NAME}] ouvindo réplicas no tópico 'replica'...")
 
-    while True:
-        topic, raw = sub.recv_multipart()
-        if topic.decode() != "replica":
+def apply_replicas(records: list) -> None:
+    """
+    Aplica um lote de registros [(payload, raw)] vindos de outros
+    servidores (chamado pela thread de aplicação da réplica, na ordem de
+    sequência de cada origem): o relógio avança uma vez, pelo maior clock
+    do lote, e cada store recebe uma escrita só.
+    """
+    top = 0
+    pubs, msgs = [], []
+    for payload, raw in records:
+        clock = int(payload.get("clock") or 0)
+        if clock > top:
+            top = clock
+
+        if recovered and (payload.get("origin"), clock) in recovered:
+            # reenvio de algo que já estava na cauda do log antes de reiniciar
+            recovered.discard((payload.get("origin"), clock))
             continue
 
+        kind = payload.get("type")
+        if kind == "register_user":
+            # o registro é o mesmo em todos os servidores (sem partição)
+            registry.add_user(payload.get("user"))
+        elif kind == "inbox_ack":
+            # confirmações em todos os servidores: valem se a partição mudar
+            inbox.ack(payload.get("user"), int(payload.get("acked") or 0))
+        elif kind in ("publish", "message"):
+            if not partitioner.owns(record_key(payload)):
+                continue  # chave de outra partição: só o clock interessa
+            if kind == "publish":
+                track_channel_clock(payload.get("channel"), clock)
+                pubs.append((payload, raw))
+            else:
+                msgs.append((payload, raw))
+
+    # quanto o lote chegou atrás do relógio local (em ticks de Lamport)
+    _replica_clock_lag.set(max(0, logical_clock.value - top))
+    _replica_applied.inc(len(records))
+    logical_clock.observe(top)
+
+    # grava os mesmos bytes recebidos, sem re-codificar
+    if pubs:
+        persist_publications(pubs)
+    if msgs:
+        persist_messages(msgs)
+
+
+# ---------------------------
+# Tratamento das requisições
+# ---------------------------
+
+def reply_to(service: str, data: dict) -> dict:
+    """Monta a resposta no contrato {"service", "data"} com o clock lógico."""
+    data["clock"] = logical_clock.tick()
+    return {"service": service, "data": data}
+
+
+def reply_status(service: str, status: str, message: str, t: str = None,
+                 cache: bool = True) -> PackedReply:
+    """
+    reply_to(service, {"status", "message", "timestamp"}) já codificada,
+    a partir do prefixo fixo de (serviço, status, mensagem). Mensagem que
+    muda a cada chamada (texto de exceção) vai com cache=False.
+    """
+    return replies.encode(service, status, message, t or ts(), logical_clock.tick(), cache)
+
+
+def service_of(req) -> str:
+    """Serviço pedido; o que não for texto (lista, dict...) vira None."""
+    service = req.get("service")
+    return service if isinstance(service, str) else None
+
+
+def int_field(data: dict, name: str, default: int = 0, low: int = 0, high: int = None) -> int:
+    """
+    Campo inteiro do pedido (ausente ou 0 = `default`), limitado a
+    [low, high]. Valor que não é inteiro levanta ValueError, que vira a
+    resposta "requisição inválida".
+    """
+    value = data.get(name) or default
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"campo {name!r} inválido")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"campo {name!r} inválido") from None
+    if value < low:
+        return low
+    return value if high is None else min(value, high)
+
+
+def count_message(n: int = 1) -> None:
+    """Conta publish/message; a cada SYNC_EVERY pede sincronização ao ref."""
+    global msg_count
+    with state_lock:
+        due = (msg_count + n) // SYNC_EVERY > msg_count // SYNC_EVERY
+        msg_count += n
+    if due:
+        sync_wanted.set()
+
+
+_replay_lock = threading.Lock()
+_replay_tokens = REPLAY_RATE
+_replay_refill = time.monotonic()
+
+
+def take_replay_budget(limit: int) -> int:
+    """Quantos registros esta página de replay pode levar (0 = espere)."""
+    global _replay_tokens, _replay_refill
+    if REPLAY_RATE <= 0:
+        return limit
+    with _replay_lock:
+        now = time.monotonic()
+        _replay_tokens = min(REPLAY_RATE, _replay_tokens + (now - _replay_refill) * REPLAY_RATE)
+        _replay_refill = now
+        n = min(limit, int(_replay_tokens))
+        _replay_tokens -= n
+    return n
+
+
+def read_history(channel: str, since: int, limit: int, last: bool, clocks: list) -> list:
+    """Payloads do history: do cache quente se ele cobrir o pedido, senão do log."""
+    if hot_cache.enabled:
+        views = hot_cache.read(channel, since, limit, last, HISTORY_MAX_BYTES, clocks)
+        if views is not None:
+            return views
+    if last:
+        return pub_store.tail(channel, limit, clocks)[0]
+    return pub_store.read_views(channel, since, limit, HISTORY_MAX_BYTES, clocks)
+
+
+def replay(reg: Registry, data: dict) -> dict:
+    """
+    Registros de um canal (`channel`) ou mensagens diretas de um usuário
+    (`user`) com clock > since_clock, em páginas. `cursor` é a posição no
+    log deste servidor onde a página anterior parou: seguir por ele não
+    pula réplicas gravadas depois com clock menor, como acontece ao
+    paginar o history pelo maior clock. Se a página cair em outro
+    servidor (broker sem afinidade, failover), o cursor não vale lá e a
+    leitura segue pelo maior clock já devolvido, como no history.
+    """
+    channel, user = data.get("channel"), data.get("user")
+    since = int_field(data, "since_clock")
+    limit = int_field(data, "limit", REPLAY_LIMIT, 1, REPLAY_MAX)
+
+    if channel is not None:
+        store, key, known = pub_store, channel, reg.has_channel(channel)
+    else:
+        store, key, known = msg_store, user, reg.has_user(user)
+    if not known:
+        return reply_status("replay", "erro", "canal ou usuário inexistente")
+
+    # cursor = [servidor, segmento, offset, maior clock devolvido até aqui]
+    cursor = data.get("cursor")
+    start, top = None, since
+    if isinstance(cursor, list) and len(cursor) == 4:
         try:
-            payload = msgpack.unpackb(raw, raw=False)
-        except Exception:
-            continue
+            top = max(since, int(cursor[3]))
+            if cursor[0] == SERVER_NAME:
+                start = (int(cursor[1]), int(cursor[2]))
+            else:
+                since = top
+        except (TypeError, ValueError):
+            raise ValueError("campo 'cursor' inválido") from None
+
+    n = take_replay_budget(limit)
+    if n == 0:
+        # muitos clientes retomando ao mesmo tempo: volte daqui a pouco
+        _replay_throttled.inc()
+        return reply_to("replay", {
+            "status": "busy",
+            "retry_after_ms": round(1000.0 * limit / REPLAY_RATE),
+            "timestamp": ts(),
+        })
+
+    clocks = []
+    views, stop, more = store.read_range(str(key), since, start, n, HISTORY_MAX_BYTES, clocks)
+    _replay_records.inc(len(views))
+    return reply_to("replay", {
+        "status": "OK",
+        "messages": [msgpack.unpackb(v, raw=False) for v in views],
+        "cursor": [SERVER_NAME, stop[0], stop[1], max(clocks, default=top)],
+        "more": more,
+        "timestamp": ts(),
+    })
+
+
+def handle_request(req: dict, reg: Registry, pub):
+    """
+    Processa uma requisição já decodificada e devolve o dict de resposta,
+    ou um Future com a resposta quando ela depende de uma gravação no log.
+    Usado tanto pelo loop REP quanto pelos workers do modo DEALER.
+    """
+    service = service_of(req)
+    data = req.get("data", {}) or {}
 
-        # não replica o que foi originado por esse mesmo servidor
-        if payload.get("origin") == SERVER_NAME:
-            continue
+    # clock lógico com base na mensagem recebida
+    logical_clock.observe(data.get("clock", 0))
 
-        # atualiza clock lógico
-        update_clock(payload.get("clock", 0))
+    if service == "publish":
+        user = data.get("user")
+        channel = data.get("channel")
+        message = data.get("message")
+        t = data.get("timestamp") or ts()
 
-        kind = payload.get("type")
-        if kind == "publish":
-            append(LOG_PUB, payload)
-        elif kind == "message":
-            append(LOG_MSG, payload)
+        if not reg.has_channel(channel):
+            return reply_status("publish", "erro", "canal inexistente", t)
+
+        # payload da publicação
+        payload = {
+            "type": "publish",
+            "origin": SERVER_NAME,  # quem gerou
+            "channel": channel,
+            "user": user,
+            "message": message,
+            "timestamp": t,
+            "clock": logical_clock.tick(),
+        }
+
+        # publica para os clientes do canal
+        raw = packb(payload)
+        pub_raw(pub, channel, raw)
+        track_channel_clock(channel, payload["clock"])
+        # grava localmente: a resposta só sai quando o lote estiver gravado
+        durable = persist(payload, raw, reply_status("publish", "OK", "", t))
+        # 🔁 replica para outros servidores (em lotes, com sequência)
+        replication.send(raw)
+
+        count_message()
+        return durable
+
+    if service == "publish_batch":
+        # N publicações numa requisição: clocks consecutivos, uma escrita,
+        # um lote de réplica e uma resposta com o status de cada item
+        items = data.get("messages") or []
+        t = data.get("timestamp") or ts()
+        if not isinstance(items, list) or len(items) > PUBLISH_BATCH_MAX:
+            return reply_status("publish_batch", "erro",
+                                f"lote deve ser uma lista de até {PUBLISH_BATCH_MAX} mensagens", t)
+
+        default_user, default_channel = data.get("user"), data.get("channel")
+        channels = [m.get("channel", default_channel) if isinstance(m, dict) else None for m in items]
+        valid = [i for i, ch in enumerate(channels) if reg.has_channel(ch)]
+        clock = logical_clock.tick_many(len(valid)) if valid else 0
+
+        results = [{"status": "erro", "message": "canal inexistente"} for _ in items]
+        records = []
+        for i in valid:
+            m, channel = items[i], channels[i]
+            payload = {
+                "type": "publish",
+                "origin": SERVER_NAME,
+                "channel": channel,
+                "user": m.get("user", default_user),
+                "message": m.get("message"),
+                "timestamp": m.get("timestamp") or t,
+                "clock": clock,
+            }
+            raw = packb(payload)
+            pub_raw(pub, channel, raw)
+            track_channel_clock(channel, clock)
+            results[i] = {"status": "OK", "clock": clock}
+            records.append((payload, raw))
+            clock += 1
+
+        reply = reply_to("publish_batch", {
+            "status": "OK",
+            "accepted": len(records),
+            "results": results,
+            "timestamp": t,
+        })
+        if not records:
+            return reply
+
+        # lote misto: aqui só fica o que é desta partição; o resto chega
+        # aos donos pela réplica
+        local = [(p, raw) for p, raw in records if partitioner.owns(p["channel"])]
+        durable = persist_publications(local, reply) if local else None
+        replication.send_many([raw for _, raw in records])
+
+        count_message(len(records))
+        return durable or reply
+
+    if service == "message":
+        src = data.get("src")
+        dst = data.get("dst")
+        message = data.get("message")
+        t = data.get("timestamp") or ts()
+
+        if reg.count_users() and not reg.has_user(dst):
+            return reply_status("message", "erro", "usuário inexistente", t)
 
-        print(f"[{SERVER_NAME}] replicou registro de {payload.get('origin')} ({kind})")
+        payload = {
+            "type": "message",
+            "origin": SERVER_NAME,
+            "src": src,
+            "dst": dst,
+            "message": message,
+            "timestamp": t,
+            "clock": logical_clock.tick(),
+        }
+
+        # publica para o usuário de destino
+        raw = packb(payload)
+        pub_raw(pub, dst, raw)
+        # grava localmente: a resposta só sai quando o lote estiver gravado
+        durable = persist(payload, raw, reply_status("message", "OK", "", t))
+        # 🔁 replica para outros servidores (em lotes, com sequência)
+        replication.send(raw)
+
+        count_message()
+        return durable
+
+    if service == "register_user":
+        u = data.get("user")
+        # resposta de tamanho fixo: a lista de usuários sai pelo list_users
+        reply = reply_to("register_user", {
+            "status": "OK",
+            "user": u,
+            "timestamp": ts(),
+        })
+        durable = reg.add_user(u, reply)
+        reply["data"]["users_count"] = reg.count_users()
+        if durable is None:
+            return reply   # já cadastrado
+
+        # 🔁 replica o cadastro para os outros servidores
+        replication.send(packb({
+            "type": "register_user",
+            "origin": SERVER_NAME,
+            "user": u,
+            "clock": logical_clock.tick(),
+        }))
+        return durable
+
+    if service == "list_users":
+        # paginado na ordem de cadastro: offset + limit, devolve o próximo offset
+        offset = int_field(data, "offset")
+        limit = int_field(data, "limit", USERS_PAGE_LIMIT, 1, USERS_PAGE_MAX)
+        users, next_offset, total = reg.page_users(offset, limit)
+        return reply_to("list_users", {
+            "status": "OK",
+            "users": users,
+            "next_offset": next_offset,
+            "total": total,
+            "timestamp": ts(),
+        })
+
+    if service == "list_channels":
+        return reply_to("list_channels", {
+            "status": "OK",
+            "channels": reg.list_channels(),
+            "timestamp": ts(),
+        })
+
+    if service == "history":
+        # publicações de um canal com clock > since_clock, na ordem do log,
+        # ou as últimas N com "last": N (quem entra ou reconecta)
+        channel = data.get("channel")
+        since = int_field(data, "since_clock")
+        last = int_field(data, "last")
+        limit = max(1, min(last or int_field(data, "limit", HISTORY_LIMIT), HISTORY_MAX))
+
+        if not reg.has_channel(channel):
+            return reply_status("history", "erro", "canal inexistente")
+
+        clocks = []
+        views = read_history(channel, since, limit, last > 0, clocks)
+        last_clock = max(clocks, default=since)
+        header = {
+            "status": "OK",
+            "channel": channel,
+            "last_clock": last_clock,
+            "more": channel_clock.get(channel, 0) > last_clock,
+            "timestamp": ts(),
+        }
+
+        if data.get("raw"):
+            # um frame por registro, direto do log, sem decodificar
+            header["count"] = len(views)
+            return MultipartReply(reply_to("history", header), views)
+
+        # registros emendados na resposta como estão no log/cache
+        header["clock"] = logical_clock.tick()
+        return splice("history", header, "messages", views)
+
+    if service == "replay":
+        return replay(reg, data)
+
+    if service == "inbox_fetch":
+        # mensagens diretas não lidas (clock acima do último inbox_ack)
+        user = data.get("user")
+        limit = int_field(data, "limit", INBOX_LIMIT, 1, INBOX_MAX)
+        if not reg.has_user(user):
+            return reply_status("inbox_fetch", "erro", "usuário inexistente")
+
+        page = inbox.fetch(user, limit, HISTORY_MAX_BYTES)
+        return reply_to("inbox_fetch", {
+            "status": "OK",
+            "user": user,
+            "messages": [msgpack.unpackb(v, raw=False) for v in page["messages"]],
+            "last_clock": max(page["clocks"], default=inbox.acked(user)),
+            "unread": page["unread"],
+            "more": page["more"],
+            "timestamp": ts(),
+        })
+
+    if service == "inbox_ack":
+        # marca como lidas as mensagens com clock <= last_clock (o do inbox_fetch)
+        user = data.get("user")
+        if not reg.has_user(user):
+            return reply_status("inbox_ack", "erro", "usuário inexistente")
+        acked = int_field(data, "last_clock")
+
+        reply = reply_to("inbox_ack", {"status": "OK", "user": user, "timestamp": ts()})
+        durable = inbox.ack(user, acked, reply)
+        reply["data"]["acked"] = inbox.acked(user)
+        reply["data"]["unread"] = inbox.unread(user)
+        if durable is None:
+            return reply   # nada novo confirmado
+
+        # 🔁 replica a confirmação para os outros servidores
+        replication.send(packb({
+            "type": "inbox_ack",
+            "origin": SERVER_NAME,
+            "user": user,
+            "acked": acked,
+            "clock": logical_clock.tick(),
+        }))
+        return durable
+
+    if service == "stats":
+        # contadores, gauges e histogramas deste servidor (ver metrics.py)
+        data = metrics.snapshot()
+        data.update({"status": "OK", "server": SERVER_NAME, "timestamp": ts()})
+        return reply_to("stats", data)
+
+    if service == "clock":
+        # este serviço é chamado por outros processos, mas aqui
+        # mantemos para compatibilidade com o enunciado
+        t = ts()
+        return reply_to("clock", {
+            "time": t,
+            "timestamp": t,
+        })
+
+    if service == "election":
+        # responde requisições de eleição conforme enunciado
+        return reply_to("election", {
+            "election": "OK",
+            "timestamp": ts(),
+        })
+
+    return reply_status(service, "erro", "serviço desconhecido")
+
+
+def durable_reply(service: str, fut: Future) -> dict:
+    """Resposta de uma gravação pendente; falha de I/O vira resposta de erro."""
+    try:
+        return fut.result()
+    except Exception as e:
+        return reply_status(service, "erro", f"falha ao gravar no log: {e}", cache=False)
 
 
 # ---------------------------
-# Loop principal do servidor
+# Modo REP (lockstep, uma requisição por vez)
 # ---------------------------
 
-def main():
-    global msg_count
+def serve_peer_once(peer, reg: Registry, pub) -> None:
+    """Atende um repasse de outro servidor, esperando a gravação no log."""
+    frames = peer.recv_multipart()
+    envelope, service, reply = process_frames(frames, reg, pub, local=True)
+    if isinstance(reply, Future):
+        reply = durable_reply(service, reply)
+    peer.send_multipart(pack_reply(envelope, reply), copy=False)
+
+
+_forward_ids = itertools.count(1)
 
-    ctx = zmq.Context.instance()
 
+def forward_sync(peers, owner: str, raw: bytes, service: str, peer, reg: Registry, pub) -> list:
+    """
+    Repassa a requisição ao dono da chave e espera a resposta (os frames
+    depois do envelope: um só, ou cabeçalho + registros no history raw).
+    Enquanto espera, atende os repasses que chegarem dos outros
+    servidores, para dois servidores em REP não travarem um no outro.
+    """
+    sock = peers.socket(owner)
+    if sock is None:
+        return [forward_error(service).raw]
+    tag = next(_forward_ids).to_bytes(8, "big")
+    sock.send_multipart([tag, b"", raw])
+
+    poller = zmq.Poller()
+    poller.register(sock, zmq.POLLIN)
+    poller.register(peer, zmq.POLLIN)
+    deadline = time.monotonic() + FORWARD_TIMEOUT_MS / 1000.0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            _forward_timeouts.inc()
+            partitioner.suspect(owner, SUSPECT_SECONDS)
+            return [forward_error(service).raw]
+        socks = dict(poller.poll(int(remaining * 1000) + 1))
+        if socks.get(peer) == zmq.POLLIN:
+            serve_peer_once(peer, reg, pub)
+        if socks.get(sock) == zmq.POLLIN:
+            frames = sock.recv_multipart()
+            if frames[0] == tag:
+                return frames[2:]
+            # resposta atrasada de um repasse que já expirou: descarta
+
+
+def serve_rep(ctx, pub, reg) -> None:
     # REP: atende clientes via broker
     rep = ctx.socket(zmq.REP)
     rep.connect(BROKER)
 
-    # PUB: publica mensagens para canais/usuários, réplicas e eleição
-    pub = ctx.socket(zmq.PUB)
-    pub.connect(XSUB)
+    poller = zmq.Poller()
+    poller.register(rep, zmq.POLLIN)
+    peer = peers = None
+    if partitioner.enabled:
+        # ROUTER: recebe os repasses dos outros servidores
+        peer = ctx.socket(zmq.ROUTER)
+        peer.bind(PEER_BIND)
+        poller.register(peer, zmq.POLLIN)
+        peers = Peers(ctx, partitioner)
+
+    while True:
+        socks = dict(poller.poll(100 if pub.latest else 1000))
+        pub.tick()
+        if peer is not None and socks.get(peer) == zmq.POLLIN:
+            serve_peer_once(peer, reg, pub)
+        if socks.get(rep) != zmq.POLLIN:
+            continue
+
+        raw = rep.recv()
+        t0 = time.perf_counter()
+        service = None
+        # REP precisa responder toda requisição: um pedido inválido vira
+        # resposta de erro, como em process_frames, e o loop segue
+        try:
+            req = msgpack.unpackb(raw, raw=False)
+            service = service_of(req)
+            owner = partitioner.route(request_key(req))
+            if owner is not None:
+                _forwarded.inc()
+                rep.send_multipart(forward_sync(peers, owner, raw, service, peer, reg, pub))
+                continue
+            reply = handle_request(req, reg, pub)
+            observe_request(service, t0, reply)
+            if isinstance(reply, Future):
+                reply = durable_reply(service, reply)
+        except Exception as e:
+            reply = reply_status(service, "erro", f"requisição inválida: {e}", cache=False)
+        send_msgpack(rep, reply)
+
+
+# ---------------------------
+# Modo DEALER (pipeline, várias requisições em voo)
+# ---------------------------
+
+class _Outbox:
+    """
+    Socket PUSH por thread que devolve respostas e publicações ao
+    loop principal, dono dos sockets DEALER e PUB (sockets ZeroMQ
+    não podem ser compartilhados entre threads).
+    """
+
+    def __init__(self, ctx):
+        self.sock = ctx.socket(zmq.PUSH)
+        self.sock.connect(OUTBOX_ADDR)
+
+    def send_multipart(self, frames) -> None:
+        # mesmo formato de pub_msgpack: [tópico, payload]
+        self.sock.send_multipart([b"P"] + list(frames))
+
+    def reply(self, frames, dest: bytes = b"R") -> None:
+        # R: resposta ao broker; Q: resposta a um repasse de outro servidor
+        self.sock.send_multipart([dest] + list(frames), copy=False)
+
+    def forward(self, owner: str, service, frames) -> None:
+        self.sock.send_multipart(
+            [b"F", owner.encode("utf-8"), (service or "").encode("utf-8")] + list(frames)
+        )
 
-    # REQ: fala com o servidor de referência
-    ref = ctx.socket(zmq.REQ)
-    ref.connect(REF_ADDR)
+    def wake(self) -> None:
+        # avisa o loop que há gravações concluídas
+        self.sock.send(b"W")
 
-    reg = load_registry()
 
-    # registra servidor na referência e inicia thread de replicação
-    register_with_ref(ref)
-    threading.Thread(target=replica_listener, daemon=True).start()
+_thread_local = threading.local()
 
-    print(f"[{SERVER_NAME}] iniciado. Aguardando requisições...")
+
+def _outbox(ctx) -> _Outbox:
+    box = getattr(_thread_local, "outbox", None)
+    if box is None:
+        box = _thread_local.outbox = _Outbox(ctx)
+    return box
+
+
+def pack_reply(envelope, reply) -> list:
+    """Frames da resposta com o mesmo envelope, para o broker rotear ao cliente."""
+    if isinstance(reply, MultipartReply):
+        return envelope + reply.encode()
+    if isinstance(reply, PackedReply):
+        return envelope + [reply.raw]
+    return envelope + [packb(reply)]
+
+
+def process_frames(frames, reg: Registry, pub, local: bool = False) -> tuple:
+    """
+    Recebe [identidade..., "", corpo] vindo do broker e devolve
+    (envelope, serviço, resposta); a resposta pode ser um Future
+    quando depende de uma gravação no log, ou um Forward quando a chave
+    é de outro servidor (nunca com `local`, usado nos repasses recebidos).
+    """
+    envelope, raw = frames[:-1], frames[-1]
+    service = None
+    t0 = time.perf_counter()
+    try:
+        req = msgpack.unpackb(raw, raw=False)
+        service = service_of(req)
+        owner = None if local else partitioner.route(request_key(req))
+        if owner is not None:
+            _forwarded.inc()
+            reply = Forward(owner)
+        else:
+            reply = handle_request(req, reg, pub)
+            observe_request(service, t0, reply)
+    except Exception as e:
+        reply = reply_status(service, "erro", f"requisição inválida: {e}", cache=False)
+    return envelope, service, reply
+
+
+def _work(ctx, reg: Registry, frames, dest: bytes = b"R") -> None:
+    """Executa uma requisição num worker do pool e devolve pelo outbox."""
+    box = _outbox(ctx)
+    envelope, service, reply = process_frames(frames, reg, box, local=(dest == b"Q"))
+    if isinstance(reply, Forward):
+        box.forward(reply.owner, service, frames)
+    elif isinstance(reply, Future):
+        # a thread de escrita entrega a resposta quando o lote for gravado
+        reply.add_done_callback(lambda fut: _outbox(ctx).reply(
+            pack_reply(envelope, durable_reply(service, fut)), dest
+        ))
+    else:
+        box.reply(pack_reply(envelope, reply), dest)
+
+
+def serve_dealer(ctx, pub, reg) -> None:
+    """
+    DEALER conectado ao DEALER do broker: recebe [identidade, "", corpo]
+    e responde com o mesmo envelope, sem esperar a resposta anterior.
+
+    Com SERVER_WORKERS=0 os handlers rodam no próprio loop; com N > 0
+    rodam num pool de threads (útil quando o handler bloqueia em disco).
+
+    Com particionamento, um ROUTER recebe os repasses dos outros
+    servidores e os pedidos de chaves alheias saem por um DEALER por par;
+    a resposta do dono volta ao broker sem ser decodificada.
+
+    Com BROKER_MODE=lb o broker é ROUTER também do lado dos servidores:
+    o servidor manda ["", "READY", capacidade] periodicamente e o broker
+    só entrega pedidos a quem anunciou folga.
+    """
+    dealer = ctx.socket(zmq.DEALER)
+    dealer.connect(BROKER)
+
+    outbox = ctx.socket(zmq.PULL)
+    outbox.bind(OUTBOX_ADDR)
+
+    workers = None
+    if WORKERS > 0:
+        workers = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="worker")
+    inflight = 0
+
+    # respostas do loop aguardando o group commit, em ordem de chegada;
+    # a thread de escrita manda um aviso por lote gravado
+    pending = deque()
+    log_writer.on_batch = lambda: _outbox(ctx).wake()
+
+    # profundidade das filas do loop (lidas na hora da coleta)
+    metrics.gauge("dealer_inflight", fn=lambda: inflight)
+    metrics.gauge("dealer_pending_durable", fn=lambda: len(pending))
+    metrics.gauge("forwards_waiting", fn=lambda: len(forwards.waiting))
+
+    poller = zmq.Poller()
+    poller.register(dealer, zmq.POLLIN)
+    poller.register(outbox, zmq.POLLIN)
+
+    # entradas de requisições: broker (R) e, se particionado, repasses (Q)
+    intake = [(dealer, b"R")]
+    replies = {b"R": dealer}
+    peers = Peers(ctx, partitioner, poller)
+    forwards = Forwards(FORWARD_TIMEOUT_MS / 1000.0)
+    if partitioner.enabled:
+        peer = ctx.socket(zmq.ROUTER)
+        peer.bind(PEER_BIND)
+        poller.register(peer, zmq.POLLIN)
+        intake.append((peer, b"Q"))
+        replies[b"Q"] = peer
+
+    # modo lb: READY ao conectar e a cada READY_INTERVAL (serve de heartbeat)
+    ready = [b"", b"READY", str(MAX_INFLIGHT).encode("utf-8")]
+    last_ready = 0.0
+
+    def forward(frames, service, owner) -> bool:
+        """Repassa ao dono da chave; False se não há endereço para ele."""
+        sock = peers.socket(owner)
+        if sock is None:
+            return False
+        sock.send_multipart(frames, copy=False)
+        forwards.add(frames, service, owner)
+        return True
 
     while True:
-        req = recv_msgpack(rep)
-        service = req.get("service")
-        data = req.get("data", {}) or {}
-
-        # clock lógico com base na mensagem recebida
-        update_clock(data.get("clock", 0))
-
-        if service == "publish":
-            user = data.get("user")
-            channel = data.get("channel")
-            message = data.get("message")
-            t = data.get("timestamp") or ts()
-
-            if channel not in reg["channels"]:
-                reply_clock = next_clock()
-                send_msgpack(rep, {
-                    "service": "publish",
-                    "data": {
-                        "status": "erro",
-                        "message": "canal inexistente",
-                        "timestamp": t,
-                        "clock": reply_clock,
-                    },
-                })
+        if BROKER_MODE == "lb" and time.monotonic() - last_ready >= READY_INTERVAL:
+            dealer.send_multipart(ready)
+            last_ready = time.monotonic()
+
+        timeout = 100 if forwards.waiting or pub.latest else 1000
+        if BROKER_MODE == "lb":
+            timeout = min(timeout, int(READY_INTERVAL * 1000))
+        socks = dict(poller.poll(timeout))
+        pub.tick()
+
+        if socks.get(outbox) == zmq.POLLIN:
+            # drena respostas/publicações prontas
+            while True:
+                try:
+                    frames = outbox.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                kind = frames[0]
+                if kind in replies:
+                    replies[kind].send_multipart(frames[1:])
+                    inflight -= 1
+                elif kind == b"P":
+                    pub.send_multipart(frames[1:])
+                elif kind == b"F":
+                    owner, service = frames[1].decode("utf-8"), frames[2].decode("utf-8")
+                    if not forward(frames[3:], service, owner):
+                        dealer.send_multipart(pack_reply(frames[3:-1], forward_error(service)))
+                        inflight -= 1
+
+            while pending and pending[0][3].done():
+                sock, envelope, service, fut = pending.popleft()
+                sock.send_multipart(pack_reply(envelope, durable_reply(service, fut)))
+                inflight -= 1
+
+        # respostas dos donos aos repasses: voltam direto ao broker
+        for sock in socks:
+            if sock not in peers:
+                continue
+            while True:
+                try:
+                    frames = sock.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if forwards.done(frames):
+                    dealer.send_multipart(frames, copy=False)
+                    inflight -= 1
+
+        for envelope, service, owner in forwards.expired():
+            _forward_timeouts.inc()
+            partitioner.suspect(owner, SUSPECT_SECONDS)
+            dealer.send_multipart(pack_reply(envelope, forward_error(service)))
+            inflight -= 1
+
+        for src, dest in intake:
+            if socks.get(src) != zmq.POLLIN:
                 continue
+            while inflight < MAX_INFLIGHT:
+                try:
+                    frames = src.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                if workers is not None:
+                    inflight += 1
+                    workers.submit(_work, ctx, reg, frames, dest)
+                    continue
+                envelope, service, reply = process_frames(frames, reg, pub, local=(dest == b"Q"))
+                if isinstance(reply, Forward):
+                    if forward(frames, service, reply.owner):
+                        inflight += 1
+                    else:
+                        src.send_multipart(pack_reply(envelope, forward_error(service)))
+                elif isinstance(reply, Future):
+                    pending.append((src, envelope, service, reply))
+                    inflight += 1
+                else:
+                    src.send_multipart(pack_reply(envelope, reply), copy=False)
+
+        # limita requisições em voo: sem espaço, para de ler as entradas
+        mask = 0 if inflight >= MAX_INFLIGHT else zmq.POLLIN
+        for src, _ in intake:
+            poller.modify(src, mask)
 
-            # payload da publicação
-            payload_clock = next_clock()
-            payload = {
-                "type": "publish",
-                "origin": SERVER_NAME,  # quem gerou
-                "channel": channel,
-                "user": user,
-                "message": message,
-                "timestamp": t,
-                "clock": payload_clock,
-            }
 
-            # publica para os clientes do canal
-            pub_msgpack(pub, channel, payload)
-            # grava localmente
-            append(LOG_PUB, payload)
-            # 🔁 replica para outros servidores
-            pub_msgpack(pub, "replica", payload)
-
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "publish",
-                "data": {
-                    "status": "OK",
-                    "message": "",
-                    "timestamp": t,
-                    "clock": reply_clock,
-                },
-            })
-            msg_count += 1
-
-        elif service == "message":
-            src = data.get("src")
-            dst = data.get("dst")
-            message = data.get("message")
-            t = data.get("timestamp") or ts()
-
-            if reg["users"] and dst not in reg["users"]:
-                reply_clock = next_clock()
-                send_msgpack(rep, {
-                    "service": "message",
-                    "data": {
-                        "status": "erro",
-                        "message": "usuário inexistente",
-                        "timestamp": t,
-                        "clock": reply_clock,
-                    },
-                })
-                continue
+# ---------------------------
+# Loop principal do servidor
+# ---------------------------
 
-            payload_clock = next_clock()
-            payload = {
-                "type": "message",
-                "origin": SERVER_NAME,
-                "src": src,
-                "dst": dst,
-                "message": message,
-                "timestamp": t,
-                "clock": payload_clock,
-            }
+def capture_state() -> dict:
+    """Estado para o snapshot; offsets e checkpoints lidos sob o mesmo lock."""
+    with replication.lock:
+        state = {
+            "replication": replication.offsets(),
+            "stores": {
+                "publications": pub_store.checkpoint(),
+                "messages": msg_store.checkpoint(),
+            },
+            "high_water": dict(channel_clock),
+            "clock": logical_clock.value,
+        }
+    return state
 
-            # publica para o usuário de destino
-            pub_msgpack(pub, dst, payload)
-            # grava localmente
-            append(LOG_MSG, payload)
-            # 🔁 replica para outros servidores
-            pub_msgpack(pub, "replica", payload)
-
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "message",
-                "data": {
-                    "status": "OK",
-                    "message": "",
-                    "timestamp": t,
-                    "clock": reply_clock,
-                },
-            })
-            msg_count += 1
-
-        elif service == "register_user":
-            u = data.get("user")
-            if u and u not in reg["users"]:
-                reg["users"].append(u)
-                save_registry(reg)
-
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "register_user",
-                "data": {
-                    "status": "OK",
-                    "users": reg["users"],
-                    "timestamp": ts(),
-                    "clock": reply_clock,
-                },
-            })
-
-        elif service == "list_channels":
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "list_channels",
-                "data": {
-                    "status": "OK",
-                    "channels": reg["channels"],
-                    "timestamp": ts(),
-                    "clock": reply_clock,
-                },
-            })
-
-        elif service == "clock":
-            # este serviço é chamado por outros processos, mas aqui
-            # mantemos para compatibilidade com o enunciado
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "clock",
-                "data": {
-                    "time": ts(),
-                    "timestamp": ts(),
-                    "clock": reply_clock,
-                },
-            })
-
-        elif service == "election":
-            # responde requisições de eleição conforme enunciado
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": "election",
-                "data": {
-                    "election": "OK",
-                    "timestamp": ts(),
-                    "clock": reply_clock,
-                },
-            })
 
-        else:
-            reply_clock = next_clock()
-            send_msgpack(rep, {
-                "service": service,
-                "data": {
-                    "status": "erro",
-                    "message": "serviço desconhecido",
-                    "timestamp": ts(),
-                    "clock": reply_clock,
-                },
-            })
-
-        # a cada N mensagens: sincroniza relógio com o ref
-        # e atualiza coordenador (eleição baseada no rank)
-        if msg_count > 0 and msg_count % SYNC_EVERY == 0:
-            sync_clock_with_ref(ref)
-            refresh_servers_and_maybe_elect(ref, pub)
-
-        # heartbeat pro servidor de referência
-        maybe_send_heartbeat(ref)
+def restore_state() -> tuple:
+    """
+    Abre os stores a partir do último snapshot e reprocessa só a cauda do
+    log gravada depois dele. Devolve (registro de snapshots antigos,
+    offsets de replicação).
+    """
+    global pub_store, msg_store, channel_clock, recovered, inbox, hot_cache
+
+    t0 = time.perf_counter()
+    state = snapshot.load(SNAPSHOT_PATH) or {}
+    checkpoints = state.get("stores", {})
+
+    stores = {}
+    for name in ("publications", "messages"):
+        stores[name] = SegmentStore(
+            os.path.join(STORE_DIR, name), log_writer,
+            segment_bytes=SEGMENT_BYTES, segment_seconds=SEGMENT_SECONDS,
+            index_every=INDEX_EVERY, checkpoint=checkpoints.get(name),
+        )
+    pub_store, msg_store = stores["publications"], stores["messages"]
+
+    max_clock, channel_clock, recovered = snapshot.replay_tail(stores, state, SERVER_NAME, REPL_RETAIN)
+    logical_clock.advance_to(max_clock)
+    # índice das caixas de entrada: reindexa o que o log tem além do checkpoint dele
+    inbox = InboxIndex(
+        os.path.join(STORE_DIR, "inbox"), msg_store, log_writer,
+        cache_users=INBOX_CACHE_USERS, compact_every=REGISTRY_COMPACT_EVERY, fsync=LOG_FSYNC,
+    ).open()
+    hot_cache = HotCache(pub_store, HOT_CACHE_BYTES, HOT_CACHE_RECORDS)
+    if hot_cache.enabled:
+        pub_store.on_append = hot_cache.add
+
+    origem = "snapshot + cauda" if state else "log inteiro"
+    log(f"estado restaurado ({origem}) em "
+        f"{(time.perf_counter() - t0) * 1000:.1f} ms (clock={logical_clock.value})")
+    return state.get("registry"), state.get("replication")
+
+
+def supervise() -> None:
+    """SERVER_PROCESSES > 1: sobe e acompanha os workers deste host."""
+    Supervisor(
+        SERVER_NAME, SERVER_PROCESSES, os.path.abspath(__file__), REF_ADDR, logical_clock,
+        heartbeat_s=HEARTBEAT_INTERVAL,
+        peer_bind=PEER_BIND, peer_addr=PEER_ADDR, metrics_port=METRICS_PORT,
+        ref_timeout_ms=REF_TIMEOUT_MS, ref_retries=REF_RETRIES, log=log,
+    ).run()
+
+
+def main():
+    global log_writer, replication, partitioner, registry
+
+    if SERVER_PROCESSES > 1:
+        supervise()
+        return
+
+    ctx = zmq.Context.instance()
+    if METRICS_PORT:
+        try:
+            metrics.serve_http(METRICS_PORT)
+            log(f"métricas em http://0.0.0.0:{METRICS_PORT}/metrics")
+        except OSError as e:
+            log(f"porta de métricas {METRICS_PORT} indisponível: {e}", "warn")
+    log_writer = LogWriter(batch_max=LOG_BATCH, flush_ms=LOG_FLUSH_MS, fsync=LOG_FSYNC)
+    partitioner = Partitioner(SERVER_NAME, PARTITION_RF)
+    snap_registry, snap_offsets = restore_state()
+
+    # PUB: publica mensagens para canais/usuários, réplicas e eleição
+    pub = open_pub(ctx, "pub", PUB_COALESCE)
+
+    reg = registry = load_registry(snap_registry)
+
+    # coordenação com o ref em segundo plano (registro, heartbeat, clock e
+    # eleição); espera um pouco pelo primeiro registro para já partir com
+    # a lista de servidores, mas não depende dele para atender
+    threading.Thread(target=coordinate, args=(ctx,), name="ref", daemon=True).start()
+    if not registered.wait(REF_STARTUP_WAIT):
+        log("ref indisponível na partida; registro segue em segundo plano")
+
+    # inicia thread de replicação
+    replication = ReplicaStream(
+        ctx, SERVER_NAME, XSUB, XPUB, apply_replicas,
+        batch_max=REPL_BATCH, flush_ms=REPL_FLUSH_MS, retain=REPL_RETAIN,
+        sndhwm=REPL_SNDHWM, rcvhwm=REPL_RCVHWM, apply_queue=REPL_APPLY_QUEUE,
+        sync_source=lambda: reg.snapshot()["users"], sync_apply=merge_users,
+        log=log, debug=log_debug,
+    )
+    replication.restore(snap_offsets)
+    replication.start()
+    inbox.start(INBOX_FLUSH_S)
+
+    retention = RetentionEngine(
+        {"publications": pub_store, "messages": msg_store},
+        RetentionPolicy(RETENTION_SECONDS, RETENTION_BYTES, parse_overrides(RETENTION_OVERRIDES)),
+        archive_after_s=ARCHIVE_AFTER_S, codec=ARCHIVE_CODEC, io_rate=RETENTION_IO_RATE,
+        store_max_bytes=STORE_MAX_BYTES, interval_s=RETENTION_INTERVAL, log=log,
+    )
+    if retention.enabled:
+        retention.start()
+        log(f"retenção ativa (arquivamento com {retention.codec}, "
+            f"I/O até {RETENTION_IO_RATE / 1048576:.0f} MiB/s)")
+
+    if SNAPSHOT_INTERVAL > 0:
+        snapshot.Snapshotter(
+            SNAPSHOT_PATH, capture_state, log_writer, SNAPSHOT_INTERVAL,
+            log=log,
+        ).start()
+
+    mode = SERVER_MODE
+    if BROKER_MODE == "lb" and mode != "dealer":
+        # REP não consegue mandar READY: o broker lb só fala com DEALER
+        log("BROKER_MODE=lb exige SERVER_MODE=dealer; usando dealer")
+        mode = "dealer"
+
+    log(f"iniciado (modo {mode}). Aguardando requisições...")
+
+    if mode == "dealer":
+        serve_dealer(ctx, pub, reg)
+    else:
+        serve_rep(ctx, pub, reg)
 
 
 if __name__ == "__main__":
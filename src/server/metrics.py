@@ -0,0 +1,207 @@
+"""
+Métricas do servidor: contadores, gauges e histogramas de latência.
+
+Tudo fica num registro global do processo (`counter`, `gauge`,
+`histogram` devolvem sempre o mesmo objeto para o mesmo nome + labels),
+então cada módulo pega os seus instrumentos uma vez e só incrementa no
+caminho quente. Os histogramas têm buckets fixos em milissegundos (uma
+busca binária e um incremento por observação, sem guardar amostras).
+
+Leitura: `snapshot()` (serviço `stats`) ou `prometheus()` (texto no
+formato de exposição do Prometheus, servido por `serve_http`).
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# limites superiores dos buckets, em ms (o último bucket é +Inf)
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_lock = threading.Lock()
+_metrics = {}            # (nome, labels ordenados) -> instrumento
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def _get(cls, name: str, labels: dict, *args):
+    key = _key(name, labels)
+    m = _metrics.get(key)
+    if m is None:
+        with _lock:
+            m = _metrics.get(key)
+            if m is None:
+                m = _metrics[key] = cls(name, key[1], *args)
+    return m
+
+
+class Counter:
+    __slots__ = ("name", "labels", "value", "_lock")
+    kind = "counter"
+
+    def __init__(self, name: str, labels: tuple):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1) -> None:
+        with self._lock:
+            self.value += n
+
+
+class Gauge:
+    """Valor instantâneo: definido com set() ou lido de `fn` na hora da coleta."""
+
+    __slots__ = ("name", "labels", "value", "fn")
+    kind = "gauge"
+
+    def __init__(self, name: str, labels: tuple, fn=None):
+        self.name = name
+        self.labels = labels
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value) -> None:
+        self.value = value
+
+    def read(self):
+        if self.fn is None:
+            return self.value
+        try:
+            return self.fn()
+        except Exception:
+            return 0
+
+
+class Histogram:
+    __slots__ = ("name", "labels", "counts", "total", "sum", "max", "_lock")
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: tuple):
+        self.name = name
+        self.labels = labels
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float) -> None:
+        i = bisect.bisect_left(BUCKETS_MS, ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.total += 1
+            self.sum += ms
+            if ms > self.max:
+                self.max = ms
+
+    def observe_since(self, t0: float, now: float) -> None:
+        """Observa o intervalo entre dois perf_counter(), em ms."""
+        self.observe((now - t0) * 1000.0)
+
+    def quantile(self, q: float) -> float:
+        """Estimativa pelo limite superior do bucket que contém o quantil."""
+        with self._lock:
+            counts, total, top = list(self.counts), self.total, self.max
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            seen += n
+            if seen >= rank and n:
+                return min(BUCKETS_MS[i], top) if i < len(BUCKETS_MS) else top
+        return top
+
+
+def counter(name: str, **labels) -> Counter:
+    return _get(Counter, name, labels)
+
+
+def gauge(name: str, fn=None, **labels) -> Gauge:
+    g = _get(Gauge, name, labels)
+    if fn is not None:
+        g.fn = fn
+    return g
+
+
+def histogram(name: str, **labels) -> Histogram:
+    return _get(Histogram, name, labels)
+
+
+# ---------------------------
+# Coleta
+# ---------------------------
+
+def _label_str(labels: tuple) -> str:
+    return ",".join(f"{k}={v}" for k, v in labels)
+
+
+def snapshot() -> dict:
+    """Resumo para o serviço `stats`: {"counters", "gauges", "histograms"}."""
+    out = {"counters": {}, "gauges": {}, "histograms": {}}
+    for (name, labels), m in sorted(_metrics.items(), key=lambda kv: kv[0]):
+        key = f"{name}{{{_label_str(labels)}}}" if labels else name
+        if m.kind == "counter":
+            out["counters"][key] = m.value
+        elif m.kind == "gauge":
+            out["gauges"][key] = m.read()
+        elif m.total:
+            out["histograms"][key] = {
+                "count": m.total,
+                "avg_ms": round(m.sum / m.total, 3),
+                "p50_ms": m.quantile(0.50),
+                "p99_ms": m.quantile(0.99),
+                "max_ms": round(m.max, 3),
+            }
+    return out
+
+
+def prometheus(prefix: str = "chat_") -> str:
+    """Texto no formato de exposição do Prometheus."""
+    lines = []
+    typed = set()
+    for (name, labels), m in sorted(_metrics.items(), key=lambda kv: kv[0]):
+        full = prefix + name
+        if full not in typed:
+            lines.append(f"# TYPE {full} {m.kind}")
+            typed.add(full)
+        base = [f'{k}="{v}"' for k, v in labels]
+        lab = "{" + ",".join(base) + "}" if base else ""
+        if m.kind == "counter":
+            lines.append(f"{full}{lab} {m.value}")
+        elif m.kind == "gauge":
+            lines.append(f"{full}{lab} {m.read()}")
+        else:
+            with m._lock:
+                counts, total, total_sum = list(m.counts), m.total, m.sum
+            acc = 0
+            for bound, n in zip(list(BUCKETS_MS) + ["+Inf"], counts):
+                acc += n
+                le = "{" + ",".join(base + [f'le="{bound}"']) + "}"
+                lines.append(f"{full}_bucket{le} {acc}")
+            lines.append(f"{full}_sum{lab} {total_sum}")
+            lines.append(f"{full}_count{lab} {total}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_http(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Endpoint /metrics (Prometheus) numa thread própria."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass   # sem uma linha de log por coleta
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,191 @@
+"""
+Particionamento de canais e destinatários entre os servidores.
+
+Cada chave (canal ou destinatário de mensagem direta) pertence a
+`rf` servidores, escolhidos num anel de hash consistente montado com a
+lista de membros do `ref`. Só os donos gravam a chave; uma requisição
+que chega (pelo broker) num servidor que não é dono é repassada a um
+dono pelo socket de pares.
+
+Formato no socket de pares (DEALER -> ROUTER):
+
+    [envelope do broker..., corpo]
+
+O dono responde com o mesmo envelope e quem repassou devolve os frames
+ao broker sem decodificar.
+"""
+import bisect
+import hashlib
+import time
+
+import zmq
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Anel de hash consistente com `vnodes` pontos por servidor."""
+
+    def __init__(self, members, vnodes: int = 64):
+        self.members = tuple(sorted(members))
+        points = []
+        for name in self.members:
+            for i in range(vnodes):
+                points.append((_hash(f"{name}#{i}"), name))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._names = [n for _, n in points]
+        self._cache = {}
+
+    def owners(self, key: str, rf: int) -> tuple:
+        """Os `rf` donos da chave, o primário primeiro."""
+        if not self.members:
+            return ()
+        rf = min(rf, len(self.members))
+        hit = self._cache.get(key)
+        if hit is not None and len(hit) == rf:
+            return hit
+
+        found = []
+        i = bisect.bisect(self._hashes, _hash(key))
+        for step in range(len(self._names)):
+            name = self._names[(i + step) % len(self._names)]
+            if name not in found:
+                found.append(name)
+                if len(found) == rf:
+                    break
+        found = tuple(found)
+        if len(self._cache) < 100000:
+            self._cache[key] = found
+        return found
+
+
+class Partitioner:
+    """
+    Visão de quem é dono de cada chave. `update()` é chamado com a lista
+    do `ref` (na thread do ref); as leituras trocam só a referência do
+    anel, então não precisam de lock.
+    """
+
+    def __init__(self, me: str, rf: int, vnodes: int = 64):
+        self.me = me
+        self.rf = int(rf)
+        self.vnodes = vnodes
+        self.addrs = {}
+        self.ring = HashRing([me], vnodes)
+        self.suspects = {}       # nome -> até quando evitar (sem resposta)
+
+    @property
+    def enabled(self) -> bool:
+        return self.rf > 0
+
+    def update(self, servers: dict) -> bool:
+        """Reconstrói o anel se os membros mudaram; devolve True nesse caso."""
+        addrs = {name: info.get("addr") for name, info in (servers or {}).items()
+                 if info.get("addr")}
+        addrs.setdefault(self.me, None)
+        if set(addrs) == set(self.ring.members) and addrs == self.addrs:
+            return False
+        self.addrs = addrs
+        self.ring = HashRing(addrs, self.vnodes)
+        return True
+
+    def owners(self, key: str) -> tuple:
+        return self.ring.owners(str(key or ""), self.rf)
+
+    def owns(self, key: str) -> bool:
+        return not self.enabled or self.me in self.owners(key)
+
+    def route(self, key: str):
+        """
+        None se a chave é local (ou se não há chave: atende em qualquer
+        servidor); senão o dono para onde repassar (o primeiro que não
+        deixou um repasse sem resposta há pouco).
+        """
+        if not self.enabled or key is None:
+            return None
+        owners = self.owners(key)
+        if self.me in owners:
+            return None
+        now = time.monotonic()
+        for name in owners:
+            if self.suspects.get(name, 0) <= now:
+                return name
+        return owners[0]
+
+    def suspect(self, name: str, seconds: float) -> None:
+        self.suspects[name] = time.monotonic() + seconds
+
+
+class Peers:
+    """
+    Sockets DEALER para os outros servidores (um por par, criados sob
+    demanda). Usado só pela thread dona do loop de atendimento.
+    """
+
+    def __init__(self, ctx, partitioner: Partitioner, poller=None):
+        self.ctx = ctx
+        self.partitioner = partitioner
+        self.poller = poller
+        self.socks = {}
+
+    def socket(self, name: str):
+        addr = self.partitioner.addrs.get(name)
+        sock, current = self.socks.get(name, (None, None))
+        if sock is not None and current == addr:
+            return sock
+        if sock is not None:
+            if self.poller is not None:
+                self.poller.unregister(sock)
+            sock.close(0)
+        if not addr:
+            self.socks.pop(name, None)
+            return None
+        sock = self.ctx.socket(zmq.DEALER)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(addr)
+        if self.poller is not None:
+            self.poller.register(sock, zmq.POLLIN)
+        self.socks[name] = (sock, addr)
+        return sock
+
+    def __contains__(self, sock) -> bool:
+        return any(sock is s for s, _ in self.socks.values())
+
+
+def envelope_of(frames) -> tuple:
+    """
+    Envelope de roteamento de uma mensagem (frames até o delimitador
+    vazio, inclusive). O corpo pode ter vários frames (history raw).
+    """
+    for i, frame in enumerate(frames):
+        if len(frame) == 0:
+            return tuple(frames[:i + 1])
+    return tuple(frames[:-1])
+
+
+class Forwards:
+    """Requisições repassadas aguardando resposta, com prazo."""
+
+    def __init__(self, timeout_s: float):
+        self.timeout = timeout_s
+        self.waiting = {}        # envelope -> (prazo, serviço, dono)
+
+    def add(self, frames, service, owner) -> None:
+        """`frames`: a requisição repassada, com o envelope do broker."""
+        self.waiting[envelope_of(frames)] = (time.monotonic() + self.timeout, service, owner)
+
+    def done(self, frames) -> bool:
+        """`frames`: a resposta do dono (um ou mais frames depois do envelope)."""
+        return self.waiting.pop(envelope_of(frames), None) is not None
+
+    def expired(self) -> list:
+        """Remove e devolve (envelope, serviço, dono) das que passaram do prazo."""
+        now = time.monotonic()
+        late = [(list(env), svc, owner) for env, (deadline, svc, owner) in self.waiting.items()
+                if deadline <= now]
+        for env, _, _ in late:
+            del self.waiting[tuple(env)]
+        return late
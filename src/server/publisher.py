@@ -0,0 +1,92 @@
+"""
+PUB com limite de fila explícito e contagem de descartes por tópico.
+
+Um PUB do ZeroMQ nunca bloqueia: com a fila para o proxy cheia (SNDHWM),
+a mensagem some sem aviso. Aqui o socket usa XPUB_NODROP e envio
+NOBLOCK, então o descarte vira um zmq.Again que é contado por tópico,
+aparece nas métricas e é registrado no log a cada `report_s` segundos.
+
+Tópicos de alta taxa listados em `coalesce` não descartam: sob pressão
+fica só a última mensagem de cada um (as anteriores contam como
+coalescidas), enviada assim que a fila andar. Serve a canais em que só o
+valor mais recente importa. O dono do socket chama tick() no seu loop
+para esvaziar esses pendentes e emitir o aviso de descartes mesmo sem
+novas publicações.
+
+Não é thread-safe, como o socket: usar só na thread dona dele.
+"""
+import time
+
+import zmq
+
+import metrics
+
+
+class Publisher:
+    def __init__(self, sock, name: str, sndhwm: int = 1000, coalesce=(),
+                 label=None, report_s: float = 10.0, log=print):
+        self.sock = sock
+        sock.setsockopt(zmq.SNDHWM, int(sndhwm))
+        sock.setsockopt(zmq.XPUB_NODROP, 1)
+        self.name = name
+        self.coalesce = {t.encode("utf-8") if isinstance(t, str) else t for t in coalesce}
+        self.label = label or (lambda topic: topic)   # tópico -> label da métrica
+        self.report_s = report_s
+        self.log = log
+
+        self.latest = {}         # tópico coalescido -> frames ainda não enviados
+        self._window = {}        # tópico -> descartes desde o último aviso
+        self._reported = time.monotonic()
+        metrics.gauge("pub_coalesced_pending", fn=lambda: len(self.latest), socket=name)
+
+    def send_multipart(self, frames, copy: bool = True) -> bool:
+        """Publica [tópico, ...]; False se a mensagem foi descartada ou coalescida."""
+        if self.latest:
+            self.flush()
+        try:
+            self.sock.send_multipart(frames, zmq.NOBLOCK, copy=copy)
+            return True
+        except zmq.Again:
+            pass
+
+        topic = bytes(frames[0])
+        if topic in self.coalesce:
+            if topic in self.latest:
+                self._count("pub_coalesced_total", topic)
+            self.latest[topic] = frames
+        else:
+            self._count("pub_dropped_total", topic)
+            self._window[topic] = self._window.get(topic, 0) + 1
+            if time.monotonic() - self._reported >= self.report_s:
+                self._report()
+        return False
+
+    def tick(self) -> None:
+        """Chamado periodicamente pelo loop dono do socket."""
+        if self.latest:
+            self.flush()
+        if self._window and time.monotonic() - self._reported >= self.report_s:
+            self._report()
+
+    def flush(self) -> None:
+        """Tenta enviar as últimas mensagens dos tópicos coalescidos."""
+        for topic in list(self.latest):
+            try:
+                self.sock.send_multipart(self.latest[topic], zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            del self.latest[topic]
+
+    def _count(self, name: str, topic: bytes) -> None:
+        label = self.label(topic.decode("utf-8", "replace"))
+        metrics.counter(name, socket=self.name, topic=label).inc()
+
+    def _report(self) -> None:
+        now = time.monotonic()
+        worst = sorted(self._window.items(), key=lambda kv: -kv[1])
+        shown = ", ".join(f"{t.decode('utf-8', 'replace')}={n}" for t, n in worst[:10])
+        more = f" (+{len(worst) - 10} tópicos)" if len(worst) > 10 else ""
+        self.log(f"{self.name}: {sum(self._window.values())} mensagem(ns) descartada(s) "
+                 f"com a fila cheia em {now - self._reported:.0f}s: {shown}{more}")
+        self._window.clear()
+        self._reported = now
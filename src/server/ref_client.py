@@ -0,0 +1,40 @@
+"""
+Cliente REQ do servidor de referência com timeout (padrão "Lazy Pirate").
+
+Um REQ que perde a resposta fica preso esperando para sempre; aqui cada
+pedido espera no máximo `timeout_ms` e, sem resposta, o socket é
+descartado e recriado antes de tentar de novo.
+"""
+import zmq
+
+
+class RefClient:
+    def __init__(self, ctx, addr: str, timeout_ms: float = 1000.0, retries: int = 2):
+        self.ctx = ctx
+        self.addr = addr
+        self.timeout_ms = int(timeout_ms)
+        self.retries = max(1, int(retries))
+        self.sock = None
+        self._connect()
+
+    def _connect(self) -> None:
+        if self.sock is not None:
+            self.sock.close(0)
+        self.sock = self.ctx.socket(zmq.REQ)
+        self.sock.setsockopt(zmq.LINGER, 0)
+        self.sock.connect(self.addr)
+
+    def request(self, msg: dict) -> dict:
+        """Envia `msg` (JSON) e devolve a resposta; TimeoutError se o ref não responder."""
+        for _ in range(self.retries):
+            self.sock.send_json(msg)
+            if self.sock.poll(self.timeout_ms, zmq.POLLIN):
+                return self.sock.recv_json()
+            # sem resposta: o REQ não aceita outro send, recria o socket
+            self._connect()
+        raise TimeoutError(f"ref não respondeu em {self.retries} tentativa(s)")
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close(0)
+            self.sock = None
@@ -0,0 +1,184 @@
+"""
+Registro de usuários e canais com índice em memória e journal.
+
+Usuários e canais ficam em dicts (busca O(1)) e numa lista na ordem de
+cadastro (usada na paginação). Cada cadastro novo vira uma linha JSONL
+no journal `registry.<geração>.journal`, gravada pelo LogWriter; a cada
+`compact_every` linhas o registro inteiro vai para `registry.json` e o
+journal recomeça numa geração nova. Na partida: registry.json + journals
+da geração dele em diante.
+"""
+import glob
+import json
+import os
+import re
+import threading
+
+DEFAULT_CHANNELS = ["general", "random", "dev"]
+
+_JOURNAL_RE = re.compile(r"\.(\d+)\.journal$")
+
+
+class Registry:
+    def __init__(self, path: str, writer, compact_every: int = 10000):
+        self.path = path
+        self.base = os.path.splitext(path)[0]
+        self.writer = writer
+        self.compact_every = max(1, int(compact_every))
+
+        self.lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self.users = {}          # nome -> posição em user_list
+        self.user_list = []
+        self.channels = {}
+        self.channel_list = []
+        self.generation = 0
+        self.pending = 0         # linhas no journal da geração atual
+
+    # ---------------------------
+    # Partida
+    # ---------------------------
+
+    def _journal(self, gen: int) -> str:
+        return f"{self.base}.{gen}.journal"
+
+    def _apply(self, entry: dict) -> None:
+        name = entry.get("name")
+        if not name:
+            return
+        if entry.get("op") == "user" and name not in self.users:
+            self.users[name] = len(self.user_list)
+            self.user_list.append(name)
+        elif entry.get("op") == "channel" and name not in self.channels:
+            self.channels[name] = len(self.channel_list)
+            self.channel_list.append(name)
+
+    def load(self, fallback: dict = None) -> "Registry":
+        """Carrega registry.json e reaplica os journals (ou usa `fallback`)."""
+        state = None
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        fresh = state is None
+        state = state or fallback or {"channels": DEFAULT_CHANNELS, "users": []}
+
+        for name in state.get("channels", []):
+            self._apply({"op": "channel", "name": name})
+        for name in state.get("users", []):
+            self._apply({"op": "user", "name": name})
+        self.generation = int(state.get("journal", 0))
+
+        journals = []
+        for path in glob.glob(glob.escape(self.base) + ".*.journal"):
+            m = _JOURNAL_RE.search(path)
+            if m:
+                journals.append((int(m.group(1)), path))
+
+        replayed = 0
+        for gen, path in sorted(journals):
+            if gen < self.generation:
+                os.remove(path)      # já está no registry.json
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except ValueError:
+                        break        # última linha incompleta (queda no meio da gravação)
+                    replayed += 1
+            self.generation = max(self.generation, gen)
+
+        if fresh or replayed:
+            self.compact()
+        return self
+
+    # ---------------------------
+    # Consultas (sem lock: leituras de dict são atômicas)
+    # ---------------------------
+
+    def has_user(self, name) -> bool:
+        return name in self.users
+
+    def has_channel(self, name) -> bool:
+        return name in self.channels
+
+    def count_users(self) -> int:
+        return len(self.user_list)
+
+    def list_channels(self) -> list:
+        return list(self.channel_list)
+
+    def page_users(self, offset: int, limit: int) -> tuple:
+        """(usuários, próximo offset ou None, total) na ordem de cadastro."""
+        offset = max(0, int(offset))
+        page = self.user_list[offset:offset + limit]
+        end = offset + len(page)
+        total = len(self.user_list)
+        return page, (end if end < total else None), total
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"channels": list(self.channel_list), "users": list(self.user_list)}
+
+    # ---------------------------
+    # Alterações
+    # ---------------------------
+
+    def add_user(self, name, result=None):
+        """
+        Cadastra o usuário. Devolve o Future da linha no journal (com
+        `result`), ou None se ele já existia.
+        """
+        return self._add("user", name, result)
+
+    def add_channel(self, name, result=None):
+        return self._add("channel", name, result)
+
+    def _add(self, op: str, name, result):
+        if not name:
+            return None
+        index = self.users if op == "user" else self.channels
+        compact = False
+        with self.lock:
+            if name in index:
+                return None
+            self._apply({"op": op, "name": name})
+            fut = self.writer.append(self._journal(self.generation), {"op": op, "name": name}, result)
+            self.pending += 1
+            if self.pending >= self.compact_every:
+                compact = True
+                self.pending = 0
+        if compact:
+            self.compact()
+        return fut
+
+    def compact(self) -> None:
+        """
+        Grava o registro inteiro em registry.json e passa o journal para
+        uma geração nova; o journal antigo é apagado depois de fechado.
+        """
+        with self._compact_lock:
+            with self.lock:
+                old = self.generation
+                self.generation += 1
+                self.pending = 0
+                state = {
+                    "channels": list(self.channel_list),
+                    "users": list(self.user_list),
+                    "journal": self.generation,
+                }
+
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+
+            path = self._journal(old)
+            self.writer.release(path).add_done_callback(lambda _: _remove(path))
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
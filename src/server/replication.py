@@ -0,0 +1,481 @@
+"""
+Fluxo de replicação em lotes com números de sequência e reparo de lacunas.
+
+Formato no tópico 'replica' (um multipart por lote):
+
+    ["replica", cabeçalho, registro_1, ..., registro_n]
+
+O cabeçalho é um mapa MessagePack {origin, epoch, first, count, sent}: os
+registros (bytes MessagePack já codificados) têm as sequências
+first..first+count-1 da origem. `epoch` identifica a encarnação do
+processo de origem; um epoch novo reinicia a numeração. Lotes com
+count=0 servem de "tip" periódico, para o receptor perceber que perdeu
+o último lote mesmo sem tráfego novo. `sent` (time.time() da origem) dá
+o atraso de replicação medido no receptor.
+
+Quem detecta uma lacuna publica um pedido no tópico 'repair.<origem>'
+com o intervalo que falta; a origem reenvia esses registros (do seu
+buffer circular) como um lote comum no tópico 'replica'.
+
+Estado que não cabe no buffer circular (o registro de usuários, que todo
+servidor tem inteiro) vem por anti-entropia: ao iniciar, o servidor publica
+{from} no tópico 'sync-request' até receber uma resposta; cada par
+devolve o seu estado em páginas no tópico 'sync.<quem pediu>', a última
+com last=True. Assim um servidor novo, ou que voltou com o disco vazio,
+conhece o que foi cadastrado antes de ele subir, mesmo que o buffer da
+origem já tenha girado.
+
+A thread de recebimento só ordena e pede reparos; os registros em ordem
+vão por uma fila limitada (`apply_queue` lotes) para a thread que os
+aplica. Com a fila cheia o lote é descartado e contado, como se tivesse
+se perdido na rede: o receptor não para de esvaziar o SUB e o reparo
+traz o lote de novo quando a aplicação alcançar.
+"""
+import math
+import queue
+import threading
+import time
+
+import zmq
+import msgpack
+
+import metrics
+from publisher import Publisher
+
+TOPIC = b"replica"
+REPAIR_PREFIX = "repair."
+SYNC_TOPIC = b"sync-request"
+SYNC_PREFIX = "sync."
+
+
+class _Ring:
+    """Buffer circular dos últimos registros enviados, indexado por sequência."""
+
+    def __init__(self, size: int):
+        self.size = max(1, int(size))
+        self.seqs = [0] * self.size
+        self.items = [None] * self.size
+
+    def put(self, seq: int, raw: bytes) -> None:
+        i = seq % self.size
+        self.seqs[i] = seq
+        self.items[i] = raw
+
+    def get(self, seq: int):
+        i = seq % self.size
+        return self.items[i] if self.seqs[i] == seq else None
+
+
+class _OriginState:
+    """O que um receptor sabe de uma origem."""
+
+    __slots__ = ("epoch", "next", "pending", "last_repair")
+
+    def __init__(self, epoch: int):
+        self.epoch = epoch
+        self.next = 1            # próxima sequência esperada
+        self.pending = {}        # seq -> registro que chegou fora de ordem
+        self.last_repair = 0.0
+
+
+class ReplicaStream:
+    """
+    Envia os registros locais em lotes e aplica os lotes de outros
+    servidores em ordem de sequência, pedindo reparo quando falta algo.
+    Roda numa thread própria, dona dos sockets PUB/SUB de replicação.
+
+    `apply(records)` é chamado na thread de aplicação com uma lista de
+    (payload, raw) remotos, na ordem de cada origem: vários lotes que
+    esperavam na fila (até `apply_batch` registros) saem numa chamada só,
+    para quem aplica gravar tudo numa escrita.
+
+    Com `sync_source`/`sync_apply` o fluxo também faz a anti-entropia:
+    `sync_source()` devolve a lista (MessagePack) que este servidor
+    entrega a quem pede e `sync_apply(items)` junta uma página recebida,
+    na thread de replicação. O pedido se repete a cada `tip_interval`
+    até a primeira resposta completa, no máximo `sync_tries` vezes (o
+    primeiro servidor do cluster não tem a quem perguntar).
+    """
+
+    def __init__(self, ctx, name: str, xsub: str, xpub: str, apply,
+                 batch_max: int = 256, flush_ms: float = 2.0, retain: int = 100000,
+                 reorder_max: int = 10000, repair_max: int = 1000,
+                 repair_interval_ms: float = 200.0, tip_interval_ms: float = 1000.0,
+                 sndhwm: int = 10000, rcvhwm: int = 10000, apply_queue: int = 1024,
+                 apply_batch: int = 4096, sync_source=None, sync_apply=None,
+                 sync_page: int = 1000, sync_tries: int = 10,
+                 log=print, debug=None):
+        self.ctx = ctx
+        self.name = name
+        self.xsub = xsub
+        self.xpub = xpub
+        self.apply = apply
+        self.batch_max = max(1, int(batch_max))
+        self.flush_s = max(0.0, flush_ms / 1000.0)
+        self.reorder_max = int(reorder_max)
+        self.repair_max = max(1, int(repair_max))
+        self.repair_interval = repair_interval_ms / 1000.0
+        self.tip_interval = tip_interval_ms / 1000.0
+        self.apply_batch = max(1, int(apply_batch))
+        self.sndhwm = int(sndhwm)
+        self.rcvhwm = int(rcvhwm)
+        self.sync_source = sync_source
+        self.sync_apply = sync_apply
+        self.sync_page = max(1, int(sync_page))
+        self.sync_tries = int(sync_tries) if sync_apply is not None else 0
+        self.log = log
+        self.debug = debug       # uma linha por lote aplicado (None = nada)
+
+        self._lag_ms = metrics.histogram("replica_lag_ms")
+        self._sent = metrics.counter("replica_records_sent_total")
+        self._repairs = metrics.counter("replica_repairs_requested_total")
+        self._lost = metrics.counter("replica_records_lost_total")
+        self._apply_dropped = metrics.counter("replica_apply_dropped_total")
+        metrics.gauge("replica_reorder_pending",
+                      fn=lambda: sum(len(st.pending) for st in list(self.origins.values())))
+
+        self.epoch = int(time.time() * 1000)
+        self.seq = 0             # última sequência local atribuída
+        self.ring = _Ring(retain)
+        self.origins = {}        # estado de recebimento (thread de replicação)
+        self.applied = {}        # origem -> {epoch, next} do que já foi aplicado
+        # segurado enquanto um lote remoto é aplicado: quem tira snapshot
+        # vê offsets coerentes com o que já foi enviado ao store
+        self.lock = threading.Lock()
+        self._applyq = queue.Queue(max(1, int(apply_queue)))
+        metrics.gauge("replica_apply_queue", fn=self._applyq.qsize)
+
+        self._inbox_addr = f"inproc://replica-out-{id(self)}"
+        self._local = threading.local()
+        self._ready = threading.Event()
+        self._thread = None
+
+    # ---------------------------
+    # API (qualquer thread)
+    # ---------------------------
+
+    def start(self) -> "ReplicaStream":
+        self._thread = threading.Thread(target=self._run, name="replica", daemon=True)
+        self._thread.start()
+        threading.Thread(target=self._apply_loop, name="replica-apply", daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def offsets(self) -> dict:
+        """Próxima sequência a aplicar de cada origem (chamar com `lock`)."""
+        return {o: dict(off) for o, off in self.applied.items()}
+
+    def restore(self, offsets: dict) -> None:
+        """Retoma os offsets de um snapshot (antes de start())."""
+        for origin, off in (offsets or {}).items():
+            st = self.origins[origin] = _OriginState(int(off["epoch"]))
+            st.next = int(off["next"])
+            self.applied[origin] = {"epoch": st.epoch, "next": st.next}
+
+    def send(self, raw: bytes) -> None:
+        """Enfileira um registro local (bytes MessagePack) para replicação."""
+        push = getattr(self._local, "push", None)
+        if push is None:
+            push = self._local.push = self.ctx.socket(zmq.PUSH)
+            push.connect(self._inbox_addr)
+        push.send(raw, copy=False)
+
+    def send_many(self, raws: list) -> None:
+        """Enfileira vários registros juntos: saem no mesmo lote de réplica."""
+        push = getattr(self._local, "push", None)
+        if push is None:
+            push = self._local.push = self.ctx.socket(zmq.PUSH)
+            push.connect(self._inbox_addr)
+        push.send_multipart(raws, copy=False)
+
+    # ---------------------------
+    # Envio
+    # ---------------------------
+
+    def _header(self, first: int, count: int, **extra) -> bytes:
+        head = {"origin": self.name, "epoch": self.epoch, "first": first, "count": count,
+                "sent": time.time()}
+        head.update(extra)
+        return msgpack.packb(head, use_bin_type=True)
+
+    def _flush(self, pub, batch: list) -> None:
+        first = self.seq + 1
+        for raw in batch:
+            self.seq += 1
+            self.ring.put(self.seq, raw)
+        self._sent.inc(len(batch))
+        pub.send_multipart([TOPIC, self._header(first, len(batch))] + batch, copy=False)
+
+    def _send_tip(self, pub) -> None:
+        pub.send_multipart([TOPIC, self._header(self.seq + 1, 0)])
+
+    def _serve_repair(self, pub, req: dict) -> None:
+        if req.get("epoch") != self.epoch:
+            return
+        first = max(1, int(req.get("first", 1)))
+        last = min(int(req.get("last", 0)), self.seq, first + self.repair_max - 1)
+        if last < first:
+            return
+
+        # registros mais antigos que o buffer circular não podem mais ser
+        # reenviados: o lote começa no primeiro disponível e o receptor pula
+        records = []
+        start = first
+        for seq in range(first, last + 1):
+            raw = self.ring.get(seq)
+            if raw is None:
+                records = []
+                start = seq + 1
+                continue
+            records.append(raw)
+        if records:
+            extra = {"repair": True}
+            if start > first:
+                extra["lost_before"] = start
+            pub.send_multipart(
+                [TOPIC, self._header(start, len(records), **extra)] + records, copy=False,
+            )
+        elif start > first:
+            # nada disponível no intervalo: avisa para o receptor seguir adiante
+            pub.send_multipart([TOPIC, self._header(last + 1, 0, lost_before=last + 1)])
+
+    def _serve_sync(self, pub, req: dict) -> None:
+        requester = req.get("from")
+        if not isinstance(requester, str) or requester == self.name:
+            return
+        items = list(self.sync_source())
+        topic = (SYNC_PREFIX + requester).encode("utf-8")
+        for start in range(0, max(1, len(items)), self.sync_page):
+            page = items[start:start + self.sync_page]
+            last = start + self.sync_page >= len(items)
+            pub.send_multipart([topic, msgpack.packb(
+                {"origin": self.name, "items": page, "last": last}, use_bin_type=True)])
+
+    def _request_sync(self, pub) -> None:
+        self.sync_tries -= 1
+        pub.send_multipart([SYNC_TOPIC, msgpack.packb({"from": self.name}, use_bin_type=True)])
+        if self.sync_tries == 0:
+            self.log("nenhum servidor respondeu à sincronização do estado; seguindo só com a réplica")
+
+    def _on_sync(self, reply: dict) -> None:
+        items = reply.get("items") or []
+        if items:
+            self.sync_apply(items)
+        if reply.get("last") and self.sync_tries > 0:
+            # uma resposta completa basta; as de outros pares só repetem
+            self.sync_tries = 0
+            self.log(f"estado sincronizado a partir de {reply.get('origin')}")
+
+    # ---------------------------
+    # Recebimento
+    # ---------------------------
+
+    def _request_repair(self, pub, origin: str, st: _OriginState, last: int) -> None:
+        now = time.monotonic()
+        if now - st.last_repair < self.repair_interval:
+            return
+        st.last_repair = now
+        self._repairs.inc()
+        req = {"from": self.name, "epoch": st.epoch, "first": st.next, "last": last}
+        pub.send_multipart([
+            (REPAIR_PREFIX + origin).encode("utf-8"),
+            msgpack.packb(req, use_bin_type=True),
+        ])
+
+    def _drain_pending(self, st: _OriginState, ready: list) -> None:
+        while st.next in st.pending:
+            ready.append(st.pending.pop(st.next))
+            st.next += 1
+
+    def _on_batch(self, pub, head: dict, records: list) -> int:
+        origin = head.get("origin")
+        if origin == self.name:
+            return 0  # não replica o que foi originado por esse mesmo servidor
+
+        epoch = int(head.get("epoch", 0))
+        st = self.origins.get(origin)
+        if st is None or epoch > st.epoch:
+            st = self.origins[origin] = _OriginState(epoch)
+        elif epoch < st.epoch:
+            return 0  # lote de uma encarnação antiga da origem
+
+        lost_before = head.get("lost_before")
+        if lost_before and lost_before > st.next:
+            self.log(f"registros {st.next}..{lost_before - 1} de {origin} "
+                     f"não estão mais disponíveis na origem")
+            self._lost.inc(lost_before - st.next)
+            st.next = lost_before
+            for seq in [s for s in st.pending if s < st.next]:
+                del st.pending[seq]
+
+        if records and not head.get("repair") and head.get("sent"):
+            self._lag_ms.observe(max(0.0, time.time() - head["sent"]) * 1000.0)
+
+        if records and self._applyq.full():
+            # aplicação atrasada: descarta o lote inteiro sem mexer no estado;
+            # a lacuna aparece no próximo lote (ou tip) e o reparo o traz
+            self._apply_dropped.inc(len(records))
+            return 0
+
+        ready = []
+        seq = int(head.get("first", 1))
+        for raw in records:
+            if seq == st.next:
+                ready.append(raw)
+                st.next += 1
+            elif seq > st.next and len(st.pending) < self.reorder_max:
+                st.pending[seq] = raw
+            seq += 1
+
+        self._drain_pending(st, ready)
+        applied = len(ready)
+        if applied:
+            # só esta thread enfileira e a fila não estava cheia: não bloqueia
+            self._applyq.put((origin, st.epoch, st.next, ready))
+        if head.get("repair") and applied:
+            # resposta de reparo com progresso: pode pedir o próximo trecho já
+            st.last_repair = 0.0
+
+        # lacuna: algo entre st.next e o fim deste lote não chegou
+        tip = seq - 1
+        if st.pending:
+            tip = max(tip, max(st.pending))
+        if tip >= st.next:
+            self._request_repair(pub, origin, st, tip)
+        return applied
+
+    def _check_gaps(self, pub) -> None:
+        """Repete pedidos de reparo pendentes (o pedido ou a resposta podem se perder)."""
+        for origin, st in self.origins.items():
+            if st.pending:
+                self._request_repair(pub, origin, st, max(st.pending))
+
+    # ---------------------------
+    # Thread
+    # ---------------------------
+
+    def _apply_loop(self) -> None:
+        """Thread de aplicação: junta os lotes que esperam na fila e aplica de uma vez."""
+        while True:
+            items = [self._applyq.get()]
+            n = len(items[0][3])
+            while n < self.apply_batch:
+                try:
+                    item = self._applyq.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                n += len(item[3])
+
+            decoded = []
+            totals = {}
+            for origin, _, _, records in items:
+                for raw in records:
+                    try:
+                        decoded.append((msgpack.unpackb(raw, raw=False), raw))
+                    except Exception:
+                        continue
+                totals[origin] = totals.get(origin, 0) + len(records)
+
+            with self.lock:
+                self.apply(decoded)
+                for origin, epoch, next_seq, _ in items:
+                    self.applied[origin] = {"epoch": epoch, "next": next_seq}
+            if self.debug is not None:
+                for origin, count in totals.items():
+                    self.debug(f"replicou {count} registro(s) de {origin}")
+
+    def _run(self) -> None:
+        inbox = self.ctx.socket(zmq.PULL)
+        inbox.bind(self._inbox_addr)
+
+        # descarte na origem (fila para o proxy cheia) é contado; os
+        # receptores percebem a lacuna e pedem reparo
+        pub = Publisher(self.ctx.socket(zmq.PUB), "replica", self.sndhwm, log=self.log)
+        pub.sock.connect(self.xsub)
+
+        sub = self.ctx.socket(zmq.SUB)
+        sub.setsockopt(zmq.RCVHWM, self.rcvhwm)
+        sub.connect(self.xpub)                       # XPUB do proxy
+        sub.setsockopt(zmq.SUBSCRIBE, TOPIC)
+        repair_topic = (REPAIR_PREFIX + self.name).encode("utf-8")
+        sub.setsockopt(zmq.SUBSCRIBE, repair_topic)
+        sync_topic = (SYNC_PREFIX + self.name).encode("utf-8")
+        if self.sync_source is not None:
+            sub.setsockopt(zmq.SUBSCRIBE, SYNC_TOPIC)
+        if self.sync_apply is not None:
+            sub.setsockopt(zmq.SUBSCRIBE, sync_topic)
+
+        poller = zmq.Poller()
+        poller.register(inbox, zmq.POLLIN)
+        poller.register(sub, zmq.POLLIN)
+
+        self._ready.set()
+        self.log("ouvindo réplicas no tópico 'replica'...")
+
+        batch = []
+        deadline = None
+        last_sent = time.monotonic()
+
+        while True:
+            now = time.monotonic()
+            if batch:
+                timeout = max(0.0, deadline - now)
+            else:
+                timeout = max(0.0, last_sent + self.tip_interval - now)
+            events = dict(poller.poll(math.ceil(timeout * 1000)))
+
+            if events.get(inbox) == zmq.POLLIN:
+                while len(batch) < self.batch_max:
+                    try:
+                        raws = inbox.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    if not batch:
+                        deadline = time.monotonic() + self.flush_s
+                    batch.extend(raws)
+
+            now = time.monotonic()
+            if batch and (len(batch) >= self.batch_max or now >= deadline):
+                self._flush(pub, batch)
+                batch = []
+                last_sent = now
+            elif not batch and now - last_sent >= self.tip_interval:
+                self._send_tip(pub)
+                self._check_gaps(pub)
+                if self.sync_tries > 0:
+                    self._request_sync(pub)
+                last_sent = now
+            pub.tick()
+
+            if events.get(sub) == zmq.POLLIN:
+                while True:
+                    try:
+                        frames = sub.recv_multipart(zmq.NOBLOCK)
+                    except zmq.Again:
+                        break
+                    topic = frames[0]
+                    if topic == repair_topic and len(frames) > 1:
+                        try:
+                            self._serve_repair(pub, msgpack.unpackb(frames[1], raw=False))
+                        except Exception:
+                            pass
+                        continue
+                    if (topic == SYNC_TOPIC or topic == sync_topic) and len(frames) > 1:
+                        try:
+                            body = msgpack.unpackb(frames[1], raw=False)
+                            if topic == SYNC_TOPIC:
+                                if self.sync_source is not None:
+                                    self._serve_sync(pub, body)
+                            elif self.sync_apply is not None:
+                                self._on_sync(body)
+                        except Exception:
+                            pass
+                        continue
+                    if topic != TOPIC or len(frames) < 2:
+                        continue
+                    try:
+                        head = msgpack.unpackb(frames[1], raw=False)
+                    except Exception:
+                        continue
+                    self._on_batch(pub, head, frames[2:])
@@ -0,0 +1,205 @@
+"""
+Retenção, arquivamento e limite de disco dos stores segmentados.
+
+Uma thread de baixa prioridade passa pelos stores a cada `interval_s`:
+
+  1. retenção por chave (canal ou destinatário): tempo (`seconds`) e
+     tamanho (`max_bytes`), com exceções por canal. Os segmentos mais
+     novos de cada chave ficam; os de antes do corte somem das leituras
+     dessa chave na hora (SegmentStore.set_floors);
+  2. compactação: um segmento selado em que todas as chaves passaram da
+     retenção é apagado. O corte é por segmento (um segmento nunca é
+     reescrito, para não invalidar cursores e índices), então a
+     retenção vale com a granularidade de SEGMENT_BYTES/SEGMENT_SECONDS;
+  3. arquivamento: segmentos selados há mais de `archive_after_s` vão
+     comprimidos para archive/ (zstd/lz4/zlib, ver archive.py), com o
+     índice ainda em memória e no .idx;
+  4. teto de disco (`store_max_bytes`): passando dele, os segmentos
+     selados mais antigos são apagados, seja qual for a retenção.
+
+O I/O da thread (leitura para comprimir) passa por um limite de
+`io_rate` bytes/s, para o arquivamento não competir com o group commit
+no disco; o lock do store só é tomado para trocar a lista de segmentos.
+Arquivos em archive/ não mudam depois de gravados: um backup incremental
+copia só os novos.
+
+Exceções por canal: "general=3600:0,logs=0:10485760" (segundos:bytes,
+0 = sem limite).
+"""
+import threading
+import time
+
+import archive
+import metrics
+
+
+def parse_overrides(spec: str) -> dict:
+    """"canal=segundos:bytes,..." -> {canal: (segundos, bytes)}."""
+    out = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        key, _, limits = item.partition("=")
+        seconds, _, max_bytes = limits.partition(":")
+        out[key.strip()] = (float(seconds or 0), int(max_bytes or 0))
+    return out
+
+
+class RetentionPolicy:
+    def __init__(self, seconds: float = 0.0, max_bytes: int = 0, overrides: dict = None):
+        self.seconds = float(seconds)
+        self.max_bytes = int(max_bytes)
+        self.overrides = dict(overrides or {})
+
+    def limits(self, key: str) -> tuple:
+        """(segundos, bytes) da chave; 0 = sem limite."""
+        return self.overrides.get(key, (self.seconds, self.max_bytes))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.seconds or self.max_bytes or self.overrides)
+
+
+class Throttle:
+    """Balde de tokens em bytes/s: throttle(n) dorme o necessário (rate 0 = sem limite)."""
+
+    def __init__(self, rate: float):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._last = time.monotonic()
+
+    def __call__(self, n: int) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - n
+        self._last = now
+        if self._tokens < 0:
+            time.sleep(-self._tokens / self.rate)
+
+
+def floors(usage: list, policy: RetentionPolicy, now: float) -> dict:
+    """
+    Para cada chave, o menor seq dentro da retenção (só as chaves que
+    perderam algum segmento). `usage` vem de SegmentStore.usage().
+    """
+    out = {}
+    kept = {}                    # chave -> bytes dos segmentos mais novos
+    for seg, sealed_at, keys in reversed(usage):
+        for key, nbytes in keys.items():
+            if key in out:
+                continue
+            seconds, max_bytes = policy.limits(key)
+            total = kept.get(key, 0) + nbytes
+            too_old = sealed_at is not None and seconds and now - sealed_at > seconds
+            too_big = max_bytes and total > max_bytes and key in kept
+            if too_old or too_big:
+                out[key] = seg.seq + 1
+            else:
+                kept[key] = total
+    return out
+
+
+class RetentionEngine:
+    def __init__(self, stores: dict, policy: RetentionPolicy, archive_after_s: float = 0.0,
+                 codec: str = "auto", io_rate: float = 8 * 1024 * 1024,
+                 store_max_bytes: int = 0, interval_s: float = 60.0,
+                 log=lambda msg, level="info": print(msg)):
+        self.stores = stores                 # nome -> SegmentStore
+        self.policy = policy
+        self.archive_after = float(archive_after_s)
+        self.codec = archive.pick(codec)
+        self.throttle = Throttle(io_rate)
+        self.store_max_bytes = int(store_max_bytes)
+        self.interval = float(interval_s)
+        self.log = log
+
+        for name, store in stores.items():
+            for tier in ("hot", "archive"):
+                metrics.gauge("store_bytes", fn=lambda s=store, t=tier: s.disk_usage()[t],
+                              store=name, tier=tier)
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy.enabled or self.archive_after > 0 or self.store_max_bytes > 0
+
+    def start(self) -> "RetentionEngine":
+        threading.Thread(target=self._run, name="retention", daemon=True).start()
+        return self
+
+    def run_once(self, now: float = None) -> dict:
+        """Uma passada em todos os stores; devolve o que foi feito."""
+        now = time.time() if now is None else now
+        done = {"dropped": 0, "dropped_bytes": 0, "archived": 0, "archived_bytes": 0}
+        for name, store in self.stores.items():
+            self._retain(name, store, now, done)
+            self._archive(name, store, now, done)
+            self._cap(name, store, done)
+        return done
+
+    def _drop(self, name: str, store, seg, reason: str, done: dict):
+        """Apaga o segmento; devolve os bytes liberados (None se não apagou)."""
+        freed = store.drop(seg)
+        if freed is not None:
+            done["dropped"] += 1
+            done["dropped_bytes"] += freed
+            metrics.counter("retention_dropped_bytes_total", store=name, reason=reason).inc(freed)
+        return freed
+
+    def _retain(self, name: str, store, now: float, done: dict) -> None:
+        if not self.policy.enabled:
+            return
+        usage = store.usage()
+        cut = floors(usage, self.policy, now)
+        store.set_floors(cut)
+        for seg, sealed_at, keys in usage[:-1]:
+            # só as chaves deste segmento contam: todas fora da retenção
+            if all(cut.get(key, 0) > seg.seq for key in keys):
+                self._drop(name, store, seg, "retention", done)
+
+    def _archive(self, name: str, store, now: float, done: dict) -> None:
+        if self.archive_after <= 0:
+            return
+        for seg, sealed_at, _ in store.usage()[:-1]:
+            if seg.archived or sealed_at is None or now - sealed_at < self.archive_after:
+                continue
+            t0 = time.perf_counter()
+            size = store.archive(seg, self.codec, self.throttle)
+            done["archived"] += 1
+            done["archived_bytes"] += size
+            metrics.counter("retention_archived_bytes_total", store=name).inc(seg.size)
+            self.log(f"{name}: segmento {seg.seq} arquivado ({self.codec}) "
+                     f"{seg.size} -> {size} bytes em {time.perf_counter() - t0:.1f}s", "debug")
+
+    def _cap(self, name: str, store, done: dict) -> None:
+        if self.store_max_bytes <= 0:
+            return
+        usage = store.disk_usage()
+        total = usage["hot"] + usage["archive"]
+        for seg, _, _ in store.usage()[:-1]:
+            if total <= self.store_max_bytes:
+                break
+            # só desconta o que saiu de fato: um segmento que o drop não
+            # apagou (já removido, ou virou o ativo) não libera nada
+            freed = self._drop(name, store, seg, "disk_cap", done)
+            if freed is not None:
+                total -= freed
+        # o aviso vale pelo que ficou no disco, não pela conta acima
+        usage = store.disk_usage()
+        total = usage["hot"] + usage["archive"]
+        if total > self.store_max_bytes:
+            left = len(store.usage())
+            hint = "reduza SEGMENT_BYTES" if left == 1 else f"{left} segmento(s) não puderam sair"
+            self.log(f"{name}: {total} bytes em disco acima do teto; {hint}", "warn")
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                done = self.run_once()
+            except Exception as e:
+                self.log(f"falha na retenção: {e}", "warn")
+                continue
+            if done["dropped"] or done["archived"]:
+                self.log(f"retenção: {done['dropped']} segmento(s) apagado(s) "
+                         f"({done['dropped_bytes']} bytes), {done['archived']} arquivado(s)")
@@ -0,0 +1,124 @@
+"""
+Snapshots compactos do estado do servidor para partida rápida.
+
+Um snapshot guarda, em MessagePack:
+  - o relógio lógico (o registro de usuários tem journal próprio);
+  - clock máximo por canal (high-water);
+  - offsets de replicação por origem ({epoch, next});
+  - o checkpoint de cada store (segmento ativo, tamanho e índice).
+
+Na partida o servidor carrega o snapshot, abre os stores a partir dos
+checkpoints e reprocessa só a cauda do log gravada depois dele: o tempo
+de partida depende do tamanho do snapshot e da cauda, não do histórico.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import msgpack
+
+VERSION = 1
+
+
+def save(path: str, state: dict) -> None:
+    """Grava o snapshot de forma atômica (arquivo temporário + rename)."""
+    state = dict(state)
+    state["version"] = VERSION
+    state["created"] = time.time()
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(msgpack.packb(state, use_bin_type=True))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load(path: str):
+    """Carrega o snapshot, ou None se não existir ou for inválido."""
+    try:
+        with open(path, "rb") as f:
+            state = msgpack.unpackb(f.read(), raw=False, strict_map_key=False)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get("version") != VERSION:
+        return None
+    return state
+
+
+def replay_tail(stores: dict, state: dict, me: str, retain: int = None) -> tuple:
+    """
+    Reprocessa a cauda de cada store depois do checkpoint do snapshot.
+
+    Devolve (maior clock visto, high-water por chave das publicações,
+    conjunto (origem, clock) dos registros replicados na cauda). O
+    conjunto serve para descartar os reenvios de réplicas que já estavam
+    gravadas quando o processo caiu.
+
+    Sem checkpoint (queda antes do primeiro snapshot) a cauda é o log
+    inteiro: os offsets de replicação também não foram salvos e as
+    origens reenviam tudo o que ainda têm. Uma origem só reenvia do seu
+    buffer circular, então basta lembrar os últimos `retain` registros
+    de cada uma.
+    """
+    state = state or {}
+    max_clock = int(state.get("clock", 0))
+    high_water = dict(state.get("high_water", {}))
+    recent = {}              # origem -> últimos (clock) replicados vistos
+    checkpoints = state.get("stores", {})
+
+    for name, store in stores.items():
+        cp = checkpoints.get(name) or {"seq": 0, "size": 0}
+        for key, clock, payload in store.replay(cp["seq"], cp["size"]):
+            if clock > max_clock:
+                max_clock = clock
+            if name == "publications" and clock > high_water.get(key, 0):
+                high_water[key] = clock
+            try:
+                origin = msgpack.unpackb(payload, raw=False).get("origin")
+            except Exception:
+                continue
+            if origin and origin != me:
+                clocks = recent.get(origin)
+                if clocks is None:
+                    clocks = recent[origin] = deque(maxlen=retain)
+                clocks.append(clock)
+
+    seen = {(origin, clock) for origin, clocks in recent.items() for clock in clocks}
+    return max_clock, high_water, seen
+
+
+class Snapshotter:
+    """
+    Thread que tira snapshots periódicos. `capture()` devolve o estado
+    (chamado com os locks que o servidor precisar); antes de gravar,
+    espera o LogWriter deixar no disco tudo o que o checkpoint cobre.
+    """
+
+    def __init__(self, path: str, capture, writer, interval_s: float = 30.0, log=print):
+        self.path = path
+        self.capture = capture
+        self.writer = writer
+        self.interval = float(interval_s)
+        self.log = log
+        self._lock = threading.Lock()
+
+    def start(self) -> "Snapshotter":
+        threading.Thread(target=self._run, name="snapshot", daemon=True).start()
+        return self
+
+    def take(self) -> None:
+        with self._lock:
+            t0 = time.perf_counter()
+            state = self.capture()
+            self.writer.flush()
+            save(self.path, state)
+            self.log(f"snapshot gravado em {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.take()
+            except Exception as e:
+                self.log(f"falha ao gravar snapshot: {e}")
@@ -0,0 +1,865 @@
+"""
+Armazenamento segmentado em MessagePack com índice esparso.
+
+Cada registro é gravado como:
+
+    [tamanho do payload: u32][clock: u64][tamanho da chave: u16][chave][payload]
+
+O payload são os bytes MessagePack que já trafegam na rede (sem
+re-codificar). A chave é o canal (publicações) ou o destinatário
+(mensagens diretas). Os segmentos giram por tamanho ou por tempo; cada
+segmento selado ganha um arquivo .idx com o índice esparso, e o
+segmento ativo é reindexado na partida lendo só os cabeçalhos.
+
+Segmentos selados são lidos via mmap: os payloads saem como memoryview
+apontando para o mapeamento e podem ir direto para frames ZeroMQ
+(copy=False), sem decodificar nem copiar. O segmento ativo é lido em
+blocos limitados.
+
+Índice esparso: para cada chave, a cada INDEX_EVERY registros guarda
+(maior clock da chave antes da posição, posição). Como esse máximo só
+cresce, uma busca binária acha um ponto de partida onde todos os
+registros anteriores têm clock <= since, sem varrer o arquivo inteiro.
+
+Retenção (ver retention.py): segmentos selados antigos podem ir para
+archive/ comprimidos (o .idx fica, então continuam consultáveis: são
+descomprimidos inteiros na leitura) e ser apagados quando todas as
+chaves deles passaram da retenção. Um segmento nunca é reescrito por
+dentro: as posições (cursores do replay, índice) continuam valendo. Uma
+chave além da sua retenção some das leituras na hora (piso por chave),
+mesmo que o segmento ainda guarde outras chaves.
+"""
+import bisect
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import msgpack
+
+import archive
+
+HEADER = struct.Struct(">IQH")
+READ_CHUNK = 1 << 20
+UNPACKED_MAX = 2             # segmentos arquivados mantidos descomprimidos
+_ARCHIVED = re.compile(r"^(\d+)\.seg\.(zst|lz4|z)$")
+
+
+def encode_record(key: str, clock: int, payload: bytes) -> bytes:
+    k = key.encode("utf-8")
+    return HEADER.pack(len(payload), int(clock), len(k)) + k + payload
+
+
+class _KeyIndex:
+    """Índice esparso de uma chave dentro de um segmento."""
+
+    __slots__ = ("maxes", "positions", "count", "max_clock", "nbytes")
+
+    def __init__(self):
+        self.maxes = []        # maior clock da chave antes de positions[i]
+        self.positions = []
+        self.count = 0
+        self.max_clock = 0
+        self.nbytes = 0        # bytes dos registros da chave (retenção por tamanho)
+
+    def add(self, clock: int, pos: int, every: int, size: int = 0) -> None:
+        if self.count % every == 0:
+            self.maxes.append(self.max_clock)
+            self.positions.append(pos)
+        self.count += 1
+        self.nbytes += size
+        if clock > self.max_clock:
+            self.max_clock = clock
+
+    def start(self, since: int) -> int:
+        """Posição a partir da qual vale a pena ler registros com clock > since."""
+        i = bisect.bisect_right(self.maxes, since) - 1
+        return self.positions[max(i, 0)]
+
+    def dump(self) -> list:
+        return [self.maxes, self.positions, self.count, self.max_clock, self.nbytes]
+
+    @classmethod
+    def load(cls, raw: list) -> "_KeyIndex":
+        idx = cls()
+        idx.maxes, idx.positions, idx.count, idx.max_clock = raw[:4]
+        idx.nbytes = raw[4] if len(raw) > 4 else -1     # -1: índice antigo, sem bytes
+        return idx
+
+
+class Segment:
+    def __init__(self, directory: str, seq: int):
+        self.seq = seq
+        self.path = os.path.join(directory, f"{seq:08d}.seg")
+        self.idx_path = os.path.join(directory, f"{seq:08d}.idx")
+        self.size = 0
+        self.created = time.time()
+        self.sealed = False
+        self.sealed_at = None    # quando parou de receber gravações
+        self.archived = None     # codec do arquivo em archive/ (None = segmento quente)
+        self.disk_size = 0       # bytes no disco (comprimido, se arquivado)
+        self.keys = {}
+        self.mm = None           # mmap do segmento selado (aberto sob demanda)
+
+    def archive_as(self, codec: str) -> None:
+        """Passa a apontar para o arquivo comprimido em archive/."""
+        directory = os.path.dirname(self.path)
+        self.path = os.path.join(directory, "archive", f"{self.seq:08d}.seg.{codec}")
+        self.archived = codec
+
+    def add(self, key: str, clock: int, pos: int, every: int, size: int = 0) -> None:
+        idx = self.keys.get(key)
+        if idx is None:
+            idx = self.keys[key] = _KeyIndex()
+        idx.add(clock, pos, every, size)
+
+    def save_index(self) -> None:
+        tmp = self.idx_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(msgpack.packb({
+                "size": self.size,
+                "created": self.created,
+                "sealed_at": self.sealed_at,
+                "archived": self.archived,
+                "keys": {k: v.dump() for k, v in self.keys.items()},
+            }, use_bin_type=True))
+        os.replace(tmp, self.idx_path)
+
+    def load_index(self) -> bool:
+        """
+        Carrega o .idx se ele corresponder ao tamanho atual do segmento
+        (arquivado: o tamanho descomprimido vem do próprio .idx).
+        """
+        try:
+            with open(self.idx_path, "rb") as f:
+                raw = msgpack.unpackb(f.read(), raw=False)
+        except (OSError, ValueError):
+            return False
+        if self.archived:
+            self.size = raw.get("size", 0)
+        elif raw.get("size") != self.size:
+            return False
+        self.created = raw.get("created", self.created)
+        self.sealed_at = raw.get("sealed_at") or self.sealed_at
+        self.keys = {k: _KeyIndex.load(v) for k, v in raw["keys"].items()}
+        # índice de antes da retenção: reparte o tamanho pela contagem
+        total = sum(idx.count for idx in self.keys.values()) or 1
+        for idx in self.keys.values():
+            if idx.nbytes < 0:
+                idx.nbytes = self.size * idx.count // total
+        return True
+
+    def rebuild(self, every: int, start: int = 0, buf=None) -> int:
+        """
+        Reconstrói o índice lendo só os cabeçalhos, a partir de `start`
+        (0 = do zero; senão continua um índice já carregado), do arquivo
+        ou de `buf` (segmento arquivado já descomprimido). Devolve o
+        tamanho válido (um registro cortado no fim do arquivo é descartado).
+        """
+        if start == 0:
+            self.keys = {}
+        if buf is not None:
+            self.size = len(buf)
+        pos = start
+        if self.size <= start:
+            return start
+        if buf is not None:
+            for key, clock, _, _, end in iter_records(buf, start, self.size):
+                self.add(key, clock, pos, every, end - pos)
+                pos = end
+            return pos
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for key, clock, _, _, end in iter_records(mm, start, self.size):
+                    self.add(key, clock, pos, every, end - pos)
+                    pos = end
+        return pos
+
+
+def iter_records(buf, start: int, end: int):
+    """
+    Itera (chave, clock, início do payload, fim do payload, fim do registro)
+    sobre os registros completos de buf[start:end].
+    """
+    pos = start
+    hsize = HEADER.size
+    unpack = HEADER.unpack_from
+    keys = {}
+    while pos + hsize <= end:
+        plen, clock, klen = unpack(buf, pos)
+        kstart = pos + hsize
+        pstart = kstart + klen
+        pend = pstart + plen
+        if pend > end:
+            return
+        kraw = buf[kstart:pstart]
+        key = keys.get(kraw)
+        if key is None:
+            key = keys[kraw] = kraw.decode("utf-8")
+        yield key, clock, pstart, pend, pend
+        pos = pend
+
+
+def scan(buf, start: int, end: int, key: bytes, since: int, limit: int, out: list,
+         budget: int = None, clocks: list = None) -> tuple:
+    """
+    Percorre os registros de buf[start:end] e acrescenta em `out`
+    (como memoryview, sem copiar) os payloads da chave com clock > since,
+    até `limit` registros ou `budget` bytes de payload. Se `clocks` for
+    dado, recebe o clock de cada payload acrescentado.
+    Devolve (posição do primeiro registro não lido, bytes acrescentados,
+    se parou por ter atingido o limite ou o orçamento).
+    """
+    view = memoryview(buf)
+    pos = start
+    taken = 0
+    hsize = HEADER.size
+    while pos + hsize <= end:
+        if len(out) >= limit:
+            return pos, taken, True
+        plen, clock, klen = HEADER.unpack_from(view, pos)
+        kstart = pos + hsize
+        pstart = kstart + klen
+        pend = pstart + plen
+        if pend > end:
+            break
+        if clock > since and view[kstart:pstart] == key:
+            if budget is not None and out and taken + plen > budget:
+                return pos, taken, True
+            out.append(view[pstart:pend])
+            if clocks is not None:
+                clocks.append(clock)
+            taken += plen
+        pos = pend
+    return pos, taken, len(out) >= limit
+
+
+class SegmentStore:
+    """
+    Log segmentado de uma família de registros (publicações ou mensagens).
+    As gravações passam pelo LogWriter (group commit); as leituras vão
+    direto aos arquivos, até o tamanho já gravado.
+    """
+
+    def __init__(self, directory: str, writer, segment_bytes: int = 64 * 1024 * 1024,
+                 segment_seconds: float = 3600.0, index_every: int = 64,
+                 checkpoint: dict = None):
+        self.directory = directory
+        self.writer = writer
+        self.segment_bytes = int(segment_bytes)
+        self.segment_seconds = float(segment_seconds)
+        self.index_every = max(1, int(index_every))
+
+        self.archive_dir = os.path.join(directory, "archive")
+
+        self._lock = threading.Lock()
+        self._written = {}       # seq -> bytes já gravados no disco
+        self._failed = set()     # seqs cortados depois de um erro de gravação
+        self._floors = {}        # chave -> menor seq visível (retenção)
+        self._unpacked = OrderedDict()   # seq arquivado -> bytes descomprimidos
+        self.segments = []
+        # chamado sob o lock a cada gravação com [(chave, clock, seq, offset,
+        # payload)], na ordem do log (caixa de entrada, cache de histórico)
+        self.on_append = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._open(checkpoint)
+
+    # ---------------------------
+    # Partida
+    # ---------------------------
+
+    def _open(self, checkpoint: dict = None) -> None:
+        """
+        Abre os segmentos existentes. Selados usam o .idx; o segmento do
+        checkpoint (snapshot) retoma o índice salvo e só lê o que veio depois.
+        """
+        seqs = {
+            int(name[:-4]): None for name in os.listdir(self.directory)
+            if name.endswith(".seg") and name[:-4].isdigit()
+        }
+        if os.path.isdir(self.archive_dir):
+            for name in os.listdir(self.archive_dir):
+                m = _ARCHIVED.match(name)
+                if m is None:
+                    continue
+                if int(m.group(1)) in seqs:
+                    # queda no meio do arquivamento: a cópia quente vale
+                    os.remove(os.path.join(self.archive_dir, name))
+                else:
+                    seqs[int(m.group(1))] = m.group(2)
+
+        for seq in sorted(seqs):
+            seg = Segment(self.directory, seq)
+            if seqs[seq] is not None:
+                seg.archive_as(seqs[seq])
+                seg.disk_size = os.path.getsize(seg.path)
+                if not seg.load_index():
+                    with open(seg.path, "rb") as f:
+                        seg.rebuild(self.index_every, 0, archive.decompress(seg.archived, f.read()))
+                    seg.save_index()
+                seg.sealed = True
+                self.segments.append(seg)
+                self._written[seq] = seg.size
+                continue
+
+            seg.size = os.path.getsize(seg.path)
+            seg.created = os.path.getmtime(seg.path)
+            if not seg.load_index():
+                start = 0
+                if checkpoint and checkpoint.get("seq") == seq and checkpoint["size"] <= seg.size:
+                    seg.keys = {k: _KeyIndex.load(v) for k, v in checkpoint["keys"].items()}
+                    start = checkpoint["size"]
+                valid = seg.rebuild(self.index_every, start)
+                if valid != seg.size:
+                    # registro incompleto no fim (queda no meio de uma gravação)
+                    with open(seg.path, "r+b") as f:
+                        f.truncate(valid)
+                    seg.size = valid
+            seg.sealed = True
+            seg.sealed_at = seg.sealed_at or os.path.getmtime(seg.path)
+            seg.disk_size = seg.size
+            self.segments.append(seg)
+            self._written[seq] = seg.size
+
+        if self.segments and not self.segments[-1].archived:
+            # o último segmento volta a ser o ativo
+            last = self.segments[-1]
+            last.sealed = False
+            last.sealed_at = None
+            if os.path.exists(last.idx_path):
+                os.remove(last.idx_path)
+        else:
+            self._new_segment(self.segments[-1].seq + 1 if self.segments else 0)
+
+    def checkpoint(self) -> dict:
+        """
+        Posição atual do log (segmento ativo e tamanho) com o índice do
+        segmento ativo, para o snapshot. Segmentos selados já têm .idx.
+        """
+        with self._lock:
+            active = self.segments[-1]
+            return {
+                "seq": active.seq,
+                "size": active.size,
+                "keys": {k: v.dump() for k, v in active.keys.items()},
+            }
+
+    def replay(self, seq: int, size: int):
+        """
+        Itera (chave, clock, payload) dos registros gravados depois da
+        posição (seq, size) — a cauda do log desde um checkpoint.
+        """
+        with self._lock:
+            plan = [(s, self._written.get(s.seq, 0)) for s in self.segments if s.seq >= seq]
+        for seg, end in plan:
+            start = size if seg.seq == seq else 0
+            if end <= start:
+                continue
+            if seg.archived:
+                buf = self._unpack(seg)
+                for key, clock, pstart, pend, _ in iter_records(buf, start, end):
+                    yield key, clock, buf[pstart:pend]
+                continue
+            with open(seg.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for key, clock, pstart, pend, _ in iter_records(mm, start, end):
+                        yield key, clock, mm[pstart:pend]
+
+    def locations(self, seq: int = 0, pos: int = 0):
+        """
+        Itera (chave, clock, seq, offset) dos registros gravados a partir
+        da posição (seq, pos), lendo só os cabeçalhos.
+        """
+        with self._lock:
+            plan = [(s, self._written.get(s.seq, 0)) for s in self.segments if s.seq >= seq]
+        for seg, end in plan:
+            start = pos if seg.seq == seq else 0
+            if end <= start:
+                continue
+            if seg.archived:
+                for key, clock, _, _, rend in iter_records(self._unpack(seg), start, end):
+                    yield key, clock, seg.seq, start
+                    start = rend
+                continue
+            with open(seg.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for key, clock, _, _, rend in iter_records(mm, start, end):
+                        yield key, clock, seg.seq, start
+                        start = rend
+
+    def _new_segment(self, seq: int) -> Segment:
+        seg = Segment(self.directory, seq)
+        open(seg.path, "ab").close()
+        self.segments.append(seg)
+        self._written[seq] = 0
+        return seg
+
+    # ---------------------------
+    # Escrita
+    # ---------------------------
+
+    def _roll(self) -> Segment:
+        active = self.segments[-1]
+        active.sealed = True
+        active.sealed_at = time.time()
+        active.disk_size = active.size
+        active.save_index()
+        self.writer.release(active.path)
+        return self._new_segment(active.seq + 1)
+
+    def append(self, key: str, clock: int, payload: bytes, result=None):
+        """
+        Grava um payload MessagePack já codificado. Devolve o Future do
+        LogWriter, resolvido com `result` quando o lote estiver gravado.
+        """
+        record = encode_record(key, clock, payload)
+        with self._lock:
+            active = self.segments[-1]
+            if active.size > 0 and (
+                active.size + len(record) > self.segment_bytes
+                or time.time() - active.created > self.segment_seconds
+            ):
+                active = self._roll()
+            pos = active.size
+            active.size += len(record)
+            active.add(key, int(clock), pos, self.index_every, len(record))
+            fut = self.writer.append_raw(active.path, record, result)
+            if self.on_append is not None:
+                self.on_append([(key, int(clock), active.seq, pos, payload)])
+
+        fut.add_done_callback(self._on_written(active.seq, pos + len(record)))
+        return fut
+
+    def append_many(self, records: list, result=None):
+        """
+        Grava vários (key, clock, payload) numa única escrita, todos no
+        mesmo segmento. Devolve um Future só, resolvido com `result`.
+        """
+        encoded = [(key, int(clock), encode_record(key, clock, payload), payload)
+                   for key, clock, payload in records]
+        total = sum(len(rec) for _, _, rec, _ in encoded)
+        with self._lock:
+            active = self.segments[-1]
+            if active.size > 0 and (
+                active.size + total > self.segment_bytes
+                or time.time() - active.created > self.segment_seconds
+            ):
+                active = self._roll()
+            located = []
+            for key, clock, rec, payload in encoded:
+                active.add(key, clock, active.size, self.index_every, len(rec))
+                located.append((key, clock, active.seq, active.size, payload))
+                active.size += len(rec)
+            end = active.size
+            fut = self.writer.append_raw(active.path, b"".join(rec for _, _, rec, _ in encoded), result)
+            if self.on_append is not None:
+                self.on_append(located)
+
+        fut.add_done_callback(self._on_written(active.seq, end))
+        return fut
+
+    def _on_written(self, seq: int, end: int):
+        def done(fut):
+            if fut.exception() is None:
+                self._mark_written(seq, end)
+            else:
+                self._write_failed(seq)
+        return done
+
+    def _mark_written(self, seq: int, end: int) -> None:
+        if end > self._written.get(seq, 0) and seq not in self._failed:
+            self._written[seq] = end
+
+    def _write_failed(self, seq: int) -> None:
+        """
+        Um lote do segmento não foi gravado (erro de I/O). As posições já
+        reservadas depois do que estava no disco não valem mais: o segmento
+        é cortado no último lote gravado, o índice é refeito até ali e, se
+        era o ativo, ele é selado e as próximas gravações vão para um novo.
+        Os lotes seguintes já enfileirados para ele não passam desse corte.
+        """
+        with self._lock:
+            seg = next((s for s in self.segments if s.seq == seq), None)
+            if seg is None or seq in self._failed or seg.archived:
+                return
+            self._failed.add(seq)
+            good = self._written.get(seq, 0)
+            try:
+                with open(seg.path, "r+b") as f:
+                    f.truncate(good)
+            except OSError:
+                pass
+            seg.size = seg.disk_size = good
+            seg.rebuild(self.index_every)
+            if seg is self.segments[-1]:
+                self._roll()
+            else:
+                seg.save_index()
+
+    # ---------------------------
+    # Leitura
+    # ---------------------------
+
+    def high_water(self, key: str) -> int:
+        """Maior clock gravado para a chave."""
+        with self._lock:
+            best = 0
+            for seg in self.segments:
+                idx = seg.keys.get(key)
+                if idx is not None and idx.max_clock > best:
+                    best = idx.max_clock
+            return best
+
+    def _plan(self, key: str, since: int, start: tuple = None) -> tuple:
+        """
+        Segmentos com registros da chave acima de `since` e onde começar
+        (a partir da posição `start` = (segmento, offset), se dada), e o
+        fim do log no momento do plano.
+        """
+        plan = []
+        floor = self._floors.get(key, 0)
+        with self._lock:
+            for seg in self.segments:
+                if seg.seq < floor or (start is not None and seg.seq < start[0]):
+                    continue
+                idx = seg.keys.get(key)
+                if idx is None or idx.max_clock <= since:
+                    continue
+                pos = idx.start(since)
+                if start is not None and seg.seq == start[0]:
+                    pos = max(pos, start[1])
+                plan.append((seg, pos, self._written.get(seg.seq, 0)))
+            last = self.segments[-1]
+            tail = (last.seq, self._written.get(last.seq, 0))
+        return plan, tail
+
+    def _map(self, seg: Segment, end: int):
+        """
+        mmap de um segmento selado e totalmente gravado (ou None); de um
+        arquivado, os bytes descomprimidos.
+        """
+        if seg.archived:
+            return self._unpack(seg)
+        if not seg.sealed or end != seg.size or seg.size == 0:
+            return None
+        with self._lock:
+            if seg.mm is None:
+                with open(seg.path, "rb") as f:
+                    seg.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(seg.mm, "madvise"):
+                    # leitura sequencial: o kernel pode descartar as páginas
+                    # lidas sem empurrar o working set quente para fora
+                    seg.mm.madvise(mmap.MADV_SEQUENTIAL)
+            return seg.mm
+
+    def read_views(self, key: str, since: int = 0, limit: int = 100,
+                   max_bytes: int = None, clocks: list = None) -> list:
+        """
+        Devolve até `limit` payloads MessagePack da chave com clock > since,
+        na ordem do log, como memoryviews (de segmentos mapeados ou de
+        blocos lidos do segmento ativo), limitados a `max_bytes` no total.
+        Se `clocks` for dado, recebe o clock de cada payload.
+        """
+        return self.read_range(key, since, None, limit, max_bytes, clocks)[0]
+
+    def read_range(self, key: str, since: int = 0, start: tuple = None, limit: int = 100,
+                   max_bytes: int = None, clocks: list = None, ends: dict = None) -> tuple:
+        """
+        Como read_views, mas a partir da posição `start` = (segmento,
+        offset) do log. Devolve (payloads, posição onde a leitura parou,
+        se parou antes do fim do log): passar essa posição de volta continua
+        exatamente dali, sem pular registros de clock menor gravados depois
+        (réplicas atrasadas). Se `ends` for dado, recebe {seq: fim lido}
+        de cada segmento do plano.
+        """
+        out = []
+        budget = max_bytes
+        kbytes = key.encode("utf-8")
+        plan, stop = self._plan(key, since, start)
+        if ends is not None:
+            ends.update((seg.seq, end) for seg, _, end in plan)
+        full = False
+        for seg, pos, end in plan:
+            try:
+                mm = self._map(seg, end)
+            except FileNotFoundError:
+                continue    # apagado pela retenção depois do plano
+            if mm is not None:
+                pos, taken, full = scan(mm, pos, end, kbytes, since, limit, out, budget, clocks)
+                if budget is not None:
+                    budget -= taken
+                if full:
+                    stop = (seg.seq, pos)
+                    break
+                continue
+
+            full = False
+            with open(seg.path, "rb") as f:
+                # lê em blocos para não carregar o segmento inteiro
+                chunk = READ_CHUNK
+                while pos < end:
+                    f.seek(pos)
+                    buf = f.read(min(chunk, end - pos))
+                    used, taken, full = scan(buf, 0, len(buf), kbytes, since, limit, out, budget, clocks)
+                    if budget is not None:
+                        budget -= taken
+                    if full:
+                        pos += used
+                        break
+                    if used == 0:
+                        if len(buf) >= end - pos:
+                            break   # registro corrompido
+                        # registro maior que o bloco
+                        chunk *= 2
+                        continue
+                    pos += used
+            if full:
+                stop = (seg.seq, pos)
+                break
+        return out, stop, full
+
+    def tail(self, key: str, n: int, clocks: list = None) -> tuple:
+        """
+        Os últimos `n` payloads da chave, na ordem do log. Devolve
+        (payloads, maior clock da chave fora da resposta, {seq: até onde o
+        segmento foi lido}): um registro gravado depois, ou num segmento
+        fora do mapa, não está na resposta.
+        """
+        floor = self._floors.get(key, 0)
+        start, count, skipped = None, 0, 0
+        with self._lock:
+            for seg in reversed(self.segments):
+                idx = seg.keys.get(key)
+                if idx is None or seg.seq < floor:
+                    continue
+                if count >= n:
+                    skipped = max(skipped, idx.max_clock)
+                    continue
+                # entrada do índice esparso logo antes do n-ésimo registro do fim
+                first = max(0, (idx.count - (n - count)) // self.index_every)
+                start = (seg.seq, idx.positions[first])
+                count += idx.count - first * self.index_every
+                if first:
+                    skipped = max(skipped, idx.maxes[first])
+        ends = {}
+        if start is None:
+            return [], 0, ends
+        found = []
+        views, _, _ = self.read_range(key, -1, start, 1 << 62, None, found, ends)
+        cut = len(views) - n
+        if cut > 0:
+            skipped = max([skipped] + found[:cut])
+            views, found = views[cut:], found[cut:]
+        if clocks is not None:
+            clocks.extend(found)
+        return views, skipped, ends
+
+    def read_at(self, key: str, locations: list, max_bytes: int = None,
+                clocks: list = None) -> tuple:
+        """
+        Payloads da chave nas posições `locations` [(seq, offset)] vindas
+        de um índice externo, na ordem dada, sem varrer o log. Devolve
+        (payloads, quantas posições foram consumidas): para antes de uma
+        posição ainda não gravada no disco ou de estourar `max_bytes`.
+        Posições de segmentos apagados (ou abaixo do piso da chave) são
+        puladas e contam como consumidas.
+        """
+        out = []
+        used = taken = 0
+        kbytes = key.encode("utf-8")
+        floor = self._floors.get(key, 0)
+        with self._lock:
+            segs = {s.seq: s for s in self.segments}
+            written = dict(self._written)
+        fds = {}
+        try:
+            for seq, pos in locations:
+                seg, end = segs.get(seq), written.get(seq, 0)
+                if seg is not None and pos >= end:
+                    break               # ainda no group commit
+                record = None
+                if seg is not None and seq >= floor:
+                    try:
+                        record = self._record_at(seg, pos, end, fds)
+                    except FileNotFoundError:
+                        pass            # apagado pela retenção depois da cópia da lista
+                if record is not None and record[0] == kbytes:
+                    _, clock, payload = record
+                    if max_bytes is not None and out and taken + len(payload) > max_bytes:
+                        break
+                    out.append(payload)
+                    taken += len(payload)
+                    if clocks is not None:
+                        clocks.append(clock)
+                used += 1
+        finally:
+            for fd in fds.values():
+                os.close(fd)
+        return out, used
+
+    def _record_at(self, seg: Segment, pos: int, end: int, fds: dict):
+        """(chave, clock, payload) do registro em `pos`, ou None se não couber em `end`."""
+        hsize = HEADER.size
+        mm = self._map(seg, end)
+        if mm is not None:
+            if pos + hsize > end:
+                return None
+            plen, clock, klen = HEADER.unpack_from(mm, pos)
+            pstart = pos + hsize + klen
+            if pstart + plen > end:
+                return None
+            view = memoryview(mm)
+            return bytes(view[pos + hsize:pstart]), clock, view[pstart:pstart + plen]
+        # segmento ativo: leitura pontual, sem mapear o arquivo
+        fd = fds.get(seg.seq)
+        if fd is None:
+            fd = fds[seg.seq] = os.open(seg.path, os.O_RDONLY)
+        head = os.pread(fd, hsize, pos)
+        if len(head) < hsize:
+            return None
+        plen, clock, klen = HEADER.unpack(head)
+        if pos + hsize + klen + plen > end:
+            return None
+        body = os.pread(fd, klen + plen, pos + hsize)
+        return body[:klen], clock, memoryview(body)[klen:]
+
+    def _unpack(self, seg: Segment) -> bytes:
+        """Segmento arquivado descomprimido (os últimos UNPACKED_MAX ficam em cache)."""
+        with self._lock:
+            data = self._unpacked.get(seg.seq)
+            if data is not None:
+                self._unpacked.move_to_end(seg.seq)
+                return data
+        with open(seg.path, "rb") as f:
+            data = archive.decompress(seg.archived, f.read())
+        with self._lock:
+            self._unpacked[seg.seq] = data
+            while len(self._unpacked) > UNPACKED_MAX:
+                self._unpacked.popitem(last=False)
+        return data
+
+    def read(self, key: str, since: int = 0, limit: int = 100) -> list:
+        """Como read_views, mas devolve cópias em bytes."""
+        return [bytes(v) for v in self.read_views(key, since, limit)]
+
+    # ---------------------------
+    # Retenção e arquivamento (chamados pela thread de retenção)
+    # ---------------------------
+
+    def usage(self) -> list:
+        """
+        (segmento, quando foi selado, {chave: bytes}) do mais antigo ao
+        ativo (que vem com selado = None).
+        """
+        with self._lock:
+            segments = list(self.segments)
+            active = {k: v.nbytes for k, v in segments[-1].keys.items()}
+        out = [(seg, seg.sealed_at, {k: v.nbytes for k, v in seg.keys.items()})
+               for seg in segments[:-1]]
+        out.append((segments[-1], None, active))
+        return out
+
+    def disk_usage(self) -> dict:
+        """Bytes no disco por camada: quente (.seg) e arquivada (comprimida)."""
+        with self._lock:
+            hot = sum(s.size for s in self.segments if not s.archived)
+            cold = sum(s.disk_size for s in self.segments if s.archived)
+        return {"hot": hot, "archive": cold}
+
+    def set_floors(self, floors: dict) -> None:
+        """Chave -> menor seq ainda dentro da retenção (os anteriores somem das leituras)."""
+        self._floors = dict(floors)
+
+    def first_seq(self, key: str) -> int:
+        """Menor seq visível para a chave (piso da retenção ou o segmento mais antigo)."""
+        return max(self._floors.get(key, 0), self.segments[0].seq)
+
+    def queued_ends(self) -> dict:
+        """Seq -> fim do que já foi enfileirado, dos segmentos com gravação pendente."""
+        with self._lock:
+            return {s.seq: s.size for s in self.segments if self._written.get(s.seq, 0) < s.size}
+
+    def written_to(self, ends: dict) -> bool:
+        """
+        True se o disco já tem tudo até `ends` (de queued_ends). Segmento
+        que saiu, ou encolheu depois de uma falha, não espera mais nada.
+        """
+        with self._lock:
+            sizes = {s.seq: s.size for s in self.segments}
+            return all(self._written.get(seq, 0) >= end
+                       for seq, end in ends.items() if sizes.get(seq, 0) >= end)
+
+    def _retire(self, seg: Segment) -> None:
+        """
+        Apaga os arquivos de um segmento que já saiu da lista. Leitores que
+        o planejaram antes continuam pelo mmap, aberto antes do unlink.
+        """
+        if not seg.archived:
+            try:
+                self._map(seg, seg.size)
+            except (OSError, ValueError):
+                pass
+        os.remove(seg.path)
+
+    def drop(self, seg: Segment):
+        """Apaga um segmento selado (e o .idx); devolve os bytes liberados (None se não apagou)."""
+        with self._lock:
+            if seg is self.segments[-1] or not any(s is seg for s in self.segments):
+                return None
+            self.segments = [s for s in self.segments if s is not seg]
+            self._written.pop(seg.seq, None)
+            self._unpacked.pop(seg.seq, None)
+        self._retire(seg)
+        try:
+            os.remove(seg.idx_path)
+        except FileNotFoundError:
+            pass
+        return seg.disk_size
+
+    def archive(self, seg: Segment, codec: str, throttle=None) -> int:
+        """
+        Comprime um segmento selado para archive/ e passa a lê-lo de lá.
+        `throttle(n)` é chamado a cada bloco lido (limite de I/O). Devolve
+        o tamanho comprimido.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        cold = Segment(self.directory, seg.seq)
+        cold.size, cold.created, cold.sealed, cold.sealed_at = seg.size, seg.created, True, seg.sealed_at
+        cold.keys = seg.keys
+        cold.archive_as(codec)
+
+        comp = archive.compressor(codec)
+        tmp = cold.path + ".tmp"
+        with open(seg.path, "rb") as src, open(tmp, "wb") as dst:
+            while True:
+                block = src.read(READ_CHUNK)
+                if not block:
+                    break
+                dst.write(comp.compress(block))
+                if throttle is not None:
+                    throttle(len(block))
+            dst.write(comp.flush())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, cold.path)
+        cold.disk_size = os.path.getsize(cold.path)
+        cold.save_index()
+
+        with self._lock:
+            self.segments = [cold if s is seg else s for s in self.segments]
+        self._retire(seg)
+        return cold.disk_size
+
+    def close(self) -> None:
+        with self._lock:
+            for seg in self.segments:
+                if seg.mm is not None:
+                    try:
+                        seg.mm.close()
+                    except BufferError:
+                        pass    # ainda há frames apontando para o mapeamento
+                    seg.mm = None
@@ -0,0 +1,204 @@
+"""
+Modo multiprocesso: um supervisor roda N processos do servidor no host.
+
+Um processo Python usa um núcleo (o GIL é disputado pelo loop de
+atendimento, pela thread de réplica e pela de escrita). Com
+SERVER_PROCESSES=N o main.py vira supervisor e sobe N workers, cada um
+um servidor completo com nome próprio (SERVER_NAME-1..N):
+
+  - todos conectam ao mesmo backend do broker (REP ou DEALER), que
+    reparte os pedidos entre eles como faria entre servidores;
+  - cada um tem o seu store (STORE_DIR por nome) e, com
+    particionamento (PARTITION_RF, padrão 1 aqui), grava só os canais e
+    destinatários da sua partição: os workers não disputam um arquivo;
+  - cada um tem seu relógio lógico; as réplicas e o heartbeat (o
+    supervisor devolve o maior clock que viu entre os workers e o ref)
+    mantêm os domínios alinhados;
+  - o heartbeat dos workers vem ao supervisor (mesmo protocolo do ref),
+    que manda ao ref um heartbeat só com os workers vivos. Worker que
+    morre ou para de responder sai da lista (o ref expira) e é
+    reiniciado.
+
+Rank, lista, sincronização de relógio e eleição continuam direto com o
+ref: cada worker é um membro como outro servidor qualquer.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import zmq
+
+from ref_client import RefClient
+from wire import WallClock
+
+
+def with_port(addr: str, offset: int) -> str:
+    """tcp://host:5570 deslocado: tcp://host:5570+offset."""
+    base, _, port = addr.rpartition(":")
+    return f"{base}:{int(port) + offset}"
+
+
+ts = WallClock().now                 # timestamp físico em ISO (wire.py)
+
+
+class Supervisor:
+    def __init__(self, name: str, processes: int, script: str, ref_addr: str, clock,
+                 heartbeat_s: float = 5.0, peer_bind: str = None, peer_addr: str = None,
+                 metrics_port: int = 0, ref_timeout_ms: float = 1000.0, ref_retries: int = 2,
+                 restart_s: float = 1.0, log=lambda msg, level="info": print(msg)):
+        self.names = [f"{name}-{i + 1}" for i in range(processes)]
+        self.script = script
+        self.clock = clock                   # maior clock visto entre workers e ref
+        self.heartbeat_s = heartbeat_s
+        self.peer_bind = peer_bind
+        self.peer_addr = peer_addr
+        self.metrics_port = metrics_port
+        self.restart_s = restart_s
+        self.log = log
+
+        self.ctx = zmq.Context.instance()
+        self.ref = RefClient(self.ctx, ref_addr, ref_timeout_ms, ref_retries)
+        # só os workers do host falam com o supervisor: porta livre no loopback
+        self.router = self.ctx.socket(zmq.ROUTER)
+        port = self.router.bind_to_random_port("tcp://127.0.0.1")
+        self.endpoint = f"tcp://127.0.0.1:{port}"
+
+        self.procs = {}                      # nome -> Popen
+        self.beats = {}                      # nome -> último heartbeat (monotônico)
+        self.died = {}                       # nome -> quando saiu (para reiniciar)
+        self.version = 0                     # versão da lista no último heartbeat ao ref
+        self.stopping = False
+
+    # ---------------------------
+    # Workers
+    # ---------------------------
+
+    def worker_env(self, i: int) -> dict:
+        name = self.names[i]
+        env = dict(os.environ)
+        env.update({
+            "SERVER_NAME": name,
+            "SERVER_PROCESSES": "1",
+            "HEARTBEAT_ENDPOINT": self.endpoint,
+            "PYTHONUNBUFFERED": "1",
+        })
+        # sem particionamento cada worker gravaria tudo
+        env.setdefault("PARTITION_RF", "1")
+        if os.getenv("STORE_DIR"):
+            env["STORE_DIR"] = os.path.join(os.environ["STORE_DIR"], name)
+        if self.peer_bind:
+            env["PEER_BIND"] = with_port(self.peer_bind, i)
+            env["PEER_ADDR"] = with_port(self.peer_addr, i)
+        if self.metrics_port:
+            env["METRICS_PORT"] = str(self.metrics_port + i)
+        return env
+
+    def spawn(self, i: int) -> None:
+        name = self.names[i]
+        self.procs[name] = subprocess.Popen([sys.executable, self.script], env=self.worker_env(i))
+        self.beats[name] = time.monotonic()   # prazo para o primeiro heartbeat
+        self.died.pop(name, None)
+
+    def check_workers(self, now: float) -> None:
+        """Reinicia (após restart_s) os workers que saíram."""
+        for i, name in enumerate(self.names):
+            code = self.procs[name].poll()
+            if code is None:
+                continue
+            if name not in self.died:
+                self.died[name] = now
+                self.log(f"worker {name} saiu (código {code}); reiniciando em {self.restart_s:.0f}s", "warn")
+            elif now - self.died[name] >= self.restart_s:
+                self.spawn(i)
+
+    def alive(self, now: float) -> list:
+        """Workers com processo de pé e heartbeat recente."""
+        return [n for n, proc in self.procs.items()
+                if proc.poll() is None and now - self.beats.get(n, 0) <= 3 * self.heartbeat_s]
+
+    def stop_workers(self) -> None:
+        for proc in self.procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self.procs.values():
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    # ---------------------------
+    # Heartbeats (workers -> supervisor -> ref)
+    # ---------------------------
+
+    def report(self, now: float) -> None:
+        """Um heartbeat ao ref por todos os workers vivos."""
+        try:
+            reply = self.ref.request({"service": "heartbeat", "data": {
+                "users": self.alive(now),
+                "timestamp": ts(),
+                "clock": self.clock.tick(),
+            }})
+        except TimeoutError:
+            self.log("ref sem resposta ao heartbeat agregado", "warn")
+            return
+        data = reply.get("data") or {}
+        self.version = data.get("version", self.version)
+        self.clock.observe(data.get("clock", 0))
+
+    def serve_worker(self, frames) -> None:
+        envelope, body = frames[:-1], frames[-1]
+        try:
+            msg = json.loads(body)
+            service, data = msg.get("service"), msg.get("data") or {}
+        except (ValueError, AttributeError):
+            service, data = None, {}
+
+        # como no ref: um pedido inválido vira resposta de erro, sem
+        # derrubar o supervisor (e, com ele, todos os workers)
+        try:
+            self.clock.observe(data.get("clock", 0))
+            user = data.get("user")
+            if service == "heartbeat" and isinstance(user, str) and user in self.procs:
+                self.beats[user] = time.monotonic()
+                rdata = {"version": self.version, "timestamp": ts()}
+            else:
+                rdata = {"status": "erro", "message": "serviço desconhecido", "timestamp": ts()}
+        except Exception as e:
+            rdata = {"status": "erro", "message": f"requisição inválida: {e}", "timestamp": ts()}
+        rdata["clock"] = self.clock.tick()
+        self.router.send_multipart(envelope + [json.dumps({"service": service, "data": rdata}).encode("utf-8")])
+
+    # ---------------------------
+    # Loop
+    # ---------------------------
+
+    def _on_signal(self, signum, frame) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        # versão da lista antes dos workers perguntarem por ela
+        self.report(time.monotonic())
+        for i in range(len(self.names)):
+            self.spawn(i)
+        self.log(f"supervisor com {len(self.names)} workers: {', '.join(self.names)}")
+
+        next_report = time.monotonic() + self.heartbeat_s
+        try:
+            while not self.stopping:
+                if self.router.poll(200):
+                    self.serve_worker(self.router.recv_multipart())
+                now = time.monotonic()
+                self.check_workers(now)
+                if now >= next_report:
+                    self.report(now)
+                    next_report = now + self.heartbeat_s
+        finally:
+            self.stop_workers()
+            self.ref.close()
+            self.router.close(0)
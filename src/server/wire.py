@@ -0,0 +1,141 @@
+"""
+Caminho rápido das respostas: timestamp em cache, Packer reaproveitado
+e partes fixas das respostas já codificadas.
+
+Cada requisição formatava o timestamp ISO com datetime (uma ou mais
+vezes), montava o dict {"service", "data"} e criava um Packer novo em
+msgpack.packb. Aqui:
+
+  - WallClock.now(): o texto ISO é refeito no máximo uma vez por
+    `resolution` segundos; sob carga, todas as requisições de um mesmo
+    lote/milissegundo recebem o mesmo texto (é só o carimbo físico
+    exibido; a ordem vem do clock lógico);
+  - packb(): um msgpack.Packer por thread, reaproveitado;
+  - ReplyTemplates: as respostas {status, message, timestamp, clock} de
+    cada (serviço conhecido, status, mensagem fixa) têm o começo
+    codificado uma vez; por resposta só se codificam o timestamp e o
+    clock;
+  - splice(): resposta com uma lista de registros que já estão em
+    MessagePack (do log ou do cache), emendados sem decodificar.
+
+Uso:
+    wall = WallClock(0.001)
+    replies = ReplyTemplates(("publish",))
+    reply = replies.encode("publish", "OK", "", wall.now(), clock)
+    sock.send(reply.raw)
+"""
+import threading
+import time
+
+import msgpack
+
+_time = time.time
+_local = threading.local()
+
+
+class WallClock:
+    __slots__ = ("resolution", "_cached")
+
+    def __init__(self, resolution: float = 0.001):
+        self.resolution = max(0.0, float(resolution))
+        self._cached = (0.0, "")          # (válido até, texto ISO)
+
+    def now(self) -> str:
+        """Timestamp físico em ISO (UTC, microssegundos, sufixo Z)."""
+        t = _time()
+        until, text = self._cached
+        if t < until:
+            return text
+        whole = int(t)
+        text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(whole)) + ".%06dZ" % int((t - whole) * 1e6)
+        # troca da tupla inteira: threads concorrentes nunca veem meio valor
+        self._cached = (t + self.resolution, text)
+        return text
+
+
+def _packer() -> msgpack.Packer:
+    try:
+        return _local.packer
+    except AttributeError:
+        packer = _local.packer = msgpack.Packer(use_bin_type=True)
+        return packer
+
+
+def packb(obj) -> bytes:
+    """msgpack.packb(obj, use_bin_type=True) com o Packer da thread."""
+    return _packer().pack(obj)
+
+
+class PackedReply:
+    """Resposta {"service", "data"} já codificada em MessagePack."""
+
+    __slots__ = ("raw", "status")
+
+    def __init__(self, raw: bytes, status: str):
+        self.raw = raw
+        self.status = status
+
+
+def _header(n: int, fix: int, b16: int) -> bytes:
+    """Cabeçalho MessagePack de map (0x80) ou array (0x90) com n itens."""
+    if n < 16:
+        return bytes((fix | n,))
+    if n < 0x10000:
+        return bytes((b16,)) + n.to_bytes(2, "big")
+    return bytes((b16 + 1,)) + n.to_bytes(4, "big")
+
+
+def splice(service, data: dict, key: str, items: list) -> PackedReply:
+    """
+    {"service": service, "data": {**data, key: [items]}} codificada, com
+    `items` já em MessagePack (bytes ou memoryview), copiados uma vez só.
+    """
+    pack = _packer().pack
+    parts = [b"\x82", pack("service"), pack(service), pack("data"), _header(len(data) + 1, 0x80, 0xde)]
+    for k, v in data.items():
+        parts.append(pack(k))
+        parts.append(pack(v))
+    parts.append(pack(key))
+    parts.append(_header(len(items), 0x90, 0xdc))
+    parts.extend(items)
+    return PackedReply(b"".join(parts), data.get("status"))
+
+
+class ReplyTemplates:
+    """
+    Prefixos codificados de {"service": s, "data": {"status", "message",
+    "timestamp", "clock"}}. Só entram no cache os serviços de `services`
+    e as mensagens fixas: o serviço vem do cliente e mensagens variáveis
+    (com o texto de uma exceção) usam cache=False. O resto é codificado
+    inteiro, sem entrar no cache; `max_entries` é só um teto.
+    """
+
+    def __init__(self, services, max_entries: int = 1024):
+        self.services = frozenset(services)
+        self.max_entries = max_entries
+        self._prefixes = {}               # (serviço, status, mensagem) -> bytes
+        self._clock_key = msgpack.packb("clock", use_bin_type=True)
+        self._last_ts = (None, b"")       # o timestamp em cache se repete
+
+    def _prefix(self, service, status: str, message: str, cache: bool) -> bytes:
+        prefix = b"".join((
+            b"\x82", packb("service"), packb(service), packb("data"),
+            b"\x84", packb("status"), packb(status), packb("message"), packb(message),
+            packb("timestamp"),
+        ))
+        if cache and len(self._prefixes) < self.max_entries:
+            self._prefixes[(service, status, message)] = prefix
+        return prefix
+
+    def encode(self, service, status: str, message: str, timestamp, clock: int,
+               cache: bool = True) -> PackedReply:
+        pack = _packer().pack
+        # type() antes do `in`: lista ou dict no frozenset levantaria TypeError
+        cache = cache and type(service) is str and service in self.services
+        prefix = (cache and self._prefixes.get((service, status, message))) \
+            or self._prefix(service, status, message, cache)
+        last, packed_ts = self._last_ts
+        if timestamp is not last:
+            packed_ts = pack(timestamp)
+            self._last_ts = (timestamp, packed_ts)
+        return PackedReply(prefix + packed_ts + self._clock_key + pack(clock), status)